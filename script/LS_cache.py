@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+    Derivation Cache Module:    <LS_cache.py>
+
+    Deriving the same preset at the same depth over and over again gives the same string every time (as long as the seed
+    is the same, see LS_string_rewriting), so there is no point in rewriting it from scratch. This module keeps derived
+    strings on disk, compressed with zlib, in a file named after the SHA-1 of everything the string depends on: the axiom,
+    the rules, the depth and the seed. The seed is left out for grammars without random choices, as it makes no difference
+    to them.
+
+    The cache has a size cap. Every time a string is read its file is touched, so the modification times say which ones
+    were used last, and when the cap is exceeded the least recently used ones are deleted. The cache is never an error:
+    if anything goes wrong reading or writing it, the string is just derived again.
+
+        >>> cache = DerivationCache("/tmp/LS_cache_example")
+        >>> cachedWriteLS("F", [[100, "F", "F[+F]F"]], 3, cache=cache)
+        'F[+F]F[+F[+F]F]F[+F]F[+F[+F]F[+F[+F]F]F[+F]F]F[+F]F[+F[+F]F]F[+F]F'
+        >>> cache.get(cache.key("F", [[100, "F", "F[+F]F"]], 3)) is not None
+        True
+"""
+import os
+import zlib
+import time
+import hashlib
+import tempfile
+
+from LS_string_rewriting import writeLS, writeLSBuffer, streamLS, compileRules, Grammar, SymbolBuffer
+
+CACHE_VERSION = 1                   # Changes whenever the derivations would change, so that old files are not used
+CACHE_SIZE = 512 * 1024 * 1024      # Bytes on disk before the least recently used strings are deleted
+CACHE_EXTENSION = ".lsz"
+TEMPORARY_EXTENSION = ".tmp"
+TEMPORARY_AGE = 3600                # Seconds after which a temporary file is taken as left behind by a killed process
+READ_BLOCK = 1024 * 1024            # Bytes compressed or decompressed at a time for SymbolBuffers
+
+def defaultDirectory():
+    """ Folder of the cache: the LSYSTEMS_CACHE environment variable, or .lsystems_cache in the home folder. """
+    return os.environ.get("LSYSTEMS_CACHE") or os.path.join(os.path.expanduser("~"), ".lsystems_cache")
+
+class DerivationCache(object):
+    """ Derived strings stored on disk.
+
+        directory :  Folder the strings are kept in, created if needed. defaultDirectory() if None.
+        maxBytes :   Size cap of the folder.
+    """
+    def __init__(self, directory=None, maxBytes=CACHE_SIZE):
+        self.directory = directory or defaultDirectory()
+        self.maxBytes = maxBytes
+
+    def key(self, pW, pP, pDepth, seed=None):
+        """ Name of the derivation in the cache, or None if it can't be cached (rules given as a Grammar). """
+        if isinstance(pP, Grammar):
+            return None
+        rules = [(float(prob), str(pred), str(succ)) for prob, pred, succ in pP]
+        if compileRules(pP).isDeterministic():
+            seed = None
+        content = repr((CACHE_VERSION, str(pW), rules, int(pDepth), seed))
+        return hashlib.sha1(content).hexdigest()
+
+    def path(self, pKey):
+        return os.path.join(self.directory, pKey + CACHE_EXTENSION)
+
+    def get(self, pKey, compact=False):
+        """ Returns the string stored with that key, or None if there isn't any. If compact is True it is returned as a
+        SymbolBuffer (see LS_string_rewriting), decompressed into it a block at a time. """
+        if pKey is None:
+            return None
+        path = self.path(pKey)
+        try:
+            with open(path, "rb") as stored:
+                if compact:
+                    value = SymbolBuffer()
+                    decompressor = zlib.decompressobj()
+                    for block in iter(lambda: stored.read(READ_BLOCK), ""):
+                        value.append(decompressor.decompress(block))
+                    value.append(decompressor.flush())
+                    value.finish()
+                else:
+                    value = zlib.decompress(stored.read())
+            os.utime(path, None) # It was just used
+        except (IOError, OSError, zlib.error):
+            return None
+        return value
+
+    def put(self, pKey, pValue):
+        """ Stores the string (or SymbolBuffer, compressed from its memory a view at a time) and deletes the oldest ones if
+        the cache gets too big. """
+        if pKey is None:
+            return
+        temporary = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written to a temporary file first, so that nobody ever reads half a file. On POSIX the rename replaces the
+            # old file in one go, even if another process is writing the same key, but Windows won't rename onto it.
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=TEMPORARY_EXTENSION)
+            with os.fdopen(handle, "wb") as stored:
+                if isinstance(pValue, SymbolBuffer):
+                    compressor = zlib.compressobj(1)
+                    for start in range(0, len(pValue), READ_BLOCK):
+                        stored.write(compressor.compress(pValue.view(start, start+READ_BLOCK)))
+                    stored.write(compressor.flush())
+                else:
+                    stored.write(zlib.compress(pValue, 1))
+            if os.name == "nt" and os.path.exists(self.path(pKey)):
+                os.remove(self.path(pKey))
+            os.rename(temporary, self.path(pKey))
+            temporary = None
+            self.evict()
+        except (IOError, OSError):
+            pass
+        finally:
+            if temporary is not None: # Never leave it behind, nothing would ever delete it
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+
+    def entries(self):
+        """ Returns a list of (modification time, size, path) of the stored strings, oldest first. """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_EXTENSION):
+                path = os.path.join(self.directory, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """ Deletes the least recently used strings until the cache fits in maxBytes, and the temporary files of processes
+        that were killed while writing. """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if name.endswith(TEMPORARY_EXTENSION):
+                path = os.path.join(self.directory, name)
+                try:
+                    if now - os.path.getmtime(path) > TEMPORARY_AGE:
+                        os.remove(path)
+                except OSError:
+                    pass
+        entries = self.entries()
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """ Deletes every stored string. """
+        if os.path.isdir(self.directory):
+            for mtime, size, path in self.entries():
+                os.remove(path)
+
+_defaultCache = None
+
+def defaultCache():
+    """ The cache used when none is given, in defaultDirectory(). """
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = DerivationCache()
+    return _defaultCache
+
+def streamWithProgress(pChunks, progress):
+    """ Joins the chunks of LS_string_rewriting.streamLS, calling progress with the number of symbols joined so far after
+    every one of them. """
+    pieces = []
+    size = 0
+    for chunk in pChunks:
+        pieces.append(chunk)
+        size += len(chunk)
+        progress(size)
+    return "".join(pieces)
+
+def cachedWriteLS(pW, pP, pDepth, seed=None, cache=None, progress=None, compact=False):
+    """ Same as LS_string_rewriting.writeLS, but the string is taken from the cache if it was derived before, and stored
+    in it otherwise. Without a seed a random derivation can't be repeated, so it is not cached. If the string has to be
+    derived and progress is given, it is called with the number of symbols derived so far every now and then. With
+    compact the string is a SymbolBuffer from start to end (writeLSBuffer), never a str.
+
+        >>> str(cachedWriteLS("F", [[100, "F", "F[+F]F"]], 3, cache=DerivationCache("/tmp/LS_cache_example"),
+        ...     compact=True)) == writeLS("F", [[100, "F", "F[+F]F"]], 3)
+        True
+    """
+    if cache is None:
+        cache = defaultCache()
+    key = None
+    if seed is not None or (not isinstance(pP, Grammar) and compileRules(pP).isDeterministic()):
+        key = cache.key(pW, pP, pDepth, seed)
+    LStringVar = cache.get(key, compact)
+    if LStringVar is None:
+        if compact:
+            LStringVar = writeLSBuffer(pW, pP, pDepth, seed=seed, progress=progress)
+        elif progress is None:
+            LStringVar = writeLS(pW, pP, pDepth, seed=seed)
+        else:
+            LStringVar = streamWithProgress(streamLS(pW, pP, pDepth, seed=seed), progress)
+        cache.put(key, LStringVar)
+    return LStringVar
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+    Mesh Export Module:    <LS_export.py>
+
+    Writes a plant straight to an OBJ or a binary PLY file from the headless pipeline (LS_string_rewriting, LS_turtle and
+    LS_mesh), so that plants can be made on machines without Maya. The mesh is never held whole in memory: it is built
+    and written a chunk of segments at a time.
+
+    OBJ is text, and formatting millions of numbers one by one is what makes exporters slow. Here every chunk is
+    formatted with a single '%' operation over a format string made for the whole chunk, which Python does in C. PLY is
+    binary: with NumPy every chunk is laid out as the bytes of the file in bulk and written with a single tofile, and
+    without it with array.tofile and a bit of byte slicing. As the PLY header needs the number of vertices and faces, which
+    are only known at the end, the vertices and faces are written to two temporary files that are then copied behind it.
+
+    The leaf and blossom geometry lives in Maya files (leaf_geo.mb and blossom_geo.mb) which can't be read without Maya,
+    so here they are replaced with simple procedural shapes: a leaf is a diamond and a blossom a small star, placed,
+    rotated and scaled like the turtle says.
+
+        >>> from LS_turtle import interpretTurtle
+        >>> turtle = interpretTurtle("F[+FL]FB", 0.2, 1.2, 25.2, 0.95, 0.85, seed=1)
+        >>> exportMesh(turtle, "/tmp/plant.obj", 5)
+        (44, 29)
+"""
+import os
+import sys
+import shutil
+import tempfile
+from array import array
+
+from LS_turtle import eulerMatrix
+from LS_mesh import MeshData, buildBranchMesh, buildTubeMesh, branchChains, numpy
+
+EXPORT_CHUNK = 20000    # Segments (or leaves, or blossoms) built and written at a time
+
+#--- LEAF AND BLOSSOM SHAPES ---#
+# Points (x, y, z) and faces of the shapes, as big as a leaf or blossom of scale 1. They grow along Y, like the segments.
+LEAF_SHAPE = ((0.0, 0.0, 0.0, 1.0, 1.5, 0.0, 0.0, 4.0, 0.0, -1.0, 1.5, 0.0), ((0, 1, 2, 3),))
+BLOSSOM_SHAPE = ((0.0, 0.0, 0.0, 0.0, 0.5, 0.0,
+                  1.5, 0.5, 0.0, 0.4, 0.5, 0.4, 0.0, 0.5, 1.5, -0.4, 0.5, 0.4,
+                  -1.5, 0.5, 0.0, -0.4, 0.5, -0.4, 0.0, 0.5, -1.5, 0.4, 0.5, -0.4),
+                 ((0, 1, 5, 3), (0, 1, 9, 7), (1, 3, 2), (1, 5, 4), (1, 7, 6), (1, 9, 8), (1, 3, 5, 7, 9)))
+
+def _multiply(a, b):
+    """ Product of two row-major 3x3 matrices. """
+    return tuple(a[3*row] * b[col] + a[3*row+1] * b[3+col] + a[3*row+2] * b[6+col] for row in range(3) for col in range(3))
+
+def buildPropMesh(pShape, positions, rotations, scales, spins=None, indices=None):
+    """ Builds the leaves or the blossoms of a plant as one mesh, copying a shape to every one of them.
+
+    pShape :                       LEAF_SHAPE, BLOSSOM_SHAPE or any (points, faces) like them.
+    positions, rotations, scales : Flat arrays of the turtle (leafPosition, leafRotation, leafScale...).
+    spins :                        Extra rotation of every prop in its own space (leafSpin), or None.
+    indices :                      Props to build, all of them if None.
+
+    On Exit :  Returns a MeshData.
+    """
+    shapePoints, shapeFaces = pShape
+    if indices is None:
+        indices = range(len(scales))
+    if numpy is not None and len(indices):
+        return _buildPropMeshNumpy(pShape, positions, rotations, scales, spins, indices)
+    mesh = MeshData()
+    for i in indices:
+        matrix = eulerMatrix(*rotations[3*i:3*i+3])
+        if spins is not None:
+            matrix = _multiply(matrix, eulerMatrix(*spins[3*i:3*i+3]))
+        pX, pY, pZ = positions[3*i:3*i+3]
+        scale = scales[i]
+        first = mesh.vertexCount()
+        for k in range(0, len(shapePoints), 3):
+            x, y, z = shapePoints[k] * scale, shapePoints[k+1] * scale, shapePoints[k+2] * scale
+            mesh.points.extend((pX + matrix[0]*x + matrix[1]*y + matrix[2]*z,
+                                pY + matrix[3]*x + matrix[4]*y + matrix[5]*z,
+                                pZ + matrix[6]*x + matrix[7]*y + matrix[8]*z))
+        for face in shapeFaces:
+            mesh.faceConnects.extend([first + k for k in face])
+            mesh.faceCounts.append(len(face))
+    return mesh
+
+def _buildPropMeshNumpy(pShape, positions, rotations, scales, spins, indices):
+    """ NumPy version of buildPropMesh, all the props at once. """
+    shapePoints, shapeFaces = pShape
+    matrices = numpy.array([eulerMatrix(*rotations[3*i:3*i+3]) for i in indices]).reshape(-1, 3, 3)
+    if spins is not None:
+        spinMatrices = numpy.array([eulerMatrix(*spins[3*i:3*i+3]) for i in indices]).reshape(-1, 3, 3)
+        matrices = (matrices[:, :, 0, None] * spinMatrices[:, None, 0, :] + matrices[:, :, 1, None] *
+                    spinMatrices[:, None, 1, :] + matrices[:, :, 2, None] * spinMatrices[:, None, 2, :])
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    origin = numpy.frombuffer(positions, dtype=numpy.float64).reshape(-1, 3)[indices]
+    scale = numpy.frombuffer(scales, dtype=numpy.float64)[indices]
+    shape = numpy.array(shapePoints).reshape(-1, 3)
+    local = shape[None, :, :] * scale[:, None, None]
+    x, y, z = local[:, :, 0], local[:, :, 1], local[:, :, 2]
+    points = numpy.stack([origin[:, None, row] + matrices[:, None, row, 0] * x + matrices[:, None, row, 1] * y +
+                          matrices[:, None, row, 2] * z for row in range(3)], axis=2)
+
+    faces = [len(face) for face in shapeFaces]
+    template = numpy.array([k for face in shapeFaces for k in face])
+    firsts = numpy.arange(len(indices)) * len(shape)
+    mesh = MeshData()
+    mesh.points.fromstring(points.tostring())
+    mesh.faceCounts.fromstring(numpy.tile(numpy.array(faces, dtype=mesh.faceCounts.typecode), len(indices)).tostring())
+    mesh.faceConnects.fromstring((firsts[:, None] + template).astype(mesh.faceConnects.typecode).tostring())
+    return mesh
+
+def iterMeshChunks(turtle, subDivs, mode="merged", lod=None, props=True, chunkSize=EXPORT_CHUNK):
+    """ Builds the plant a chunk at a time.
+
+    turtle :     TurtleResult of the plant (see LS_turtle.interpretTurtle).
+    subDivs :    Number of sides of the branches.
+    mode :       "merged" for a cylinder per segment or "tubes" for continuous tubes (see LS_mesh).
+    lod :        LODPolicy for the branches, or None. It is fitted to the turtle here.
+    props :      Whether the leaves and blossoms are exported.
+    chunkSize :  Segments, leaves or blossoms per chunk.
+
+    On Exit :    Yields 2-item tuples: the name of the group ("branches", "leaves" or "blossoms") and a MeshData.
+    """
+    if lod is not None:
+        lod.fit(turtle)
+    if mode == "tubes":
+        chains = []
+        weight = 0
+        for chain in branchChains(turtle):
+            chains.append(chain)
+            weight += len(chain)
+            if weight >= chunkSize:
+                yield "branches", buildTubeMesh(turtle, subDivs, lod, chains)
+                chains = []
+                weight = 0
+        if chains:
+            yield "branches", buildTubeMesh(turtle, subDivs, lod, chains)
+    else:
+        for start in range(0, turtle.segmentCount(), chunkSize):
+            segments = range(start, min(start + chunkSize, turtle.segmentCount()))
+            yield "branches", buildBranchMesh(turtle, subDivs, segments, lod)
+    if not props:
+        return
+    for start in range(0, turtle.leafCount(), chunkSize):
+        yield "leaves", buildPropMesh(LEAF_SHAPE, turtle.leafPosition, turtle.leafRotation, turtle.leafScale,
+            turtle.leafSpin, range(start, min(start + chunkSize, turtle.leafCount())))
+    for start in range(0, turtle.blossomCount(), chunkSize):
+        yield "blossoms", buildPropMesh(BLOSSOM_SHAPE, turtle.blossomPosition, turtle.blossomRotation,
+            turtle.blossomScale, None, range(start, min(start + chunkSize, turtle.blossomCount())))
+
+#--- WRITERS ---#
+class ObjWriter(object):
+    """ Writes meshes one after the other to a Wavefront OBJ file. Every chunk becomes a group. """
+    def __init__(self, pFileName):
+        self.file = open(pFileName, "w")
+        self.file.write("# L-System plant\n")
+        self.vertexCount = 0
+        self.faceCount = 0
+        self.group = None
+        self.faceFormats = {}
+
+    def write(self, pGroup, pMesh):
+        if pGroup != self.group:
+            self.file.write("g %s\n" % pGroup)
+            self.group = pGroup
+        # A single format string for the whole chunk, so that Python formats all the numbers in one go
+        self.file.write(("v %.6g %.6g %.6g\n" * pMesh.vertexCount()) % tuple(pMesh.points))
+        faceFormat = []
+        for count in pMesh.faceCounts:
+            if count not in self.faceFormats:
+                self.faceFormats[count] = "f" + " %d" * count + "\n"
+            faceFormat.append(self.faceFormats[count])
+        offset = self.vertexCount + 1 # OBJ counts vertices from 1, and for the whole file
+        if numpy is not None:
+            indices = tuple((numpy.frombuffer(pMesh.faceConnects, dtype=pMesh.faceConnects.typecode) + offset).tolist())
+        else:
+            indices = tuple([index + offset for index in pMesh.faceConnects])
+        self.file.write("".join(faceFormat) % indices)
+        self.vertexCount += pMesh.vertexCount()
+        self.faceCount += pMesh.faceCount()
+
+    def close(self):
+        self.file.close()
+
+class PlyWriter(object):
+    """ Writes meshes one after the other to a binary (little endian) PLY file. Vertices are written as floats and faces
+    as a byte with the number of vertices followed by their indices as ints. """
+    def __init__(self, pFileName):
+        self.fileName = pFileName
+        self.vertexFile = tempfile.TemporaryFile()
+        self.faceFile = tempfile.TemporaryFile()
+        self.vertexCount = 0
+        self.faceCount = 0
+        self.swap = sys.byteorder != "little"
+
+    def write(self, pGroup, pMesh):
+        if numpy is not None:
+            self.writeNumpy(pMesh)
+            return
+        points = array("f", pMesh.points)
+        if self.swap:
+            points.byteswap()
+        points.tofile(self.vertexFile)
+
+        # Every face is its count followed by its indices. Both go in an int array, and then the counts are squeezed
+        # into a single byte by writing the bytes in between.
+        faces = array("i")
+        position = 0
+        offset = self.vertexCount
+        connects = pMesh.faceConnects
+        for count in pMesh.faceCounts:
+            faces.append(count)
+            faces.extend([index + offset for index in connects[position:position+count]])
+            position += count
+        if self.swap:
+            faces.byteswap()
+        data = faces.tostring()
+        pieces = []
+        position = 0
+        size = faces.itemsize
+        for count in pMesh.faceCounts:
+            pieces.append(data[position:position+1])
+            pieces.append(data[position+size:position+size*(count+1)])
+            position += size * (count + 1)
+        self.faceFile.write("".join(pieces))
+        self.vertexCount += pMesh.vertexCount()
+        self.faceCount += pMesh.faceCount()
+
+    def writeNumpy(self, pMesh):
+        """ Same as write, laying out the bytes of the whole chunk with NumPy and writing them at once. """
+        numpy.frombuffer(pMesh.points, dtype=numpy.float64).astype("<f4").tofile(self.vertexFile)
+        counts = numpy.frombuffer(pMesh.faceCounts, dtype=pMesh.faceCounts.typecode)
+        connects = numpy.frombuffer(pMesh.faceConnects, dtype=pMesh.faceConnects.typecode).astype("<i4") + self.vertexCount
+        # Every face takes a byte for its count and 4 per index, so the index j of face f starts at byte f + 1 + 4*j
+        data = numpy.empty(len(counts) + 4 * len(connects), dtype=numpy.uint8)
+        before = numpy.cumsum(counts) - counts # Indices of the faces before each one
+        data[numpy.arange(len(counts)) + 4 * before] = counts
+        starts = numpy.repeat(numpy.arange(len(counts)), counts) + 1 + 4 * numpy.arange(len(connects))
+        data[(starts[:, None] + numpy.arange(4)).ravel()] = connects.view(numpy.uint8)
+        data.tofile(self.faceFile)
+        self.vertexCount += pMesh.vertexCount()
+        self.faceCount += pMesh.faceCount()
+
+    def close(self):
+        output = open(self.fileName, "wb")
+        output.write("ply\nformat binary_little_endian 1.0\ncomment L-System plant\n"
+                     "element vertex %s\nproperty float x\nproperty float y\nproperty float z\n"
+                     "element face %s\nproperty list uchar int vertex_indices\nend_header\n"
+                     % (self.vertexCount, self.faceCount))
+        for temporary in (self.vertexFile, self.faceFile):
+            temporary.seek(0)
+            shutil.copyfileobj(temporary, output, 1 << 20)
+            temporary.close()
+        output.close()
+
+WRITERS = { ".obj": ObjWriter, ".ply": PlyWriter }
+
+def exportMesh(turtle, pFileName, subDivs, mode="merged", lod=None, props=True, chunkSize=EXPORT_CHUNK):
+    """ Writes the plant to pFileName. The format is chosen from its extension, .obj or .ply. The rest of the arguments
+    are the same as iterMeshChunks'.
+
+    On Exit :  Returns a 2-item tuple with the number of vertices and faces written.
+    """
+    extension = os.path.splitext(pFileName)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError("Can't export to '%s', the file has to be %s." % (pFileName, " or ".join(sorted(WRITERS))))
+    writer = WRITERS[extension](pFileName)
+    try:
+        for group, mesh in iterMeshChunks(turtle, subDivs, mode, lod, props, chunkSize):
+            writer.write(group, mesh)
+    finally:
+        writer.close()
+    return writer.vertexCount, writer.faceCount
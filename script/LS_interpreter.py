@@ -25,14 +25,21 @@
         ]    Pop the current turtle state from the stack
 
         The rest of letters (AaCcDdEeGgHhIiJjKkMmNnOoPpQqRrSsTtUuVvXxYyZz) will be interpreted as move forward as well.
+
+    Strings derived from parametric rules (see LS_string_rewriting) carry parameters in brackets. A forward move with a
+    parameter, F(2), draws a segment that many times the segment length, and a rotation with a parameter, +(10), rotates
+    that many degrees instead of the angle set in the interface.
     
-    The position and rotation are stored as parameters of the object instance, so that it is easily accessible. Both
-    position and rotation will be updated each time a character is read. 
+    The turtle itself lives in LS_turtle, which works out the position and rotation of everything without Maya. This
+    module builds the geometry from its result.
 """
 import maya.cmds as cmds
-import random
-import copy
 import time
+from LS_string_rewriting import symbolCounts, BudgetError
+from LS_turtle import interpretTurtle, BracketError, collapseForwardRuns, TurtleResult
+from LS_mesh import buildBranchMesh, buildBranchMeshesByLevel, buildTubeMesh, branchChains, LODPolicy
+
+MAX_SCENE_NODES = 60000     # Most objects (segments, leaves and blossoms) createGeometry builds for a plant, None is no limit
 
 #--- SHADER AND MATERIALS DEFINITIONS ---#
 def createBranchShader(rgb_branch):
@@ -113,24 +120,54 @@ def createBlossomShader(rgb_blossom):
         name='blossomPedicelSG'+str(globalVar.plantNumber) )
     cmds.connectAttr( blossomPedicelMat + '.outColor', blossomPedicelSG + '.surfaceShader', f=True )
 
-def applyShader(geometricObj, materialType):
-
+def applyShader(geometricObj, materialType, plantNumber=None):
+    """ Assigns the material of the current plant (or of the plant number given) to an object, a list of objects or
+    faces. """
     import globalVar
     reload(globalVar)
+    if plantNumber is None:
+        plantNumber = globalVar.plantNumber
 
     if materialType == 'branch':
-        cmds.sets( geometricObj, fe='branchSG'+str(globalVar.plantNumber) )
+        cmds.sets( geometricObj, fe='branchSG'+str(plantNumber) )
     if materialType == 'leaf':
-        cmds.sets( geometricObj, fe='leafSG'+str(globalVar.plantNumber) )
+        cmds.sets( geometricObj, fe='leafSG'+str(plantNumber) )
     if materialType == 'blossomPetals':
-        cmds.sets( geometricObj, fe='blossomPetalsSG'+str(globalVar.plantNumber) )
+        cmds.sets( geometricObj, fe='blossomPetalsSG'+str(plantNumber) )
     if materialType == 'blossomStamen':
-        cmds.sets( geometricObj, fe='blossomStamenSG'+str(globalVar.plantNumber) )
+        cmds.sets( geometricObj, fe='blossomStamenSG'+str(plantNumber) )
     if materialType == 'blossomPedicel':
-        cmds.sets( geometricObj, fe='blossomPedicelSG'+str(globalVar.plantNumber) )
+        cmds.sets( geometricObj, fe='blossomPedicelSG'+str(plantNumber) )
     
+class ShaderBatch(object):
+    """ Collects what has to be shaded with each material while the plant is being built, so that every material is
+    assigned with a single sets command at the end instead of one per object. The materials are the ones of the current
+    plant, or of plantNumber if it is given.
+
+        >>> shaders = ShaderBatch()
+        >>> shaders.add("leaf_1_1", "leaf")
+        >>> shaders.add("leaf_1_2", "leaf")
+        >>> shaders.members
+        {'leaf': ['leaf_1_1', 'leaf_1_2']}
+    """
+    def __init__(self, plantNumber=None):
+        self.plantNumber = plantNumber
+        self.members = {}
+
+    def add(self, geometricObj, materialType):
+        self.members.setdefault(materialType, []).append(geometricObj)
+
+    def assign(self):
+        for materialType, members in self.members.items():
+            applyShader(members, materialType, self.plantNumber)
+        self.members = {}
+
+# The blossom template is made of a pedicel, the stamen and the petals, in this order
+BLOSSOM_PEDICEL_FACES = (0, 49)
+BLOSSOM_STAMEN_FACES = (50, 109)
+
 def makeSegment(pRad, pStep, posX, posY, posZ, rotX, rotY, rotZ, subDivs, indexBranch, length_atenuation,
-    radius_atenuation, rgb_branch, segmentNum):
+    radius_atenuation, rgb_branch, segmentNum, shaders=None, plant=None):
     """ Creates a step, a cylinder, representing a brach segment of the actual L-System.
 
         pRad :    Axiom, the initial state.
@@ -151,12 +188,17 @@ def makeSegment(pRad, pStep, posX, posY, posZ, rotX, rotY, rotZ, subDivs, indexB
                               the segment is located in the same branch level as the previous one it will have the
                               dimensions of the previous one. This scales depending on which branch level you are.
         rgb_branch:    Colour information which will be applied to a material that will shade the branches.
+        shaders:       ShaderBatch the segment is added to. If None the material is assigned straight away.
+        plant:         Group of the plant the segment goes in, the current plant's if None.
 
-        On Exit : It will have created the geometry AND IT RETURNS THE POSITION OF THE LAST VERTEX.
+        On Exit : It will have created the geometry and returns its name. It used to return the last vertex so that we
+                  could ask Maya where the segment ended, LS_turtle works that out on its own now.
     """
     import globalVar
     reload(globalVar)
-    branchGeo = cmds.polyCylinder ( n='segment'+str(globalVar.plantNumber)+'_'+str(indexBranch)+'_'+str(segmentNum),r=pRad,
+    if plant is None:
+        plant = 'plant' + str(globalVar.plantNumber)
+    branchGeo = cmds.polyCylinder ( n='segment'+plantTag(plant)+'_'+str(indexBranch)+'_'+str(segmentNum),r=pRad,
         h=pStep, sx=subDivs, sy=1, sz=1, ax=[0, 1, 0] )[0]
     print branchGeo, 'has been created.'
 
@@ -171,17 +213,216 @@ def makeSegment(pRad, pStep, posX, posY, posZ, rotX, rotY, rotZ, subDivs, indexB
     cmds.xform( ro=[rotX, rotY, rotZ], os=True )
 
     #--- Apply shader to the branch ---#
-    applyShader(branchGeo, 'branch')
+    if shaders is None:
+        applyShader(branchGeo, 'branch')
+    else:
+        shaders.add(branchGeo, 'branch')
 
     # TO DO: PARENT THIS BRANCH TO ITS DAD
-    cmds.parent( branchGeo, 'plant' + str(globalVar.plantNumber ))
-    return cmds.polyEvaluate( v = True ) # Returns the position of the last vertex which will be the origin for next segment
+    cmds.parent( branchGeo, plant )
+    return branchGeo
+
+def plantTag(pPlant):
+    """ What the names of the objects of a plant go by: '3' for plant3, so that they read segment3_..., leaf_3_... """
+    if pPlant.startswith("plant"):
+        return pPlant[len("plant"):]
+    return pPlant
+
+def pointArray(pPoints):
+    """ Turns a flat array of x, y, z values into an MPointArray. """
+    import maya.api.OpenMaya as om
+    return om.MPointArray([om.MPoint(pPoints[i], pPoints[i+1], pPoints[i+2]) for i in range(0, len(pPoints), 3)])
+
+def branchMeshData(turtle, subDivs, lod, pKind, pPart):
+    """ Builds one of the branch meshes createGeometry makes, from what it recorded about it (see PlantSession.built).
+
+        pKind :   "segments", "chains" or "level".
+        pPart :   The segments, the chains or the branch level it is made of.
+    """
+    if pKind == "chains":
+        return buildTubeMesh(turtle, subDivs, lod, pPart)
+    if pKind == "level":
+        return buildBranchMesh(turtle, subDivs, [i for i, level in enumerate(turtle.segmentLevel) if level == pPart], lod)
+    return buildBranchMesh(turtle, subDivs, pPart, lod)
+
+def makeBranchMesh(pMesh, pName, shaders=None, plant=None):
+    """ Creates the mesh built by LS_mesh in one go and parents it to the plant.
+
+        pMesh :   MeshData with the points and faces of the branches.
+        pName :   Name of the new mesh.
+        shaders : ShaderBatch the mesh is added to. If None the material is assigned straight away.
+        plant :   Group of the plant the mesh goes in, the current plant's if None.
+
+        On Exit : It will have created the mesh, assigned the branch shader to it and returns its name.
+    """
+    import globalVar
+    reload(globalVar)
+    import maya.api.OpenMaya as om
+
+    meshFn = om.MFnMesh()
+    transform = meshFn.create(pointArray(pMesh.points), list(pMesh.faceCounts), list(pMesh.faceConnects))
+    branchGeo = cmds.rename( om.MFnDagNode(transform).partialPathName(), pName )
+    print branchGeo, 'has been created.'
+    # Soft sides and hard caps, like the polyCylinders
+    cmds.polySoftEdge( branchGeo, a=89, ch=False )
+
+    if shaders is None:
+        applyShader(branchGeo, 'branch')
+    else:
+        shaders.add(branchGeo, 'branch')
+    cmds.parent( branchGeo, plant or 'plant' + str(globalVar.plantNumber ))
+    return branchGeo
+
+def combineBranchMeshes(pMeshes, pName):
+    """ Joins the pieces a mesh was built in (see the progressive build of createGeometry) into a single mesh, in the same
+    group. The vertices keep their order, so the pieces' records are joined as well.
+
+        pMeshes : List of (name, kind, part) of the pieces, as stored in the "meshes" of createGeometry.
+        pName :   Name of the joined mesh.
+
+        On Exit : Returns the (name, kind, part) of the joined mesh.
+    """
+    names = [name for name, kind, part in pMeshes]
+    plant = cmds.listRelatives( names[0], parent=True )[0]
+    combined = cmds.polyUnite( names, ch=False, n=pName )[0]
+    for name in names: # Without history polyUnite leaves the empty transforms behind
+        if cmds.objExists(name):
+            cmds.delete(name)
+    combined = cmds.parent( combined, plant )[0]
+    part = []
+    for name, kind, piece in pMeshes:
+        part.extend(piece)
+    return (combined, pMeshes[0][1], part)
+
+#--- PROGRESSIVE BUILD ---#
+MESH_CHUNK = 5000   # Segments per mesh when a merged plant is built progressively by time only
+
+class BuildCancelled(Exception):
+    """ Raised by BuildProgress when the user presses Esc. """
+    pass
+
+class BuildProgress(object):
+    """ Keeps Maya responsive while a plant is being built. Every chunkSize objects or chunkTime milliseconds, whatever
+    comes first, it runs onFlush (so that the materials of what has been built are assigned), moves the progress bar and
+    refreshes the viewport. Then, if Esc was pressed, it raises BuildCancelled.
+
+        total :      Number of objects (segments, leaves and blossoms) that will be built.
+        chunkSize :  Objects between refreshes, or None.
+        chunkTime :  Milliseconds between refreshes, or None.
+        onFlush :    Function called before every refresh, or None.
+    """
+    def __init__(self, total, chunkSize=None, chunkTime=None, onFlush=None):
+        self.total = total
+        self.chunkSize = chunkSize
+        self.chunkTime = chunkTime
+        self.onFlush = onFlush
+        self.done = 0
+        self.pending = 0
+        self.lastFlush = time.time()
+        cmds.progressWindow( title="L-System", progress=0, maxValue=max(total, 1), status="Building the plant...",
+            isInterruptable=True )
+
+    def step(self, count=1):
+        """ Tells that count more objects have been built. """
+        self.done += count
+        self.pending += count
+        if (self.chunkSize and self.pending >= self.chunkSize) or \
+           (self.chunkTime and (time.time() - self.lastFlush) * 1000.0 >= self.chunkTime):
+            self.flush()
+
+    def flush(self):
+        if self.onFlush is not None:
+            self.onFlush()
+        cmds.progressWindow( edit=True, progress=self.done, status="Building the plant... %s/%s" % (self.done,
+            self.total) )
+        cmds.refresh( force=True )
+        self.pending = 0
+        self.lastFlush = time.time()
+        if cmds.progressWindow( query=True, isCancelled=True ):
+            raise BuildCancelled()
+
+    def end(self):
+        cmds.progressWindow( endProgress=True )
+
+def chunkList(pItems, pSize, pWeight=None):
+    """ Splits a list in consecutive pieces of pSize items, or of about pSize in total if every item weighs
+    pWeight(item).
+
+        >>> chunkList(range(5), 2)
+        [[0, 1], [2, 3], [4]]
+        >>> chunkList([[1], [2, 3], [4, 5, 6]], 3, len)
+        [[[1], [2, 3]], [[4, 5, 6]]]
+    """
+    chunks = []
+    chunk = []
+    weight = 0
+    for item in pItems:
+        chunk.append(item)
+        weight += 1 if pWeight is None else pWeight(item)
+        if weight >= pSize:
+            chunks.append(chunk)
+            chunk = []
+            weight = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+#--- LEAF AND BLOSSOM TEMPLATES ---#
+TEMPLATE_GROUP = "LS_templates"  # Hidden group keeping the imported templates
+TEMPLATE_FILES = { "leaf" : ("leaf_geo.mb", "pPlane1"), "blossom" : ("blossom_geo.mb", "polySurface1") }
+
+def loadTemplate(pKind):
+    """ Imports the geometry of a leaf or a blossom into the scene, unless it was already imported, so that every leaf
+    and blossom can be an instance of it instead of importing the file once for each of them.
+
+        pKind :   "leaf" or "blossom".
+
+        On Exit : Returns the name of the template. It is kept in a hidden group, in its own namespace so that it never
+                  clashes with anything in the scene.
+    """
+    import os
+    fileName, nodeName = TEMPLATE_FILES[pKind]
+    template = "LS_%sTemplate:%s" % (pKind, nodeName)
+    if cmds.objExists(template):
+        return template
+    if not cmds.objExists(TEMPLATE_GROUP):
+        cmds.group( em=True, name=TEMPLATE_GROUP )
+        cmds.setAttr( TEMPLATE_GROUP+".visibility", False )
+    pathVar = os.path.dirname(__file__) # This stores the current working directory
+    # If the namespace is still there (the template was deleted, but not its namespace) Maya would make a new one called
+    # LS_leafTemplate1, so it is merged instead, and the node is looked for among the imported ones anyway
+    newNodes = cmds.file( pathVar+"/"+fileName, i=True, namespace="LS_%sTemplate" % pKind, mergeNamespacesOnClash=True,
+        returnNewNodes=True ) or []
+    for node in newNodes:
+        if node.split("|")[-1].split(":")[-1] == nodeName and cmds.nodeType(node) == "transform":
+            template = node
+            break
+    return cmds.parent( template, TEMPLATE_GROUP )[0]
+
+def checkNodeBudget(LStringVar, maxNodes=MAX_SCENE_NODES, mode="segments"):
+    """ Raises a BudgetError if interpreting LStringVar would build more than maxNodes objects. Otherwise it returns the
+    counts of the string (see LS_string_rewriting.symbolCounts). Unless the mode is "segments" the branches are built as
+    one mesh, so they hardly count. LStringVar can be the TurtleResult of the string instead, which already knows its
+    counts, so that the string doesn't have to be read again. """
+    if isinstance(LStringVar, TurtleResult):
+        counts = { "segments": LStringVar.segmentCount(), "leaves": LStringVar.leafCount(),
+                   "blossoms": LStringVar.blossomCount() }
+    else:
+        counts = symbolCounts(LStringVar)
+    branchNodes = counts["segments"] if mode == "segments" else min(counts["segments"], 1)
+    nodes = branchNodes + counts["leaves"] + counts["blossoms"]
+    if maxNodes is not None and nodes > maxNodes:
+        raise BudgetError("This plant would have %s objects (%s segments, %s leaves and %s blossoms), over the budget of %s."
+            % (nodes, counts["segments"], counts["leaves"], counts["blossoms"], maxNodes))
+    return counts
 
 def createGeometry(LStringVar, pRad, pStep, pAngle, subDivs, length_atenuation, radius_atenuation, turtleSpeed,
-    rgb_branch, rgb_leaf, rgb_blossom):
+    rgb_branch, rgb_leaf, rgb_blossom, seed=None, maxNodes=MAX_SCENE_NODES, mode="segments",
+    turtle=None, lod=None, chunkSize=None, chunkTime=None, session=None, shaderNumber=None, plantName=None):
     """ Translates the string into maya commands in order to generate the final LSystem plant.
 
-    LStringVar :    The L-System-generated string which will be interpreted by the turtle.
+    LStringVar :    The L-System-generated string which will be interpreted by the turtle. It is only read once from start to
+                    end, so an LRope (see LS_string_rewriting.writeLSRope) can be given instead of a flat string.
     pRad :          The radius of the segments left by each turtle's step.
     pStep :         The length of the segments left by each turtle's step.
     pAngle :        The turtle will yaw, roll or pitch by this angular amount each time it finds its corresponding  symbol.
@@ -196,152 +437,271 @@ def createGeometry(LStringVar, pRad, pStep, pAngle, subDivs, length_atenuation,
     rgb_branch :    RGB values for the diffuse colour of the branches.
     rgb_leaf :      RGB values for the diffuse colour of the leaves.
     rgb_blossom :   RGB values for the diffuse colour of blossoms.
+    seed :          Seed for the slight random rotation of the leaves, the same seed gives the same plant. None picks a new
+                    one.
+    maxNodes :      If the string would build more objects than this, nothing is built and a BudgetError is raised. None
+                    skips the check, for callers that already did it with checkNodeBudget.
+    mode :          How the branches are built:
+                        "segments"  A polyCylinder per segment, as it always was. Slow, but every segment can be picked.
+                        "merged"    All the branches in a single mesh (see LS_mesh).
+                        "levels"    A mesh per branch level.
+                        "tubes"     All the branches in a single mesh, as continuous tubes instead of a cylinder per
+                                    segment (see LS_mesh.buildTubeMesh).
+    turtle :        The TurtleResult of the string if it was already worked out (see LS_turtle.interpretTurtle), so that
+                    errors like unbalanced brackets can be caught before anything is created.
+    lod :           LODPolicy (see LS_mesh) choosing the subdivisions of each segment from its radius and turning the
+                    thinnest ones into cards, within its polygon budget. None gives every segment subDivs sides. In the
+                    "segments" mode there are no cards, those segments get the fewest sides instead.
+    chunkSize, chunkTime :  Progressive build. If any of them is given, the viewport is refreshed every chunkSize objects
+                    or every chunkTime milliseconds while a progress bar is shown, and the build can be cancelled with
+                    Esc. The meshes are built in pieces of chunkSize segments (or MESH_CHUNK) so they show up bit by bit,
+                    and joined into a single mesh again when the branches are finished.
+    session :       PlantSession (see LS_session) where what is built gets written down, so that updatePlant can change
+                    it later on without building it again.
+    shaderNumber :  Number of the plant whose materials are used, the ones of this plant if None. The prototypes of a
+                    scatter (see createScatter) share the materials of the scatter's number.
+    plantName :     Group the plant is built in, 'plant' followed by the current plant number if None. It is how a plant
+                    that isn't the last one is built again (see gui.updatePlantButtonAction), and the names of its
+                    objects follow it.
 
     On Exit :  Creates the geometry. Everything will be collected and parented to a group which will have the plant unique
-               name with its number.
+               name with its number. Returns False if the build was cancelled, leaving the plant half done, True otherwise.
     """
     import globalVar
     reload(globalVar)
 
-    cmds.group( em=True, name='plant'+str(globalVar.plantNumber) )
-
-    class position:
-        x = 0
-        y = 0
-        z = 0
-    POS = position()
-
-    class rotation:
-        x = 0
-        y = 0
-        z = 0
-    ROT = rotation()
-    
-    indexBranch = 0         # keeps track of the branch level
-    segmentNum = 1          # unique ID for each segment or internode
-
-    rotationLeaves = 0      # we initialise a variable that will be useful for adding slight random rotation to the leaves
-    leafNum = 1             # unique ID for each leaf
-
-    blossomNum = 1          # unique ID for each blossoms
-    
-    for i in range(0,len(LStringVar)):
-        if LStringVar[i] == chr(43):     # chr(43) is +
-            ROT.x += pAngle
-            #ROT.x += (5*random.random())
-        elif LStringVar[i] == chr(45):   # chr(43) is -
-            ROT.x -= pAngle
-            #ROT.x += (5*random.random())
-        elif LStringVar[i] == chr(38):   # chr(38) is &
-            ROT.z += pAngle
-            #ROT.z += (5*random.random())
-        elif LStringVar[i] == chr(94):   # chr(94) is ^
-            ROT.z -= pAngle
-            #ROT.z += (5*random.random())
-        elif LStringVar[i] == chr(60):   # chr(47) is <
-            ROT.y += pAngle
-            #ROT.y += (5*random.random())
-        elif LStringVar[i] == chr(62):   # chr(92) is >
-            ROT.y -= pAngle
-            #ROT.y += (5*random.random())
-        elif LStringVar[i] == chr(42):  # chr(42) is *
-            ROT.x += 180
-            #ROT.x += (5*random.random())
-
-        elif LStringVar[i] == 'B': # Create blossom
-            # Import geometry from external file and rename it
-            blossomName = "blossom_"+str(globalVar.plantNumber)+"_"+str(blossomNum)
+    # The turtle works out every transform on its own, Maya is only used to build the result
+    if turtle is None:
+        turtle = interpretTurtle(LStringVar, pRad, pStep, pAngle, length_atenuation, radius_atenuation, seed)
+    if maxNodes is not None:
+        checkNodeBudget(turtle, maxNodes, mode)
+    if plantName is None:
+        plantName = 'plant'+str(globalVar.plantNumber)
+    if shaderNumber is None:
+        shaderNumber = plantTag(plantName)
+    tag = plantTag(plantName)
+    if not cmds.objExists( plantName ): # It is kept when a plant is rebuilt
+        cmds.group( em=True, name=plantName )
+
+    # Materials are assigned all at once when the plant is finished, or when each chunk is if it is progressive
+    shaders = ShaderBatch(shaderNumber)
+    if lod is not None:
+        lod.fit(turtle)
+    progress = None
+    if chunkSize or chunkTime:
+        progress = BuildProgress(turtle.segmentCount() + turtle.leafCount() + turtle.blossomCount(), chunkSize,
+            chunkTime, shaders.assign)
+        # Big meshes are built in pieces as well, so that they show up bit by bit
+        meshChunk = chunkSize or MESH_CHUNK
+    else:
+        meshChunk = max(turtle.segmentCount(), 1)
+    branchesName = 'branches'+tag
+    built = { "plant": plantName, "shaderNumber": shaderNumber, "mode": mode, "subDivs": subDivs, "lod": lod, "meshes": [],
+              "blossoms": [], "leaves": [], "counts": (turtle.segmentCount(), turtle.leafCount(), turtle.blossomCount()) }
+    if session is not None:
+        session.built = built
+
+    try:
+        #--- Branches ---#
+        if mode == "merged":
+            chunks = chunkList(range(turtle.segmentCount()), meshChunk)
+            for k, segments in enumerate(chunks):
+                name = branchesName if len(chunks) == 1 else branchesName+'_'+str(k)
+                makeBranchMesh(buildBranchMesh(turtle, subDivs, segments, lod), name, shaders, plantName)
+                built["meshes"].append((name, "segments", segments))
+                if progress is not None:
+                    progress.step(len(segments))
+        elif mode == "tubes":
+            chunks = chunkList(branchChains(turtle), meshChunk, len)
+            for k, chains in enumerate(chunks):
+                name = branchesName if len(chunks) == 1 else branchesName+'_'+str(k)
+                makeBranchMesh(buildTubeMesh(turtle, subDivs, lod, chains), name, shaders, plantName)
+                built["meshes"].append((name, "chains", chains))
+                if progress is not None:
+                    progress.step(sum([len(chain) for chain in chains]))
+        elif mode == "levels":
+            for level, levelMesh in sorted(buildBranchMeshesByLevel(turtle, subDivs, lod).items()):
+                makeBranchMesh(levelMesh, branchesName+'_'+str(level), shaders, plantName)
+                built["meshes"].append((branchesName+'_'+str(level), "level", level))
+                if progress is not None:
+                    progress.step(turtle.segmentLevel.count(level))
+        else:
+            for i in range(0, turtle.segmentCount()):
+                rotX, rotY, rotZ = turtle.segmentRotation[3*i:3*i+3]
+                sides = subDivs
+                if lod is not None:
+                    sides = lod.subDivsFor(turtle.segmentRadius[i], turtle.segmentLevel[i]) or lod.minSubDivs
+                makeSegment(pRad, turtle.segmentStep[i], turtle.segmentStart[3*i], turtle.segmentStart[3*i+1],
+                    turtle.segmentStart[3*i+2], rotX, rotY, rotZ, sides, turtle.segmentLevel[i], length_atenuation,
+                    radius_atenuation, rgb_branch, i+1, shaders, plantName)
+                if turtleSpeed != 0:
+                    time.sleep( turtleSpeed )
+                    cmds.refresh( force=True )
+                if progress is not None:
+                    progress.step()
+        if mode in ("merged", "tubes") and len(built["meshes"]) > 1:
+            # The pieces were only there to show the branches bit by bit. Their material goes first, as it is kept
+            shaders.assign()
+            built["meshes"] = [combineBranchMeshes(built["meshes"], branchesName)]
+
+        # The leaves and blossoms are instances of a template, which is only imported the first time
+        if turtle.blossomCount():
+            blossomTemplate = loadTemplate("blossom")
+            blossomFaces = cmds.polyEvaluate( blossomTemplate, f=True )
+            built["blossomOffset"] = cmds.xform( blossomTemplate, q=True, t=True )
+        if turtle.leafCount():
+            leafTemplate = loadTemplate("leaf")
+            built["leafOffset"] = cmds.xform( leafTemplate, q=True, t=True )
+
+        #--- Blossoms ---#
+        for i in range(0, turtle.blossomCount()):
+            # Instance the template and rename it
+            blossomName = "blossom_"+tag+"_"+str(i+1)
             """ The blossoms' names will follow this template:
                     - blossom_X_Y
                 Where X will be the plant number and Y the unique blossom number (ID).
             """
-            import os
-            pathVar = os.path.dirname(__file__) # This stores the current working directory
-
-            cmds.file( pathVar+"/blossom_geo.mb", i=True )
-            cmds.rename( "polySurface1", blossomName )
+            cmds.instance( blossomTemplate, n=blossomName )
+            built["blossoms"].append(blossomName)
             # Places the blossom to the right position and rotates it according to the last branch orientation
             cmds.select( blossomName )
-            cmds.move( POS.x, POS.y, POS.z, r=True, os=True )
-            cmds.xform( ro=flaggedSegmentRot, os=True )
-            cmds.parent( blossomName, "plant"+str(globalVar.plantNumber) )
-            cmds.scale( pRad, pRad, pRad )
-            # We reduce a iteratively the size of the blossoms when they are in a deep level
-            for i in range(0,indexBranch+1):
-                cmds.scale( 0.95, 0.95, 0.95, r=True )
+            cmds.move( turtle.blossomPosition[3*i], turtle.blossomPosition[3*i+1], turtle.blossomPosition[3*i+2], r=True,
+                os=True )
+            cmds.xform( ro=list(turtle.blossomRotation[3*i:3*i+3]), os=True )
+            cmds.parent( blossomName, plantName )
+            # Blossoms are smaller when they are in a deep level
+            blossomScale = turtle.blossomScale[i]
+            cmds.scale( blossomScale, blossomScale, blossomScale )
             # Assigns materials to petals, stamen and pedicel
-            applyShader( blossomName+".f[50:109]", "blossomStamen")
-            applyShader( blossomName+".f[0:49]", "blossomPedicel")
-            cmds.select( blossomName+".f[*]", r=True )
-            cmds.select( blossomName+".f[50:109]", deselect=True )
-            cmds.select( blossomName+".f[0:49]", deselect=True )
-            objectList = cmds.ls(sl=True)
-            for item in objectList:
-                applyShader( item, "blossomPetals")
-            # Increments the blossoms counter
-            blossomNum += 1
-
-        elif LStringVar[i] == 'L': # Create leaf
-            leafName = "leaf_"+str(globalVar.plantNumber)+"_"+str(leafNum)
+            shaders.add( blossomName+".f[%s:%s]" % BLOSSOM_PEDICEL_FACES, "blossomPedicel" )
+            shaders.add( blossomName+".f[%s:%s]" % BLOSSOM_STAMEN_FACES, "blossomStamen" )
+            if blossomFaces > BLOSSOM_STAMEN_FACES[1]+1:
+                shaders.add( blossomName+".f[%s:%s]" % (BLOSSOM_STAMEN_FACES[1]+1, blossomFaces-1), "blossomPetals" )
+            if progress is not None:
+                progress.step()
+
+        #--- Leaves ---#
+        for i in range(0, turtle.leafCount()):
+            leafName = "leaf_"+tag+"_"+str(i+1)
             """ The leave's names will follow this template:
                     - leaf_X_Y
                 Where X will be the plant number and Y the unique leaf number (ID).
             """
-            import os
-            pathVar = os.path.dirname(__file__) # This stores the current working directory
-
-            cmds.file( pathVar+"/leaf_geo.mb", i=True )
-            cmds.rename( "pPlane1", leafName )
-            # Places the leaf to the right position and rotates it according to the last branch orientation
+            cmds.instance( leafTemplate, n=leafName )
+            built["leaves"].append(leafName)
+            # Places the leaf to the right position and rotates it according to the last branch orientation, plus a slight
+            # random rotation
             cmds.select( leafName )
-            cmds.move( POS.x, POS.y, POS.z, r=True, os=True )
-            cmds.xform( ro=flaggedSegmentRot, os=True )
-            cmds.rotate( rotationLeaves%48, rotationLeaves, rotationLeaves%15, r=True, os=True )
-            cmds.parent( leafName, "plant"+str(globalVar.plantNumber) )
+            cmds.move( turtle.leafPosition[3*i], turtle.leafPosition[3*i+1], turtle.leafPosition[3*i+2], r=True, os=True )
+            cmds.xform( ro=list(turtle.leafRotation[3*i:3*i+3]), os=True )
+            spinX, spinY, spinZ = turtle.leafSpin[3*i:3*i+3]
+            cmds.rotate( spinX, spinY, spinZ, r=True, os=True )
+            cmds.parent( leafName, plantName )
             # Assigns the material to leaves
-            applyShader(leafName, "leaf")
-            cmds.scale( pRad*0.5, pRad*0.5, pRad*0.5 )
-            # We reduce a iteratively the size of the leaves when they are in a deep level
-            for i in range(0,indexBranch+1):
-                cmds.scale( 0.85, 0.85, 0.85, r=True )
-            # We change the random value for the slight rotation value we add
-            rotationLeaves += random.randint(0,720)
-            leafNum += 1
-
-        elif LStringVar[i] == chr(91):   # chr(93) is [
-            exec "storedPOS_%s = copy.copy(POS)" % (indexBranch)
-            exec "storedROT_%s = copy.copy(ROT)" % (indexBranch)
-            indexBranch +=1
-
-        elif LStringVar[i] == chr(93):   # chr(93) is ]
-            indexBranch -= 1
-            exec "POS = copy.copy(storedPOS_%s)" % (indexBranch)
-            exec "ROT = copy.copy(storedROT_%s)" % (indexBranch)
-        else:
-            # Have in mind that makeSegment apart from creating geometry it also returns the position of the last vertex.
-            lastVtx = makeSegment(pRad, pStep, POS.x, POS.y, POS.z, ROT.x, ROT.y, ROT.z, subDivs, indexBranch,
-                length_atenuation, radius_atenuation, rgb_branch, segmentNum)
-
-            import globalVar
-            reload(globalVar)
-
-            """
-            I do a little trick in this part. If I changed the POS object using number additions and so on I would lose a
-            lot of precision when the segment count is so great. So, what I do is query the positon for the middle top
-            vertex for each segment when it is just created and update the POS instance according to this value.
-            """
-
-            POS.x = cmds.xform( 'segment%s_%s_%s.vtx[%s]' % (globalVar.plantNumber, indexBranch, segmentNum, lastVtx),
-                q=True, ws=True, t=True )[0]
-            POS.y = cmds.xform( 'segment%s_%s_%s.vtx[%s]' % (globalVar.plantNumber, indexBranch, segmentNum, lastVtx),
-                q=True, ws=True, t=True )[1]
-            POS.z = cmds.xform( 'segment%s_%s_%s.vtx[%s]' % (globalVar.plantNumber, indexBranch, segmentNum, lastVtx),
-                q=True, ws=True, t=True )[2]
-            
-            flaggedSegment = "segment%s_%s_%s" % (globalVar.plantNumber, indexBranch, segmentNum)
-            flaggedSegmentRot = cmds.xform( flaggedSegment, q=True, ro=True )
-
-            segmentNum += 1
-            if turtleSpeed != 0:
-                time.sleep( turtleSpeed )
-                cmds.refresh( force=True )
\ No newline at end of file
+            shaders.add(leafName, "leaf")
+            # Leaves are smaller when they are in a deep level
+            leafScale = turtle.leafScale[i]
+            cmds.scale( leafScale, leafScale, leafScale )
+            if progress is not None:
+                progress.step()
+    except BuildCancelled:
+        print "The plant was cancelled before it was finished."
+        return False
+    finally:
+        #--- Materials ---#
+        shaders.assign()
+        if progress is not None:
+            progress.end()
+    return True
+
+#--- INCREMENTAL UPDATE ---#
+def updatePlant(session):
+    """ Moves everything createGeometry built for the session to where the current turtle of the session says (see
+    PlantSession.interpret), without creating or deleting anything. This is only possible when the plant still has the
+    same number of segments, leaves and blossoms and the branches were built as meshes (not in the "segments" mode).
+
+        session : PlantSession the plant was built with.
+
+        On Exit : Returns True if the plant was updated, False if it has to be built again.
+    """
+    import maya.api.OpenMaya as om
+    built, turtle = session.built, session.turtle
+    if built is None or turtle is None or built["mode"] == "segments" or not cmds.objExists(built["plant"]):
+        return False
+    if built["counts"] != (turtle.segmentCount(), turtle.leafCount(), turtle.blossomCount()):
+        return False
+
+    # Check everything first, so that nothing is changed if the plant has to be built again anyway
+    updates = []
+    for name, kind, part in built["meshes"]:
+        if not cmds.objExists(name):
+            return False
+        selection = om.MSelectionList()
+        selection.add(name)
+        meshFn = om.MFnMesh(selection.getDagPath(0))
+        meshData = branchMeshData(turtle, built["subDivs"], built["lod"], kind, part)
+        if meshFn.numVertices != meshData.vertexCount():
+            return False
+        updates.append((meshFn, meshData))
+    for meshFn, meshData in updates:
+        meshFn.setPoints(pointArray(meshData.points))
+
+    for i, blossomName in enumerate(built["blossoms"]):
+        offset = built["blossomOffset"]
+        blossomScale = turtle.blossomScale[i]
+        cmds.xform( blossomName, t=[offset[k] + turtle.blossomPosition[3*i+k] for k in range(3)],
+            ro=list(turtle.blossomRotation[3*i:3*i+3]), s=[blossomScale]*3, os=True )
+    for i, leafName in enumerate(built["leaves"]):
+        offset = built["leafOffset"]
+        leafScale = turtle.leafScale[i]
+        cmds.xform( leafName, t=[offset[k] + turtle.leafPosition[3*i+k] for k in range(3)],
+            ro=list(turtle.leafRotation[3*i:3*i+3]), s=[leafScale]*3, os=True )
+        spinX, spinY, spinZ = turtle.leafSpin[3*i:3*i+3]
+        cmds.rotate( spinX, spinY, spinZ, leafName, r=True, os=True )
+    return True
+
+#--- SCATTERING ---#
+def createScatter(pPrototypes, scatter, pName, chunkSize=None, chunkTime=None):
+    """ Places instances of some plants already in the scene where a scatter says (see LS_scatter). The instances share
+    the geometry and materials of their prototype, only their transforms are new.
+
+    pPrototypes :  Names of the prototype plants (their groups), in the order scatter.prototype refers to them. They are
+                   moved into a hidden group, pName_prototypes, so that only the instances are seen.
+    scatter :      ScatterResult with the position, rotation, scale and prototype of every instance.
+    pName :        Name of the group the instances are parented to.
+    chunkSize, chunkTime :  Progressive build, as in createGeometry.
+
+    On Exit :  Returns False if it was cancelled, leaving the scatter half done, True otherwise.
+    """
+    cmds.group( em=True, name=pName )
+    prototypesGroup = cmds.group( pPrototypes, name=pName+"_prototypes" )
+    cmds.setAttr( prototypesGroup+".visibility", False )
+    cmds.parent( prototypesGroup, pName )
+    prototypes = [prototypesGroup+"|"+prototype for prototype in pPrototypes]
+
+    # The instances are born next to their prototype, in the hidden group, and are moved out of it a chunk at a time
+    pending = []
+    def parentPending():
+        if pending:
+            cmds.parent( pending, pName, relative=True )
+            del pending[:]
+    progress = None
+    if chunkSize or chunkTime:
+        progress = BuildProgress(scatter.count(), chunkSize, chunkTime, parentPending)
+    try:
+        for i in range(scatter.count()):
+            instance = cmds.instance( prototypes[scatter.prototype[i]], n=pName+"_"+str(i+1) )[0]
+            scale = scatter.scale[i]
+            cmds.xform( instance, t=list(scatter.position[3*i:3*i+3]), ro=(0, scatter.rotation[i], 0), s=(scale, scale,
+                scale) )
+            pending.append(instance)
+            if progress is not None:
+                progress.step()
+    except BuildCancelled:
+        print "The scatter was cancelled before it was finished."
+        return False
+    finally:
+        parentPending()
+        if progress is not None:
+            progress.end()
+    return True
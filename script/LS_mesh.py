@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+"""
+    Branch Mesh Module:    <LS_mesh.py>
+
+    createGeometry used to build a polyCylinder for every single step of the turtle, each one with its own transform,
+    shape, pivot, scale, freeze, move, rotate, shader assignment and parent. A plant of depth 5 easily ends up with tens of
+    thousands of nodes and Maya can barely move. This module builds all those cylinders as the vertex and face arrays of
+    a single mesh instead, so that Maya only has to create one object (or one per branch level) in one go.
+
+    Nothing in here needs Maya, it only reads a TurtleResult (see LS_turtle) and fills plain arrays, the same three arrays
+    MFnMesh.create wants:
+
+        points :        x, y, z of every vertex, one after the other.
+        faceCounts :    Number of vertices of every face.
+        faceConnects :  Vertex indices of every face, one face after the other.
+
+    Every cylinder looks the same as the ones polyCylinder used to build: 'subDivs' quads around and an n-gon on each end.
+    When NumPy is available buildBranchMesh works out all the cylinders with the same number of sides at once, giving
+    exactly the same arrays.
+
+        >>> from LS_turtle import interpretTurtle
+        >>> mesh = buildBranchMesh(interpretTurtle("F[+F]F", 0.2, 1.2, 25.2, 0.95, 0.85, seed=1), 5)
+        >>> mesh.vertexCount(), mesh.faceCount()
+        (30, 21)
+"""
+import math
+from array import array
+try:
+    import numpy
+except ImportError: # NumPy doesn't ship with every Maya version, the meshes are built in plain Python without it
+    numpy = None
+
+class MeshData(object):
+    """ Vertex and face arrays of a mesh, ready to be given to MFnMesh.create or written to a file. """
+    def __init__(self):
+        self.points = array("d")
+        self.faceCounts = array("i")
+        self.faceConnects = array("i")
+
+    def vertexCount(self):
+        return len(self.points) // 3
+
+    def faceCount(self):
+        return len(self.faceCounts)
+
+def appendCylinder(pMesh, start, matrix, radius, length, subDivs, cosTable, sinTable):
+    """ Adds a capped cylinder to the mesh. It starts at 'start' and grows along the second column of the rotation matrix
+    (the Y axis of the segment), like the polyCylinders of makeSegment did.
+
+    pMesh :              MeshData the cylinder is appended to.
+    start :              x, y, z where the cylinder starts.
+    matrix :             Rotation matrix of the segment, 9 values row by row (see LS_turtle.eulerMatrix).
+    radius, length :     Size of the cylinder.
+    subDivs :            Number of sides.
+    cosTable, sinTable : Cosine and sine of the angle of every side, so that they are not worked out for every segment.
+    """
+    sX, sY, sZ = start
+    # Local axes of the segment
+    xX, xY, xZ = matrix[0], matrix[3], matrix[6]
+    yX, yY, yZ = matrix[1] * length, matrix[4] * length, matrix[7] * length
+    zX, zY, zZ = matrix[2], matrix[5], matrix[8]
+
+    first = len(pMesh.points) // 3
+    points = pMesh.points
+    ring = []
+    for c, s in zip(cosTable, sinTable):
+        # Going round this way the faces look outwards
+        ring.append((radius * (c*xX - s*zX), radius * (c*xY - s*zY), radius * (c*xZ - s*zZ)))
+    for oX, oY, oZ in ring:
+        points.extend((sX + oX, sY + oY, sZ + oZ))
+    for oX, oY, oZ in ring:
+        points.extend((sX + yX + oX, sY + yY + oY, sZ + yZ + oZ))
+
+    top = first + subDivs
+    connects = pMesh.faceConnects
+    for k in range(subDivs):
+        nextK = (k + 1) % subDivs
+        connects.extend((first + k, first + nextK, top + nextK, top + k))
+    pMesh.faceCounts.extend([4] * subDivs)
+    # Caps
+    connects.extend(range(first + subDivs - 1, first - 1, -1))
+    connects.extend(range(top, top + subDivs))
+    pMesh.faceCounts.extend((subDivs, subDivs))
+
+def appendCard(pMesh, start, matrix, radius, length):
+    """ Adds two crossed quads instead of a cylinder, as wide as the segment. From far away they look the same as a thin
+    cylinder, with only 2 faces. The arguments are the same as appendCylinder's. """
+    sX, sY, sZ = start
+    yX, yY, yZ = matrix[1] * length, matrix[4] * length, matrix[7] * length
+    first = len(pMesh.points) // 3
+    for axis in (0, 2): # Local X and Z
+        oX, oY, oZ = radius * matrix[axis], radius * matrix[axis+3], radius * matrix[axis+6]
+        pMesh.points.extend((sX - oX, sY - oY, sZ - oZ, sX + oX, sY + oY, sZ + oZ,
+                             sX + yX + oX, sY + yY + oY, sZ + yZ + oZ, sX + yX - oX, sY + yY - oY, sZ + yZ - oZ))
+    pMesh.faceConnects.extend(range(first, first + 8))
+    pMesh.faceCounts.extend((4, 4))
+
+class LODPolicy(object):
+    """ Decides how detailed every branch segment is, so that thin twigs don't get as many sides as the trunk.
+
+    The number of sides goes with the radius of the segment, which already depends on its branch level, so that all the
+    sides are about as wide: the thickest segment gets maxSubDivs and thinner ones less, never below minSubDivs. Segments
+    at cardLevel or deeper are built as crossed cards (see appendCard) instead of cylinders.
+
+    With a polygon budget, fit() turns the deepest levels into cards first, as they hardly change the silhouette of the
+    plant, and only then lowers maxSubDivs, until the branches fit in the budget. Level 0 is always kept as cylinders.
+
+        >>> from LS_turtle import interpretTurtle
+        >>> turtle = interpretTurtle("F[+F[+F[+F]]]", 0.2, 1.2, 25.2, 0.95, 0.5, seed=1)
+        >>> lod = LODPolicy(12)
+        >>> lod.fit(turtle)
+        >>> [lod.subDivsFor(radius, level) for radius, level in zip(turtle.segmentRadius, turtle.segmentLevel)]
+        [12, 6, 3, 3]
+        >>> lod = LODPolicy(12, polygonBudget=30)
+        >>> lod.fit(turtle)
+        >>> lod.cardLevel, lod.polygonCount(turtle)
+        (3, 29)
+    """
+    def __init__(self, maxSubDivs, minSubDivs=3, cardLevel=None, polygonBudget=None):
+        self.maxSubDivs = maxSubDivs
+        self.minSubDivs = min(minSubDivs, maxSubDivs)
+        self.cardLevel = cardLevel          # None means no cards
+        self.polygonBudget = polygonBudget  # None means no limit
+        self.referenceRadius = None         # Radius getting maxSubDivs, the thickest one unless set
+
+    def subDivsFor(self, radius, level):
+        """ Number of sides of a segment, 0 if it is a card. """
+        if self.cardLevel is not None and level >= self.cardLevel:
+            return 0
+        if not self.referenceRadius:
+            return self.maxSubDivs
+        subDivs = int(round(self.maxSubDivs * radius / self.referenceRadius))
+        return max(self.minSubDivs, min(self.maxSubDivs, subDivs))
+
+    def polygonCount(self, turtle):
+        """ Number of faces the branches of the turtle would have. """
+        count = 0
+        for radius, level in zip(turtle.segmentRadius, turtle.segmentLevel):
+            subDivs = self.subDivsFor(radius, level)
+            count += subDivs + 2 if subDivs else 2
+        return count
+
+    def fit(self, turtle):
+        """ Takes the thickest segment of the turtle as reference and, if there is a polygon budget, lowers the detail
+        until the branches fit in it (or can't get any simpler). """
+        if self.referenceRadius is None and turtle.segmentCount():
+            self.referenceRadius = max(turtle.segmentRadius)
+        if self.polygonBudget is None or not turtle.segmentCount():
+            return
+        deepest = max(turtle.segmentLevel)
+        if self.cardLevel is None:
+            self.cardLevel = deepest + 1
+        while self.polygonCount(turtle) > self.polygonBudget:
+            if self.cardLevel > 1:
+                self.cardLevel -= 1
+            elif self.maxSubDivs > self.minSubDivs:
+                self.maxSubDivs -= 1
+            else:
+                break
+
+def buildBranchMesh(turtle, subDivs, segments=None, lod=None):
+    """ Builds the cylinders of the branches as a single mesh.
+
+    turtle :    TurtleResult with the segments (see LS_turtle.interpretTurtle).
+    subDivs :   Number of sides of every cylinder.
+    segments :  Indices of the segments to build, all of them if None.
+    lod :       LODPolicy choosing the sides of each segment instead of subDivs, already fitted to the turtle.
+
+    On Exit :   Returns a MeshData.
+    """
+    if segments is None:
+        segments = range(turtle.segmentCount())
+    if numpy is not None and len(segments):
+        return _buildBranchMeshNumpy(turtle, subDivs, segments, lod)
+    tables = {}
+    mesh = MeshData()
+    for i in segments:
+        start, matrix = turtle.segmentStart[3*i:3*i+3], turtle.segmentMatrix[9*i:9*i+9]
+        radius, length = turtle.segmentRadius[i], turtle.segmentLength[i]
+        sides = subDivs if lod is None else lod.subDivsFor(radius, turtle.segmentLevel[i])
+        if not sides:
+            appendCard(mesh, start, matrix, radius, length)
+            continue
+        if sides not in tables:
+            tables[sides] = ([math.cos(2*math.pi*k/sides) for k in range(sides)],
+                             [math.sin(2*math.pi*k/sides) for k in range(sides)])
+        cosTable, sinTable = tables[sides]
+        appendCylinder(mesh, start, matrix, radius, length, sides, cosTable, sinTable)
+    return mesh
+
+def _buildBranchMeshNumpy(turtle, subDivs, segments, lod):
+    """ NumPy version of buildBranchMesh. Every segment gets its place in the arrays first (from the number of vertices,
+    faces and indices it takes), and then all the segments with the same number of sides are filled in one go, following
+    the same order as appendCylinder and appendCard. """
+    segments = numpy.asarray(segments, dtype=numpy.int64)
+    start = numpy.frombuffer(turtle.segmentStart, dtype=numpy.float64).reshape(-1, 3)[segments]
+    matrix = numpy.frombuffer(turtle.segmentMatrix, dtype=numpy.float64).reshape(-1, 3, 3)[segments]
+    radius = numpy.frombuffer(turtle.segmentRadius, dtype=numpy.float64)[segments]
+    length = numpy.frombuffer(turtle.segmentLength, dtype=numpy.float64)[segments]
+    if lod is None:
+        sides = numpy.empty(len(segments), dtype=numpy.int64)
+        sides.fill(subDivs)
+    else:
+        level = turtle.segmentLevel
+        sides = numpy.array([lod.subDivsFor(r, level[i]) for r, i in zip(radius.tolist(), segments.tolist())],
+            dtype=numpy.int64)
+    cards = sides == 0
+    # Vertices, faces and indices each segment takes, and where they start
+    vertexSizes = numpy.where(cards, 8, 2 * sides)
+    faceSizes = numpy.where(cards, 2, sides + 2)
+    connectSizes = numpy.where(cards, 8, 6 * sides)
+    vertexStarts = numpy.cumsum(vertexSizes) - vertexSizes
+    faceStarts = numpy.cumsum(faceSizes) - faceSizes
+    connectStarts = numpy.cumsum(connectSizes) - connectSizes
+    points = numpy.empty((int(vertexSizes.sum()), 3))
+    faceCounts = numpy.empty(int(faceSizes.sum()), dtype=numpy.int32)
+    faceConnects = numpy.empty(int(connectSizes.sum()), dtype=numpy.int32)
+
+    for count in numpy.unique(sides).tolist():
+        chosen = numpy.nonzero(sides == count)[0]
+        axisY = matrix[chosen, :, 1] * length[chosen, None]
+        base = start[chosen]
+        if count == 0:
+            corners = []
+            for axis in (0, 2): # Local X and Z
+                offset = matrix[chosen, :, axis] * radius[chosen, None]
+                corners.extend((base - offset, base + offset, base + axisY + offset, base + axisY - offset))
+            vertices = numpy.stack(corners, axis=1)
+            faces = numpy.array([4, 4])
+            connects = numpy.arange(8)
+        else:
+            cosTable = numpy.array([math.cos(2*math.pi*k/count) for k in range(count)])
+            sinTable = numpy.array([math.sin(2*math.pi*k/count) for k in range(count)])
+            axisX, axisZ = matrix[chosen, :, 0], matrix[chosen, :, 2]
+            ring = radius[chosen, None, None] * (cosTable[None, :, None] * axisX[:, None, :] -
+                                                 sinTable[None, :, None] * axisZ[:, None, :])
+            vertices = numpy.concatenate((base[:, None, :] + ring, (base + axisY)[:, None, :] + ring), axis=1)
+            faces = numpy.array([4] * count + [count, count])
+            k = numpy.arange(count)
+            quads = numpy.stack((k, (k + 1) % count, count + (k + 1) % count, count + k), axis=1).ravel()
+            connects = numpy.concatenate((quads, numpy.arange(count - 1, -1, -1), numpy.arange(count, 2 * count)))
+        points[vertexStarts[chosen, None] + numpy.arange(vertices.shape[1])] = vertices
+        faceCounts[faceStarts[chosen, None] + numpy.arange(len(faces))] = faces
+        faceConnects[connectStarts[chosen, None] + numpy.arange(len(connects))] = vertexStarts[chosen, None] + connects
+
+    mesh = MeshData()
+    mesh.points.fromstring(points.tostring())
+    mesh.faceCounts.fromstring(faceCounts.astype(numpy.dtype(mesh.faceCounts.typecode)).tostring())
+    mesh.faceConnects.fromstring(faceConnects.astype(numpy.dtype(mesh.faceConnects.typecode)).tostring())
+    return mesh
+
+#--- SWEPT TUBES ---#
+def branchChains(turtle):
+    """ Splits the segments into chains, one per branch from its '[' to its ']'. A segment goes on with the first segment
+    starting from it on the same branch level, the others start branches of their own.
+
+    On Exit :   Returns a list with the indices of the segments of every chain, in order.
+
+        >>> from LS_turtle import interpretTurtle
+        >>> branchChains(interpretTurtle("F[+F-F]F+F", 0.2, 1.2, 25.2, 0.95, 0.85, seed=1))
+        [[0, 3, 4], [1, 2]]
+    """
+    count = turtle.segmentCount()
+    parent, level = turtle.segmentParent, turtle.segmentLevel
+    continuation = [-1] * count
+    continued = [False] * count
+    for i in range(count):
+        p = parent[i]
+        if p >= 0 and level[p] == level[i] and continuation[p] == -1:
+            continuation[p] = i
+            continued[i] = True
+    chains = []
+    for i in range(count):
+        if not continued[i]:
+            chain = [i]
+            while continuation[chain[-1]] != -1:
+                chain.append(continuation[chain[-1]])
+            chains.append(chain)
+    return chains
+
+def _normalize(x, y, z):
+    length = math.sqrt(x*x + y*y + z*z)
+    if length < 1e-12:
+        return None
+    return x / length, y / length, z / length
+
+def appendTube(pMesh, turtle, chain, radius, subDivs, cosTable, sinTable):
+    """ Adds a single tube swept along a chain of segments. Consecutive segments share the ring between them, which
+    faces halfway between both directions, and only the ends of the tube are capped.
+
+    The rings keep their orientation from one to the next (the 'side' axis of the previous ring is projected on the new
+    one, which is known as parallel transport), so that the tube doesn't twist.
+
+    pMesh :              MeshData the tube is appended to.
+    turtle :             TurtleResult with the segments.
+    chain :              Indices of the segments, in order (see branchChains).
+    radius :             Radius of the tube.
+    subDivs :            Number of sides.
+    cosTable, sinTable : Cosine and sine of the angle of every side.
+    """
+    points = pMesh.points
+    first = len(points) // 3
+    matrix = turtle.segmentMatrix
+    # The first ring is the bottom of the first segment, exactly like appendCylinder
+    i = chain[0]
+    sideX, sideY, sideZ = matrix[9*i], matrix[9*i+3], matrix[9*i+6]
+    rings = [(turtle.segmentStart[3*i:3*i+3], (matrix[9*i+1], matrix[9*i+4], matrix[9*i+7]))]
+    for k, i in enumerate(chain):
+        direction = (matrix[9*i+1], matrix[9*i+4], matrix[9*i+7])
+        if k + 1 < len(chain):
+            j = chain[k+1]
+            tangent = _normalize(direction[0] + matrix[9*j+1], direction[1] + matrix[9*j+4], direction[2] + matrix[9*j+7])
+            rings.append((turtle.segmentEnd[3*i:3*i+3], tangent or direction))
+        else:
+            rings.append((turtle.segmentEnd[3*i:3*i+3], direction))
+
+    for (cX, cY, cZ), (tX, tY, tZ) in rings:
+        # Side axis projected on the plane of this ring
+        dot = sideX*tX + sideY*tY + sideZ*tZ
+        side = _normalize(sideX - dot*tX, sideY - dot*tY, sideZ - dot*tZ)
+        if side is not None:
+            sideX, sideY, sideZ = side
+        # Third axis, like the local Z of a segment
+        zX, zY, zZ = sideY*tZ - sideZ*tY, sideZ*tX - sideX*tZ, sideX*tY - sideY*tX
+        for c, s in zip(cosTable, sinTable):
+            points.extend((cX + radius * (c*sideX - s*zX), cY + radius * (c*sideY - s*zY), cZ + radius * (c*sideZ - s*zZ)))
+
+    connects = pMesh.faceConnects
+    for ring in range(len(rings) - 1):
+        bottom = first + ring * subDivs
+        top = bottom + subDivs
+        for k in range(subDivs):
+            nextK = (k + 1) % subDivs
+            connects.extend((bottom + k, bottom + nextK, top + nextK, top + k))
+    pMesh.faceCounts.extend([4] * (subDivs * (len(rings) - 1)))
+    # Caps
+    last = first + (len(rings) - 1) * subDivs
+    connects.extend(range(first + subDivs - 1, first - 1, -1))
+    connects.extend(range(last, last + subDivs))
+    pMesh.faceCounts.extend((subDivs, subDivs))
+
+def buildTubeMesh(turtle, subDivs, lod=None, chains=None):
+    """ Builds the branches as one mesh of continuous tubes, one per branch, instead of a cylinder per segment. A branch of
+    n segments has n+1 rings instead of 2n and only two caps.
+
+    turtle :    TurtleResult with the segments (see LS_turtle.interpretTurtle).
+    subDivs :   Number of sides of every tube.
+    lod :       LODPolicy choosing the sides of each branch, already fitted to the turtle. Branches it turns into cards
+                are built as cards, segment by segment.
+    chains :    The chains to build (see branchChains), all of them if None.
+
+    On Exit :   Returns a MeshData.
+
+        >>> from LS_turtle import interpretTurtle
+        >>> turtle = interpretTurtle("FF+FF", 0.2, 1.2, 25.2, 0.95, 0.85, seed=1)
+        >>> buildBranchMesh(turtle, 6).vertexCount(), buildTubeMesh(turtle, 6).vertexCount()
+        (48, 30)
+    """
+    tables = {}
+    mesh = MeshData()
+    if chains is None:
+        chains = branchChains(turtle)
+    for chain in chains:
+        radius = turtle.segmentRadius[chain[0]]
+        sides = subDivs if lod is None else lod.subDivsFor(radius, turtle.segmentLevel[chain[0]])
+        if not sides:
+            for i in chain:
+                appendCard(mesh, turtle.segmentStart[3*i:3*i+3], turtle.segmentMatrix[9*i:9*i+9], radius,
+                    turtle.segmentLength[i])
+            continue
+        if sides not in tables:
+            tables[sides] = ([math.cos(2*math.pi*k/sides) for k in range(sides)],
+                             [math.sin(2*math.pi*k/sides) for k in range(sides)])
+        cosTable, sinTable = tables[sides]
+        appendTube(mesh, turtle, chain, radius, sides, cosTable, sinTable)
+    return mesh
+
+def buildBranchMeshesByLevel(turtle, subDivs, lod=None):
+    """ Same as buildBranchMesh but it makes a mesh per branch level, so that they can still be selected or shaded apart.
+
+    On Exit :   Returns a dictionary with the branch level as key and its MeshData as value.
+    """
+    levels = {}
+    for i, level in enumerate(turtle.segmentLevel):
+        levels.setdefault(level, []).append(i)
+    return dict((level, buildBranchMesh(turtle, subDivs, segments, lod)) for level, segments in levels.items())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+    Plant Scattering Module:    <LS_scatter.py>
+
+    A forest made by pressing Create Geometry over and over again has a whole copy of every segment, leaf and material of
+    every plant, so the scene grows with the number of trees. Scattering builds just a few different plants, the
+    prototypes (same rules, different seeds), and then places thousands of instances of them. An instance shares the
+    geometry of its prototype and only adds a transform, so the scene grows with the number of prototypes instead.
+
+    This module works out where every instance goes, which prototype it is, and how it is turned and scaled, without Maya.
+    Instances can be scattered over a rectangle of the ground plane (XZ), optionally keeping a minimum distance between
+    them, or on a given set of points such as the vertices of a terrain. LS_interpreter.createScatter builds the result.
+
+        >>> scatter = scatterOnPlane(100, 3, 50, 50, seed=1, minDistance=2)
+        >>> scatter.count()
+        100
+        >>> sorted(set(scatter.prototype))
+        [0, 1, 2]
+"""
+import math
+import bisect
+import random
+from array import array
+
+from LS_string_rewriting import newSeed
+
+class ScatterResult(object):
+    """ Where the instances go. Positions are stored flat, three values per instance (x, y, z), like in
+    LS_turtle.TurtleResult.
+
+        position :   Position of each instance.
+        rotation :   Rotation of each instance around Y (degrees).
+        scale :      Uniform scale of each instance.
+        prototype :  Index of the prototype each instance is a copy of.
+    """
+    def __init__(self):
+        self.position = array("d")
+        self.rotation = array("d")
+        self.scale = array("d")
+        self.prototype = array("i")
+
+    def count(self):
+        return len(self.prototype)
+
+    def prototypeCounts(self, pPrototypes):
+        """ Returns a list with the number of instances of each of the pPrototypes prototypes. """
+        counts = [0] * pPrototypes
+        for k in self.prototype:
+            counts[k] += 1
+        return counts
+
+def _placer(pPrototypes, pRandom, weights, scaleRange):
+    """ Returns a function that adds an instance at a position to a ScatterResult, choosing its prototype (with the
+    given weights, or all alike), its rotation and its scale with pRandom. """
+    if weights is None:
+        weights = [1.0] * pPrototypes
+    if len(weights) != pPrototypes or sum(weights) <= 0:
+        raise ValueError("There must be one weight per prototype, and they can't all be 0.")
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    minScale, maxScale = scaleRange
+
+    def place(scatter, x, y, z):
+        scatter.position.extend((x, y, z))
+        scatter.prototype.append(min(bisect.bisect_right(cumulative, pRandom.random() * total), pPrototypes - 1))
+        scatter.rotation.append(pRandom.uniform(0.0, 360.0))
+        scatter.scale.append(pRandom.uniform(minScale, maxScale))
+    return place
+
+def scatterOnPlane(pCount, pPrototypes, width, depth, seed=None, minDistance=0.0, center=(0.0, 0.0, 0.0),
+    weights=None, scaleRange=(0.8, 1.2), maxAttempts=30):
+    """ Scatters instances over a rectangle of the ground plane.
+
+    pCount :        Number of instances.
+    pPrototypes :   Number of prototypes to choose from.
+    width, depth :  Size of the rectangle along X and Z.
+    seed :          Seed of the random numbers, the same seed gives the same scatter. None picks a new one.
+    minDistance :   Instances are kept at least this far from each other, 0 lets them overlap.
+    center :        Center of the rectangle.
+    weights :       How often each prototype is chosen compared to the others, or None for all alike.
+    scaleRange :    The scale of every instance is picked between these two.
+    maxAttempts :   Times an instance is tried somewhere else when it is too close to another one, before giving up.
+
+    On Exit :  Returns a ScatterResult. If the instances don't fit with minDistance between them, it has fewer than
+               pCount.
+    """
+    if seed is None:
+        seed = newSeed()
+    pRandom = random.Random(seed)
+    place = _placer(pPrototypes, pRandom, weights, scaleRange)
+    scatter = ScatterResult()
+    cX, cY, cZ = center
+    minX, minZ = cX - width / 2.0, cZ - depth / 2.0
+    if minDistance <= 0:
+        for i in range(pCount):
+            place(scatter, minX + pRandom.random() * width, cY, minZ + pRandom.random() * depth)
+        return scatter
+
+    # Dart throwing. A grid of cells minDistance wide means only the 3x3 cells around a point have to be checked
+    cellSize = float(minDistance)
+    cells = {}
+    minDistance2 = minDistance * minDistance
+    for i in range(pCount):
+        for attempt in range(maxAttempts):
+            x = minX + pRandom.random() * width
+            z = minZ + pRandom.random() * depth
+            cellX, cellZ = int(math.floor(x / cellSize)), int(math.floor(z / cellSize))
+            free = True
+            for nX in (cellX - 1, cellX, cellX + 1):
+                for nZ in (cellZ - 1, cellZ, cellZ + 1):
+                    for oX, oZ in cells.get((nX, nZ), ()):
+                        if (oX - x) * (oX - x) + (oZ - z) * (oZ - z) < minDistance2:
+                            free = False
+                            break
+                    if not free:
+                        break
+                if not free:
+                    break
+            if free:
+                cells.setdefault((cellX, cellZ), []).append((x, z))
+                place(scatter, x, cY, z)
+                break
+    return scatter
+
+def scatterOnPoints(pPoints, pPrototypes, seed=None, weights=None, scaleRange=(0.8, 1.2)):
+    """ Places an instance on each point of a list, such as the vertices of a terrain.
+
+    pPoints :  List of (x, y, z) points, or a flat list of coordinates.
+    The rest of the arguments are the same as scatterOnPlane's.
+
+    On Exit :  Returns a ScatterResult.
+
+        >>> scatterOnPoints([(0, 0, 0), (5, 1, 0)], 2, seed=3).count()
+        2
+    """
+    if seed is None:
+        seed = newSeed()
+    pRandom = random.Random(seed)
+    place = _placer(pPrototypes, pRandom, weights, scaleRange)
+    scatter = ScatterResult()
+    if pPoints and not isinstance(pPoints[0], (tuple, list)):
+        pPoints = [pPoints[i:i+3] for i in range(0, len(pPoints), 3)]
+    for x, y, z in pPoints:
+        place(scatter, x, y, z)
+    return scatter
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+    Plant Session Module:    <LS_session.py>
+
+    While an artist is tweaking a plant most changes are small: the angle slider moves, or the depth goes up by one. A
+    PlantSession remembers what was done last time, so that only what really changed is worked out again:
+
+        - The derived strings of every depth are kept, as SymbolBuffers (see LS_string_rewriting), while the axiom, rules
+          and seed stay the same. Going from depth n to n+1 rewrites the depth n string once more instead of starting
+          from the axiom, and going back is free.
+        - The turtle is only run again if the string or the geometric parameters (angle, length, radius, atenuations)
+          changed.
+        - LS_interpreter.updatePlant uses it to move the vertices of the plant that is already in the scene, instead of
+          deleting it and building it again.
+
+    Nothing in here needs Maya.
+
+        >>> session = PlantSession()
+        >>> len(session.derive("F", [[50, "F", "F[+F]F"], [50, "F", "F[-F]F"]], 4, seed=1))
+        201
+        >>> len(session.derive("F", [[50, "F", "F[+F]F"], [50, "F", "F[-F]F"]], 5, seed=1)) # Rewrites the depth 4 one
+        606
+"""
+from LS_string_rewriting import writeLSBuffer
+from LS_turtle import interpretTurtle, collapseForwardRuns
+from LS_cache import cachedWriteLS
+
+class PlantSession(object):
+    """ What the last plant was made of.
+
+        LStringVar :   The current derived string.
+        depth :        Its depth.
+        seed :         Its seed.
+        turtle :       The TurtleResult of the current string with the current geometric parameters, or None.
+        LStringTurtle :  The string the turtle read, the current one after collapseForwardRuns if it was asked for.
+        saved :        Segments saved by collapseForwardRuns on the current string.
+        built :        What createGeometry built in the scene for it (see LS_interpreter), or None.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.grammar = None     # Axiom, rules and seed of the strings
+        self.strings = {}       # Derived strings of the grammar, by depth
+        self.LStringVar = None
+        self.depth = None
+        self.seed = None
+        self.turtleArgs = None  # String and geometric parameters of the turtle
+        self.turtle = None
+        self.LStringTurtle = None
+        self.saved = 0
+        self.built = None
+
+    def derive(self, pW, pP, pDepth, seed=None, progress=None, cached=True):
+        """ Returns the string of the grammar at pDepth, reusing the strings derived before when possible. Without a
+        seed nothing is reused, as the same derivation can't be repeated. If anything has to be derived and progress is
+        given, it is called with the number of symbols derived so far every now and then. If cached is False the disk
+        cache (see LS_cache) is left alone, for seeds that won't be used again. """
+        grammar = (str(pW), [(float(prob), str(pred), str(succ)) for prob, pred, succ in pP], seed)
+        if grammar != self.grammar or seed is None:
+            self.grammar = grammar
+            self.strings = {}
+        if pDepth not in self.strings:
+            lower = [depth for depth in self.strings if depth < pDepth]
+            if lower:
+                # The random numbers only depend on the seed, generation and position, so carrying on from the depth n
+                # string gives the same result as starting from the axiom
+                depth = max(lower)
+                self.strings[pDepth] = writeLSBuffer(self.strings[depth], pP, pDepth - depth, seed=seed,
+                    startGeneration=depth, progress=progress)
+            elif cached:
+                self.strings[pDepth] = cachedWriteLS(pW, pP, pDepth, seed=seed, cache=self.cache, progress=progress,
+                    compact=True)
+            else:
+                self.strings[pDepth] = writeLSBuffer(pW, pP, pDepth, seed=seed, progress=progress)
+        self.LStringVar = self.strings[pDepth]
+        self.depth = pDepth
+        self.seed = seed
+        return self.LStringVar
+
+    def interpret(self, pRad, pStep, pAngle, length_atenuation, radius_atenuation, collapse=True):
+        """ Returns the TurtleResult of the current string (see LS_turtle.interpretTurtle), only running the turtle again
+        if the string or any of the parameters changed since last time. """
+        turtleArgs = (self.LStringVar, pRad, pStep, pAngle, length_atenuation, radius_atenuation, collapse)
+        if self.turtle is None or turtleArgs != self.turtleArgs:
+            LStringTurtle, self.saved = self.LStringVar, 0
+            if collapse:
+                LStringTurtle, self.saved = collapseForwardRuns(self.LStringVar)
+            self.LStringTurtle = LStringTurtle
+            self.turtle = interpretTurtle(LStringTurtle, pRad, pStep, pAngle, length_atenuation, radius_atenuation,
+                self.seed)
+            self.turtleArgs = turtleArgs
+        return self.turtle
@@ -6,10 +6,19 @@
     according to certain conventions (because L-System strings on their own they are nothing but a bunch of characters).
 
 '''
-import maya.cmds as cmds
 import random
+import bisect
+import math
+import re
+import mmap
+import tempfile
+import multiprocessing
+try:
+    import numpy
+except ImportError: # NumPy doesn't ship with every Maya version, writeLSNumpy falls back to writeLS without it
+    numpy = None
 
-def writeLS(pW, pP, pDepth):
+def writeLS(pW, pP, pDepth, seed=None, startGeneration=0):
     """ Iterates through the string. It will create a global string variable called "result" which is a concatenation of
     various character additions done when reading the Axiom or Word entered by the user (W) and comparing it to some rules.
 
@@ -24,6 +33,8 @@ def writeLS(pW, pP, pDepth):
                   Again, we can have multiple rules which apply to a same letter, that's why we take into account the
                   percentages --> Stochastic).
         pDepth :  Recursive index or number of iterations over the string.
+        seed :    Seed for the stochastic rules. The same seed always gives the same string. None picks a new one.
+        startGeneration :  Generation pW belongs to. Useful to carry on rewriting a string that was derived before.
 
         On Exit : Will return a result string. Thus it is recommendable binding the call to a variable.
 
@@ -40,7 +51,7 @@ def writeLS(pW, pP, pDepth):
 
         If the depth increases we carry the recursion one step further:
             >>> W = 'F'
-            >>> P = [100, 'F', 'F[+F]F[-F]F']
+            >>> P = [[100, 'F', 'F[+F]F[-F]F']]
             >>> depth = 2
             >>> string = writeLS(W, P, depth)
             >>> print string
@@ -60,79 +71,1292 @@ def writeLS(pW, pP, pDepth):
             ff+xx-ffff
             >>>
 
-        The way I worked out the probabilities is quite odd. We know a rule is specified X --> YY, so what I did is I
-        appended in a list the right hand side of the rule TIMED by the percentage number the user wrote. For instance if we
-        had [70, 'X', 'YY'] (70% chance for X to be replaced with YY) and [30, 'X', 'ZZ'] (30% chance for X to be replaced
-        with ZZ), I collect in the "choiceList" a bunch of 'ZZ' items and 'YY' items (I am lying, to optimize performance I
-        just store the index that point to these elements, otherwise we would have extremely heavy arrays).
-        In this particular case I would have seventy 'YY's and thirty 'ZZ's. Now If I pick an random value between 0-100 I
-        can access randomly an element in this list. So as we have many more 'YY's we will have more possibility to pick
-        one. I will explain it again later so that it is clearer. The bad things of this method are two:
+        When several rules share the same predecessor their probabilities are used as weights, they can be floating point
+        values and they don't even need to add up to 100. I used to build a "choiceList" with up to a hundred copies of
+        each rule index for every matching character, which was terribly slow and couldn't handle decimals. Now the rules
+        are compiled once into a Grammar (see compileRules) which keeps the running sum of the weights for each
+        predecessor, so picking a successor is just a random number and a binary search over a handful of values.
 
-            - Performancewise it takes quite a lot of memory.
-            - I cannot work with floating point values given that array index must be integers. I could get more precise
-            results if I make the list instead of being 100 items long, 1000.
+        writeLS used to call itself once per depth level, building every generation one character at a time. Now every
+        generation is rewritten in one go by rewriteGeneration, a single list comprehension for deterministic grammars,
+        and joined once. The previous generation is dropped as soon as the next one is done, so at the peak it holds the
+        last two generations, which is hardly more than the final string as they grow geometrically. streamLS gives the
+        same string in chunks, for the ones that really want to consume it bit by bit, but it does much more work per
+        symbol.
     """
-    if pDepth == 0:
-        return pW
+    grammar = compileRules(pP)
+    if seed is None:
+        seed = newSeed()
+    for generation in range(startGeneration, startGeneration+pDepth):
+        pW = rewriteGeneration(pW, grammar, seed, generation)
+    return pW
 
+class Grammar(object):
+    """ Production rules compiled into lookup tables. Rules are indexed by predecessor once, so rewriting a character is a
+    single dictionary access instead of a loop over every rule.
+
+        deterministic :  Dictionary predecessor --> successor for the predecessors that have just one rule.
+        stochastic :     Dictionary predecessor --> [successors, cumulative weights] for the ones that have several.
+        extended :       True if any rule is parametric or context sensitive (see Production). The rules of the symbols
+                         that have any of those are in productions instead, a dictionary symbol --> list of Production.
+                         The rest stay in the two dictionaries above, so they are rewritten just as quickly.
+    """
+    def __init__(self, pP):
+        self.extended = False
+        extended = set()    # Symbols with extended rules
+        for prob, pred, succ in pP:
+            if isExtendedRule(pred, succ):
+                self.extended = True
+                extended.add(Production(prob, pred, succ).symbol)
+        self.deterministic = {}
+        self.stochastic = {}
+        self.productions = {}
+        self.hasContext = False
+        self.specialModules = None
+        rules = {}
+        for prob, pred, succ in pP:
+            if isExtendedRule(pred, succ) or pred in extended:
+                production = Production(prob, pred, succ)
+                self.productions.setdefault(production.symbol, []).append(production)
+                if production.hasContext():
+                    self.hasContext = True
+            else:
+                rules.setdefault(pred, []).append((float(prob), succ))
+
+        for pred, choices in rules.items():
+            if len(choices) == 1:
+                self.deterministic[pred] = choices[0][1]
+                continue
+            total = sum([max(weight, 0.0) for weight, succ in choices])
+            cumulative = []
+            running = 0.0
+            for weight, succ in choices:
+                # If every weight is 0 there is no way to choose, so we consider all the rules equally likely
+                running += max(weight, 0.0) if total > 0 else 1.0
+                cumulative.append(running)
+            self.stochastic[pred] = [[succ for weight, succ in choices], cumulative]
+
+        if self.extended:
+            # What rewriteModules has to look at one by one: modules with parameters and symbols with extended or
+            # stochastic rules. Anything else is a plain symbol, rewritten with the deterministic dictionary.
+            symbols = "".join(sorted(set(self.productions) | set(self.stochastic)))
+            pattern = r"[^()]\([^()]*\)"
+            if symbols:
+                pattern += "|[%s]" % re.escape(symbols)
+            self.specialModules = re.compile(pattern)
+
+    def isDeterministic(self):
+        """ True when no predecessor has more than one rule, that is to say, the derivation is always the same. With
+        extended rules the context sensitive ones go before the rest (see rewriteModules), so a symbol may have one of
+        each. """
+        if self.extended:
+            for productions in self.productions.values():
+                contextual = len([production for production in productions if production.hasContext()])
+                if contextual > 1 or len(productions) - contextual > 1:
+                    return False
+        return not self.stochastic
+
+    def successor(self, pSymbol, pRandom):
+        """ Returns the string that replaces pSymbol, or None if no rule applies to it.
+
+            pSymbol :   Character being rewritten.
+            pRandom :   Uniform random value in [0,1) used to pick the rule when there are several.
+        """
+        succ = self.deterministic.get(pSymbol)
+        if succ is not None or pSymbol not in self.stochastic:
+            return succ
+        successors, cumulative = self.stochastic[pSymbol]
+        return successors[min(bisect.bisect_right(cumulative, pRandom*cumulative[-1]), len(successors)-1)]
+
+#--- PARAMETRIC AND CONTEXT SENSITIVE RULES ---#
+"""
+    Apart from the plain rules (one character replaced by a string) the predecessor can also be written as:
+
+        A(l,w)          Parametric. Matches A with two parameters, which can be used in the successor: F(l)A(l*0.7,w)
+        A(l,w) : l>1    The same, but just when the condition is true. Any Python expression with the parameters works.
+        B<A>C           Context sensitive. Matches A only when it comes after a B and before a C. Any of the two sides
+                        can be left out (B<A or A>C) and they can have parameters as well: B(x)<A(l)>C : x<l
+
+    Parameters are numbers written in brackets after the symbol, both in the axiom and in the derived strings: F(1.5).
+    When looking for the context, the rotation symbols (IGNORE_CONTEXT) are skipped and so are whole branches, so that in
+    'B[+F]A' the left context of A is B. When both context sensitive and context free rules match a module, only the
+    context sensitive ones are considered, so the context free rule of a symbol is what happens when no context applies.
+    Rules are compiled once into Python functions (see Production) and the strings
+    are split into modules with a regular expression, so nothing is parsed again symbol by symbol.
+"""
+IGNORE_CONTEXT = "+-&^<>*"  # Symbols skipped when looking for the left or right context
+
+_MODULE_RE = re.compile(r"(([^()])(?:\(([^()]*)\))?)")    # A symbol optionally followed by its parameters
+_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_EXPRESSION_GLOBALS = dict([(name, getattr(math, name)) for name in dir(math) if not name.startswith("_")])
+_EXPRESSION_GLOBALS.update({ "abs": abs, "min": min, "max": max, "__builtins__": {} })
+
+def _formatNumber(pValue):
+    """ Writes a parameter back into the string, as short as possible without losing precision. """
+    return "%.12g" % pValue
+
+def isExtendedRule(pPred, pSucc):
+    """ True if the rule needs the parametric / context sensitive machinery, i.e. it is not a plain character rule. """
+    return len(pPred) > 1 or "(" in pSucc
+
+def splitModules(pText):
+    """ Splits a rule's text into modules. Returns a list of 2-item lists: the symbol and the list of its parameter
+    expressions (as text). Expressions may contain brackets, so it doesn't use a regular expression.
+
+        For example:
+            >>> splitModules('F(l*0.5)[+A(sqrt(l),2)]')
+            [['F', ['l*0.5']], ['[', []], ['+', []], ['A', ['sqrt(l)', '2']], [']', []]]
+            >>>
+    """
+    modules = []
+    i = 0
+    while i < len(pText):
+        symbol = pText[i]
+        i += 1
+        if symbol in "()":
+            raise ValueError("Unexpected bracket in '%s'." % pText)
+        params = []
+        if i < len(pText) and pText[i] == "(":
+            depth = 0
+            start = i + 1
+            for j in range(i, len(pText)):
+                if pText[j] == "(":
+                    depth += 1
+                elif pText[j] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif pText[j] == "," and depth == 1:
+                    params.append(pText[start:j].strip())
+                    start = j + 1
+            if depth != 0:
+                raise ValueError("Unbalanced brackets in '%s'." % pText)
+            params.append(pText[start:j].strip())
+            i = j + 1
+        modules.append([symbol, params])
+    return modules
+
+def parseModules(pString):
+    """ Splits a derived string into modules. Returns a list of 3-item tuples: the text of the module, its symbol and
+    the text of its parameters (empty if it has none). """
+    return _MODULE_RE.findall(pString)
+
+def parseParams(pText):
+    """ Converts the parameters text of a module ('1.5,2') into a tuple of floats. """
+    if not pText:
+        return ()
+    return tuple([float(param) for param in pText.split(",")])
+
+def iterModules(pString):
+    """ Goes over a derived string yielding 2-item tuples: the symbol and a tuple with its parameters (empty for plain
+    symbols). It is how the interpreter reads the string, and it also works on anything that yields characters, like an
+    LRope. """
+    if isinstance(pString, basestring):
+        if "(" not in pString:
+            for symbol in pString:
+                yield symbol, ()
+        else:
+            for text, symbol, params in parseModules(pString):
+                yield symbol, parseParams(params)
+        return
+    if isinstance(pString, SymbolBuffer) and not pString.hasParams:
+        # Straight from the memory of the buffer, a view at a time
+        for start in range(0, len(pString), 65536):
+            for symbol in pString.view(start, start+65536):
+                yield symbol, ()
+        return
+    symbol = None
+    params = None
+    for c in pString:
+        if params is not None:
+            if c == ")":
+                yield symbol, parseParams("".join(params))
+                symbol = params = None
+            else:
+                params.append(c)
+        elif c == "(" and symbol is not None:
+            params = []
+        else:
+            if symbol is not None:
+                yield symbol, ()
+            symbol = c
+    if symbol is not None:
+        yield symbol, ()
+
+class Production(object):
+    """ A parametric and/or context sensitive rule, compiled. The condition and the successor are turned into Python
+    functions just once, taking as arguments the parameters of the left context, the predecessor and the right context
+    (in that order).
+
+        pProb :   Probability (weight) of this rule among the ones that match the same module.
+        pPred :   Predecessor, see the syntax above.
+        pSucc :   Successor. Parameters can be any expression of the predecessor's (and context's) parameters.
+
+        symbol :     Symbol this production rewrites.
+        params :     Number of parameters it needs, or None if written without brackets (then it matches any module with
+                     that symbol).
+        left :       [symbol, number of parameters or None] of the left context, or None.
+        right :      Same for the right context.
+        condition :  Function returning True when the rule applies, or None.
+        successor :  Function returning the successor string, or just the string if it doesn't use any parameter.
+        counts :     Dictionary symbol --> how many times it appears in the successor (used by predictGrowth).
+    """
+    __slots__ = ("probability", "symbol", "params", "left", "right", "condition", "successor", "counts", "rule")
+
+    def __init__(self, pProb, pPred, pSucc):
+        self.probability = max(float(pProb), 0.0)
+        self.rule = "%s -> %s" % (pPred, pSucc)
+        pred = pPred
+        condition = None
+        if len(pPred) > 1 and ":" in pPred:
+            pred, condition = pPred.split(":", 1)
+        pred = pred.strip()
+
+        # Context. A lonely '<' or '>' is just the turtle symbol.
+        left = right = None
+        if len(pred) > 1:
+            for separator in "<>":
+                parts = pred.split(separator)
+                if len(parts) > 2:
+                    raise ValueError("Can't understand the predecessor '%s'." % pPred)
+                if len(parts) == 2:
+                    if separator == "<":
+                        left, pred = parts[0].strip(), parts[1].strip()
+                    else:
+                        pred, right = parts[0].strip(), parts[1].strip()
+
+        names = []
+        modules = []
+        for text in [left, pred, right]:
+            if text is None:
+                modules.append(None)
+                continue
+            module = splitModules(text)
+            if len(module) != 1:
+                raise ValueError("Can't understand the predecessor '%s', every part must be a single symbol." % pPred)
+            symbol, params = module[0]
+            for name in params:
+                if not _NAME_RE.match(name):
+                    raise ValueError("'%s' is not a valid parameter name in '%s'." % (name, pPred))
+            names.extend(params)
+            hasBrackets = "(" in text
+            modules.append([symbol, len(params) if hasBrackets else None])
+        if len(set(names)) != len(names):
+            raise ValueError("Repeated parameter names in '%s'." % pPred)
+
+        self.left, predModule, self.right = modules
+        self.symbol, self.params = predModule
+        self.condition = self.compile(condition.strip(), names, pPred) if condition else None
+
+        # Successor: literal text and parameter expressions are glued together in a single expression
+        parts = []
+        literal = ""
+        successorModules = splitModules(pSucc)
+        self.counts = {}
+        for symbol, params in successorModules:
+            self.counts[symbol] = self.counts.get(symbol, 0) + 1
+        for symbol, params in successorModules:
+            if not params:
+                literal += symbol
+                continue
+            parts.append(repr(literal + symbol + "("))
+            parts.append(" + ',' + ".join(["_formatNumber(%s)" % param for param in params]))
+            literal = ")"
+        if not parts:
+            self.successor = pSucc
+        else:
+            parts.append(repr(literal))
+            self.successor = self.compile(" + ".join(parts), names, pSucc)
+
+    def compile(self, pExpression, pNames, pRule):
+        """ Turns an expression of the parameters into a function. Any name in it that is neither a parameter nor a
+        function of the math module is an error straight away, instead of a NameError in the middle of the derivation. """
+        namespace = dict(_EXPRESSION_GLOBALS)
+        namespace["_formatNumber"] = _formatNumber
+        try:
+            function = eval("lambda %s: %s" % (", ".join(pNames), pExpression), namespace)
+        except SyntaxError:
+            raise ValueError("Syntax error in '%s'." % pRule)
+        codes = [function.func_code]
+        while codes:
+            code = codes.pop()
+            for name in code.co_names:
+                if name not in namespace:
+                    raise ValueError("Unknown name '%s' in '%s'." % (name, pRule))
+            codes.extend([const for const in code.co_consts if hasattr(const, "co_names")])
+        return function
+
+    def hasContext(self):
+        return self.left is not None or self.right is not None
+
+    def matches(self, pModule, pParams, pLeft, pRight):
+        """ Returns the list of arguments for the condition and successor if the rule applies, or None if it doesn't.
+
+            pModule :   (text, symbol, parameters text) of the module being rewritten, as given by parseModules.
+            pParams :   Its parameters (tuple of floats).
+            pLeft :     Module that works as its left context, or None.
+            pRight :    Same for the right context.
+        """
+        if self.params is not None and len(pParams) != self.params:
+            return None
+        args = []
+        if self.left is not None:
+            if pLeft is None or pLeft[1] != self.left[0]:
+                return None
+            leftParams = parseParams(pLeft[2])
+            if self.left[1] is not None and len(leftParams) != self.left[1]:
+                return None
+            if self.left[1]:
+                args.extend(leftParams)
+        if self.params:
+            args.extend(pParams)
+        if self.right is not None:
+            if pRight is None or pRight[1] != self.right[0]:
+                return None
+            rightParams = parseParams(pRight[2])
+            if self.right[1] is not None and len(rightParams) != self.right[1]:
+                return None
+            if self.right[1]:
+                args.extend(rightParams)
+        if self.condition is not None:
+            try:
+                if not self.condition(*args):
+                    return None
+            except (ArithmeticError, ValueError):
+                return None
+            except TypeError, e:
+                raise ValueError("Error in the condition of '%s': %s." % (self.rule, e))
+        return args
+
+    def apply(self, pArgs):
+        """ Successor string for the given arguments (see matches). """
+        if isinstance(self.successor, basestring):
+            return self.successor
+        try:
+            return self.successor(*pArgs)
+        except (ArithmeticError, TypeError, ValueError), e:
+            raise ValueError("Error in the successor of '%s' with parameters %s: %s." % (self.rule,
+                ", ".join([_formatNumber(arg) for arg in pArgs]), e))
+
+def findContexts(pModules):
+    """ Works out the left and right context of every module in one pass each way. Returns two lists with the index of
+    the module working as left / right context of each one (or None). Rotations are skipped, a branch is skipped when
+    looking to the right and, inside a branch, the left context is the module the branch started from. """
+    count = len(pModules)
+    left = [None] * count
+    right = [None] * count
+    last = None
+    stack = []
+    for i in range(0, count):
+        symbol = pModules[i][1]
+        if symbol == "[":
+            stack.append(last)
+        elif symbol == "]":
+            last = stack.pop() if stack else None
+        else:
+            left[i] = last
+            if symbol not in IGNORE_CONTEXT:
+                last = i
+    following = None
+    stack = []
+    for i in range(count-1, -1, -1):
+        symbol = pModules[i][1]
+        if symbol == "]":
+            stack.append(following)
+            following = None
+        elif symbol == "[":
+            following = stack.pop() if stack else None
+        else:
+            right[i] = following
+            if symbol not in IGNORE_CONTEXT:
+                following = i
+    return left, right
+
+def rewriteModules(pW, pGrammar, pKey, startPosition=0):
+    """ Rewrites pW once with an extended grammar (see Production).
+
+        pW :             String being rewritten.
+        pGrammar :       Compiled Grammar.
+        pKey :           Random stream of this generation (see streamKey), used when several rules match a module.
+        startPosition :  Position of pW in its generation, when it is just a chunk of it.
+
+    Without context sensitive rules only the modules in pGrammar.specialModules are rewritten one by one, the runs of
+    plain symbols in between go through the deterministic dictionary like in writeLS.
+    """
+    deterministic = pGrammar.deterministic
+    stochastic = pGrammar.stochastic
+    pieces = []
+    if not pGrammar.hasContext:
+        position = startPosition
+        last = 0
+        for match in pGrammar.specialModules.finditer(pW):
+            start = match.start()
+            if start > last:
+                pieces.append("".join([deterministic.get(c, c) for c in pW[last:start]]))
+                position += start - last
+            text = match.group()
+            if text in stochastic: # The usual case of a stochastic grammar, a plain symbol with several rules
+                pieces.append(pGrammar.successor(text, streamRandom(pKey, position)))
+            else:
+                pieces.append(_rewriteModule((text, text[0], text[2:-1]), pGrammar, pKey, position))
+            position += 1
+            last = match.end()
+        if last < len(pW):
+            pieces.append("".join([deterministic.get(c, c) for c in pW[last:]]))
+        return "".join(pieces)
+
+    modules = parseModules(pW)
+    productions = pGrammar.productions
+    left, right = findContexts(modules)
+    for i in range(0, len(modules)):
+        module = modules[i]
+        symbol = module[1]
+        if symbol in productions:
+            leftModule = modules[left[i]] if left[i] is not None else None
+            rightModule = modules[right[i]] if right[i] is not None else None
+            pieces.append(_rewriteModule(module, pGrammar, pKey, startPosition+i, leftModule, rightModule))
+        elif symbol in deterministic:
+            pieces.append(deterministic[symbol])
+        elif symbol in stochastic:
+            pieces.append(pGrammar.successor(symbol, streamRandom(pKey, startPosition+i)))
+        else:
+            pieces.append(module[0])
+    return "".join(pieces)
+
+def _rewriteModule(pModule, pGrammar, pKey, pPosition, leftModule=None, rightModule=None):
+    """ Successor of one module (text, symbol, parameters text) of rewriteModules, pPosition being its position in the
+    generation. """
+    symbol = pModule[1]
+    candidates = pGrammar.productions.get(symbol)
+    if candidates is None:
+        successor = pGrammar.deterministic.get(symbol)
+        if successor is not None:
+            return successor
+        if symbol in pGrammar.stochastic:
+            return pGrammar.successor(symbol, streamRandom(pKey, pPosition))
+        return pModule[0]
+    params = parseParams(pModule[2])
+    matching = []
+    for production in candidates:
+        args = production.matches(pModule, params, leftModule, rightModule)
+        if args is not None:
+            matching.append([production, args])
+    if not matching:
+        return pModule[0]
+    if len(matching) > 1:
+        # Context sensitive rules take precedence, the context free ones are only there for when no context applies
+        contextual = [candidate for candidate in matching if candidate[0].hasContext()]
+        if contextual:
+            matching = contextual
+    chosen = matching[0]
+    if len(matching) > 1:
+        weights = [production.probability for production, args in matching]
+        total = sum(weights)
+        if total <= 0:
+            weights = [1.0] * len(matching)
+            total = float(len(matching))
+        target = streamRandom(pKey, pPosition) * total
+        for candidate, weight in zip(matching, weights):
+            chosen = candidate
+            target -= weight
+            if target < 0:
+                break
+    return chosen[0].apply(chosen[1])
+
+def compileRules(pP):
+    """ Compiles the production rules (same format as in writeLS) into a Grammar. If pP is already a Grammar it is returned
+    as it is, so that all the functions of this module accept both. """
+    if isinstance(pP, Grammar):
+        return pP
+    return Grammar(pP)
+
+def streamLS(pW, pP, pDepth, chunkSize=65536, seed=None, startGeneration=0, startPosition=0):
+    """ Iterative and streaming version of the rewriting. Instead of building each generation in memory it walks the
+    derivation depth first: every symbol of the axiom is expanded down to the last generation before moving on to the
+    next one, so the only thing we keep around is a stack with one successor per depth level.
+
+        pW :              Axiom, the initial word.
+        pP :              Production rules, same format as in writeLS, or a compiled Grammar.
+        pDepth :          Number of iterations over the string.
+        chunkSize :       Approximate number of characters of every chunk yielded.
+        seed :            Seed of the random numbers used by stochastic rules (see stableRandom). None picks a new one.
+        startGeneration : Generation pW belongs to. Useful to carry on rewriting a string that was derived before.
+        startPosition :   Position of pW inside that generation, when pW is just a piece of it. Only for one generation
+                          (pDepth 1) of a stochastic grammar: where the successors of the piece land in the generations
+                          after that depends on everything before it, so ValueError is raised for more.
+
+        On Exit : It is a generator. It yields consecutive chunks of the final string, which joined together give exactly
+                  what writeLS returns.
+
+        For example:
+            >>> P = [[100, 'F', 'F[+F]F[-F]F']]
+            >>> for chunk in streamLS('F', P, 1, chunkSize=4):
+            ...     print chunk
+            F[+F]F[-F]F
+            >>> "".join(streamLS('F', P, 4)) == writeLS('F', P, 4)
+            True
+            >>> P = [[50, 'F', 'F[+F]F'], [50, 'F', 'F[-F]F']]
+            >>> "".join(streamLS('FF', P, 1, seed=3, startPosition=2)) == writeLS('FFFF', P, 1, seed=3)[12:]
+            True
+            >>>
+
+    For stochastic grammars we also need to know where each symbol is, because the random number that picks its rule
+    depends on its generation and its position in it. Depth first, the symbols of every generation are still read from
+    left to right, so a counter per generation is enough. The only catch is that a character with no rule is copied
+    straight to the output, so it has to be counted in all the generations below it too.
+    """
+    grammar = compileRules(pP)
+    deterministic = grammar.deterministic
+    stochastic = grammar.stochastic
+    if startPosition and pDepth > 1 and not grammar.isDeterministic():
+        raise ValueError("A piece of a generation can only be rewritten one generation at a time with random rules.")
+    if grammar.extended and pDepth > 0:
+        # Context sensitive rules need the whole generation at hand, so this one goes generation by generation
+        if seed is None:
+            seed = newSeed()
+        for generation in range(startGeneration, startGeneration+pDepth):
+            pW = rewriteModules(pW, grammar, streamKey(seed, generation), startPosition)
+        pDepth = 0
+    if pDepth <= 0 or not (deterministic or stochastic):
+        for i in range(0, len(pW), chunkSize):
+            yield pW[i:i+chunkSize]
+        return
+    if stochastic:
+        if seed is None:
+            seed = newSeed()
+        streams = [streamKey(seed, startGeneration+g) for g in range(0, pDepth)]
+        counters = [0] * pDepth # Position of the next symbol read in each generation
+        counters[0] = startPosition
     else:
-        tempList = ""
-        for i in range(0, len(pW)): # Search for coincidences in the string
-            coincidence = []
-            for j in range(0, len(pP)):
-                if pW[i] == pP[j][1]: # IF the current letter matches any of the rule cases... p[X][1] is the predecessor
-                    coincidence.append([i,j]) # Appends the index of the string where rule satisfies and the rule index
-            """
-            For example:
-            >>> word = 'F'
-            >>> rules = [ [50, 'F', 'GF'],
-                          [50, 'F', 'ff'] ]
-            What will happen is that we will go over each character of the word and compare to the rules. Let's do it. We
-            start with "word" which is "F". We will compare it to ALL the predecessors to see if they are the same. So, as
-            "word" (F) is the same char as rules[0][1] (F) we will add in the coincidence array the touple [0,0], or [X,Y] 
-            which can be understood as "We have found a coincidence in word[X] matching the rule[Y]".
-            """
-            if len(coincidence) == 0: # IF coincidence is empty
-                tempList += pW[i] # Just add the current character
-            elif len(coincidence) == 1: # ELSE IF it finds just one coincidence
-                tempList += pP[coincidence[0][1]][2] # Add the right hand side content (sucessor) of the rule.
+        counters = None
+
+    pieces = []     # Pieces of the current chunk, joined just once when the chunk is big enough
+    size = 0
+    stack = [[pW, 0, pDepth]] # Each level stores [string being read, current index, remaining depth]
+    while stack:
+        if size >= chunkSize:
+            yield "".join(pieces)
+            pieces = []
+            size = 0
+        level = stack[-1]
+        word, i, depth = level
+        if i >= len(word):
+            stack.pop()
+            continue
+        level[1] = i + 1
+        symbol = word[i]
+        if counters is not None:
+            generation = pDepth - depth
+            position = counters[generation]
+            counters[generation] = position + 1
+        successor = deterministic.get(symbol)
+        if successor is None:
+            if symbol not in stochastic: # Characters with no rule are copied as they are
+                pieces.append(symbol)
+                size += 1
+                if counters is not None:
+                    for g in range(generation+1, pDepth):
+                        counters[g] += 1
+                continue
+            successor = grammar.successor(symbol, streamRandom(streams[generation], position))
+        if depth == 1: # Last generation, the successor goes straight to the output
+            pieces.append(successor)
+            size += len(successor)
+        else:
+            stack.append([successor, 0, depth-1])
+    if pieces:
+        yield "".join(pieces)
+
+#--- COUNTER-BASED RANDOM NUMBERS ---#
+MASK64 = 0xFFFFFFFFFFFFFFFF
+GOLDEN64 = 0x9E3779B97F4A7C15
+
+def _mix64(z):
+    """ SplitMix64 finaliser. Scrambles the bits of a 64-bit integer so that close inputs give unrelated outputs. """
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def newSeed():
+    """ Picks a new seed from the random module, so calling random.seed() beforehand still makes everything repeatable. """
+    return random.getrandbits(32)
+
+def streamKey(pSeed, pGeneration):
+    """ Key of the random stream of one generation, see stableRandom. Computing it once per generation saves time. """
+    return _mix64((_mix64(pSeed & MASK64) + (pGeneration & MASK64) * GOLDEN64) & MASK64)
+
+def streamRandom(pKey, pPosition):
+    """ Random value in [0,1) for the symbol at pPosition of the generation whose streamKey is pKey. """
+    return (_mix64((pKey + (pPosition+1) * GOLDEN64) & MASK64) >> 11) * (1.0 / 9007199254740992)
+
+def stableRandom(pSeed, pGeneration, pPosition):
+    """ Random value in [0,1) that only depends on (seed, generation, position). The global random module gives a
+    different number depending on how many were drawn before, so the same plant could only be reproduced by deriving it
+    exactly in the same order. With this one the rule picked for a symbol is always the same whether the string is
+    computed serially, in chunks, in parallel or carrying on from a previous depth.
+
+        For example:
+            >>> stableRandom(7, 2, 1000) == stableRandom(7, 2, 1000)
+            True
+            >>>
+    """
+    return streamRandom(streamKey(pSeed, pGeneration), pPosition)
+
+def stableRandomArray(pSeed, pGeneration, pPositions):
+    """ NumPy version of stableRandom for a whole array of positions at once. Gives exactly the same values. """
+    key = numpy.uint64(streamKey(pSeed, pGeneration))
+    with numpy.errstate(over="ignore"):
+        z = key + (pPositions.astype(numpy.uint64) + numpy.uint64(1)) * numpy.uint64(GOLDEN64)
+        z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> numpy.uint64(31))
+    return (z >> numpy.uint64(11)).astype(numpy.float64) * (1.0 / 9007199254740992)
+
+class DerivedString(object):
+    """ Read-only view of the string writeLS would return, without generating it. For every predecessor and every depth we
+    store how long its expansion is (and the running sum over its successor), which is enough to find out which symbol
+    lays at any index by going down the derivation tree: at each level we just look for the right child with a binary
+    search. It only works for deterministic grammars, otherwise the string is not unique.
+
+        pW :      Axiom, the initial word.
+        pP :      Production rules, same format as in writeLS, or a compiled Grammar.
+        pDepth :  Number of iterations over the string.
+
+        For example:
+            >>> derived = DerivedString('F', [[100, 'F', 'F[+F]F[-F]F']], 12)
+            >>> derived.length()
+            610351561
+            >>> derived[1000000]
+            '-'
+            >>> derived[:11]
+            'F[+F]F[-F]F'
+            >>>
+    """
+    def __init__(self, pW, pP, pDepth):
+        self.grammar = compileRules(pP)
+        if self.grammar.extended:
+            raise ValueError("Random access doesn't work with parametric or context sensitive rules.")
+        if not self.grammar.isDeterministic():
+            raise ValueError("Random access needs a deterministic grammar, there are several rules for '%s'."
+                % "', '".join(sorted(self.grammar.stochastic)))
+        self.axiom = pW
+        self.depth = max(pDepth, 0)
+
+        rules = self.grammar.deterministic
+        # self._prefix[d][symbol] is the running sum of the lengths of the successor's characters expanded d-1 times
+        self._prefix = [{}]
+        lengths = {}
+        for d in range(1, self.depth+1):
+            prefixes = {}
+            for pred, succ in rules.items():
+                running = 0
+                prefix = []
+                for c in succ:
+                    running += lengths.get(c, 1)
+                    prefix.append(running)
+                prefixes[pred] = prefix
+            self._prefix.append(prefixes)
+            lengths = dict([(pred, prefix[-1] if prefix else 0) for pred, prefix in prefixes.items()])
+
+        running = 0
+        self._axiomPrefix = []
+        for c in pW:
+            running += lengths.get(c, 1)
+            self._axiomPrefix.append(running)
+
+    def length(self):
+        """ Length of the derived string. It is a long integer, so it doesn't overflow on very deep derivations. """
+        return self._axiomPrefix[-1] if self._axiomPrefix else 0
+
+    def __len__(self):
+        return self.length()
+
+    def _locate(self, pIndex):
+        """ Goes down the derivation tree towards pIndex. Returns the stack of [word, index, remaining depth] levels leading
+        to it, the last one pointing to the symbol itself. """
+        rules = self.grammar.deterministic
+        stack = []
+        word = self.axiom
+        prefix = self._axiomPrefix
+        d = self.depth
+        offset = pIndex
+        while True:
+            k = bisect.bisect_right(prefix, offset)
+            if k:
+                offset -= prefix[k-1]
+            symbol = word[k]
+            if d == 0 or symbol not in rules:
+                stack.append([word, k, d])
+                return stack
+            stack.append([word, k+1, d])
+            word = rules[symbol]
+            prefix = self._prefix[d][symbol]
+            d -= 1
+
+    def symbolAt(self, pIndex):
+        """ Returns the symbol at position pIndex (negative values count from the end, as usual). """
+        total = self.length()
+        if pIndex < 0:
+            pIndex += total
+        if pIndex < 0 or pIndex >= total:
+            raise IndexError("Index %s out of range, the derived string has %s symbols." % (pIndex, total))
+        word, k, d = self._locate(pIndex)[-1]
+        return word[k]
+
+    def iterChunks(self, pStart=0, pStop=None, chunkSize=65536):
+        """ Streams the symbols between pStart and pStop in chunks, starting the walk right at pStart. Handy to page
+        through huge derivations. """
+        total = self.length()
+        if pStop is None or pStop > total:
+            pStop = total
+        remaining = pStop - pStart
+        if pStart < 0 or remaining <= 0:
+            return
+        rules = self.grammar.deterministic
+        stack = self._locate(pStart)
+        pieces = []
+        size = 0
+        while stack and remaining > 0:
+            if size >= chunkSize:
+                yield "".join(pieces)
+                pieces = []
+                size = 0
+            level = stack[-1]
+            word, i, d = level
+            if i >= len(word):
+                stack.pop()
+                continue
+            level[1] = i + 1
+            symbol = word[i]
+            if d == 0 or symbol not in rules:
+                pieces.append(symbol)
+                size += 1
+                remaining -= 1
             else:
-                """
-                WORKING OUT THE PROBABILITIES PROBLEM
-                This is the most complicated part. To work out the percentages I do it using a rudimentary way. I create a
-                a list, called choiceList. Then I iterate over the coincidence list we created before which contains all the
-                rule matchings. Refer back to the previous explanation if you don't know what I am talking about. It is
-                rudimentary because what I put in the choiceList the successors of the rules multiple times in the array.
-                
-                Let me explain myself with a simple example:
-                >>> word = 'F'
-                >>> rules = [ [30, 'F', 'P'],
-                              [70, 'F', 'Q'] ]
-                
-                Imagine we were in this case. choiceList would be an array containing 30 times the item 'P' and 70 times the
-                element 'Q'. So it would be huge.
-
-                    choiceList --> [[0,0,0, ...thirty times...],[1,1,1,1,1,1,1, ...seventy times...]]
-                
-                Then I flatten the list so that I have a one-dimensional array:
-
-                    flattenedList --> [0,0,0,...thirty items...,1,1,1,1,1,1,1,...seventy times...]
-
-                Now it is so easy because I pick a random number between 0 and the length of the array which will be used to
-                select the successor through the rule index.
-                """
-                choiceList = []
-
-                for k in range(0,len(coincidence)):
-                    choiceList.append(int(pP[coincidence[k][1]][0]) * [coincidence[k][1]])
-
-                flattenedList = [] # As we get a multidimensional array I must flatten it to 1D in order to pick an item just using one single index
-                for item in choiceList:
-                    flattenedList.extend(item)
-                # We pick one of the possible sucessors and we carry on
-                randomIndex = random.randint(0, len(flattenedList)-1)
-                tempList += pP[flattenedList[randomIndex]][2]
-
-        pW = tempList
-        return writeLS(pW, pP, pDepth-1) # Recursive call
\ No newline at end of file
+                stack.append([rules[symbol], 0, d-1])
+        if pieces:
+            yield "".join(pieces)
+
+    def __getitem__(self, pKey):
+        if isinstance(pKey, slice):
+            start, stop, step = pKey.indices(self.length())
+            if step < 0:
+                return "".join(self.iterChunks(stop+1, start+1))[::step]
+            return "".join(self.iterChunks(start, stop))[::step]
+        return self.symbolAt(pKey)
+
+def derivedLength(pW, pP, pDepth):
+    """ Length of writeLS(pW, pP, pDepth) without generating it (deterministic grammars only). """
+    return DerivedString(pW, pP, pDepth).length()
+
+def symbolAt(pW, pP, pDepth, pIndex):
+    """ Symbol at position pIndex of writeLS(pW, pP, pDepth) without generating it (deterministic grammars only). """
+    return DerivedString(pW, pP, pDepth).symbolAt(pIndex)
+
+class LNode(object):
+    """ Node of an LRope. It stands for a symbol expanded a certain number of times: its children are the nodes of the
+    successor's characters expanded once less. Leaves (symbols that are not rewritten any more) have no children. """
+    __slots__ = ("symbol", "children", "length")
+
+    def __init__(self, symbol, children=None):
+        self.symbol = symbol
+        self.children = children
+        self.length = sum([child.length for child in children]) if children is not None else 1
+
+class LRope(object):
+    """ Grammar-compressed representation of a derived string. Deterministic L-Systems are extremely repetitive: every 'F'
+    at the same depth expands to exactly the same substring. So instead of storing the string we store one LNode per
+    (symbol, depth) pair and share it everywhere it appears, which makes the structure grow linearly with the depth
+    instead of exponentially.
+
+    It behaves like a read-only string: len(), iteration (a streaming walk over the nodes), indexing and str() to flatten
+    it, so it can be given straight to LS_interpreter.createGeometry.
+
+        pW :      Axiom, the initial word.
+        pP :      Production rules, same format as in writeLS, or a compiled Grammar. It must be deterministic.
+        pDepth :  Number of iterations over the string.
+    """
+    def __init__(self, pW, pP, pDepth):
+        grammar = compileRules(pP)
+        if grammar.extended:
+            raise ValueError("A rope doesn't work with parametric or context sensitive rules.")
+        if not grammar.isDeterministic():
+            raise ValueError("A rope needs a deterministic grammar, there are several rules for '%s'."
+                % "', '".join(sorted(grammar.stochastic)))
+        self.rules = grammar.deterministic
+        self.nodes = {} # Shared nodes, keyed by (symbol, depth)
+        self.root = LNode(None, tuple([self.expand(c, max(pDepth, 0)) for c in pW]))
+
+    def expand(self, pSymbol, pDepth):
+        """ Returns the shared node for pSymbol expanded pDepth times, building the ones it depends on if needed. """
+        if pDepth == 0 or pSymbol not in self.rules:
+            pDepth = 0
+        key = (pSymbol, pDepth)
+        node = self.nodes.get(key)
+        if node is None:
+            for d in range(0, pDepth+1): # Bottom up, so that we never recurse more than one level
+                if (pSymbol, d) not in self.nodes:
+                    if d == 0:
+                        self.nodes[(pSymbol, 0)] = LNode(pSymbol)
+                    else:
+                        self.nodes[(pSymbol, d)] = LNode(pSymbol,
+                            tuple([self.expand(c, d-1) for c in self.rules[pSymbol]]))
+            node = self.nodes[key]
+        return node
+
+    def __len__(self):
+        return self.root.length
+
+    def iterChunks(self, chunkSize=65536):
+        """ Streams the string in chunks walking the nodes depth first. """
+        pieces = []
+        stack = [[self.root.children, 0]]
+        while stack:
+            level = stack[-1]
+            children, i = level
+            if i >= len(children):
+                stack.pop()
+                continue
+            level[1] = i + 1
+            node = children[i]
+            if node.children is None:
+                pieces.append(node.symbol)
+                if len(pieces) >= chunkSize:
+                    yield "".join(pieces)
+                    pieces = []
+            else:
+                stack.append([node.children, 0])
+        if pieces:
+            yield "".join(pieces)
+
+    def __iter__(self):
+        for chunk in self.iterChunks():
+            for symbol in chunk:
+                yield symbol
+
+    def __getitem__(self, pIndex):
+        if isinstance(pIndex, slice):
+            return str(self)[pIndex]
+        if pIndex < 0:
+            pIndex += self.root.length
+        if pIndex < 0 or pIndex >= self.root.length:
+            raise IndexError("Index out of range, the rope has %s symbols." % self.root.length)
+        node = self.root
+        while node.children is not None:
+            for child in node.children:
+                if pIndex < child.length:
+                    node = child
+                    break
+                pIndex -= child.length
+        return node.symbol
+
+    def __str__(self):
+        return "".join(self.iterChunks())
+
+def writeLSRope(pW, pP, pDepth):
+    """ Same as writeLS but returns an LRope instead of a flat string (deterministic grammars only).
+
+        For example:
+            >>> rope = writeLSRope('F', [[100, 'F', 'F[+F]F[-F]F']], 10)
+            >>> len(rope), len(rope.nodes)
+            (24414061, 15)
+            >>>
+    """
+    return LRope(pW, pP, pDepth)
+
+#--- COMPACT SYMBOL BUFFER ---#
+MMAP_THRESHOLD = 64 * 1024 * 1024   # Bytes a SymbolBuffer keeps in memory before moving to a memory-mapped temporary file
+
+class SymbolBuffer(object):
+    """ A derived string kept as one byte per symbol in a bytearray, which grows in place while the chunks of the
+    derivation come in, instead of a list of chunks joined at the end (twice the memory for a moment). When it goes over the
+    threshold it is moved to a temporary file and memory-mapped, so the operating system decides what stays in memory.
+
+    It can be read like a string (len, indexing, slicing, iterating) and, without copying anything, through view() and
+    iterModules. Slices are copies, like with strings, views aren't.
+
+        >>> symbols = writeLSBuffer('F', [[100, 'F', 'F[+F]F']], 3, threshold=16)
+        >>> len(symbols), symbols[5], symbols[:6], str(symbols.view(1, 5))
+        (66, 'F', 'F[+F]F', '[+F]')
+        >>> symbols.isMapped()
+        True
+    """
+    def __init__(self, threshold=MMAP_THRESHOLD):
+        self.threshold = threshold
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+        self.hasParams = False  # Whether any module has parameters, so that they have to be parsed
+
+    def append(self, pChunk):
+        """ Adds a chunk of symbols at the end. """
+        if "(" in pChunk:
+            self.hasParams = True
+        if self.file is None and self.threshold is not None and self.size + len(pChunk) > self.threshold:
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self.data)
+            self.data = None
+        if self.file is not None:
+            self.file.write(pChunk)
+        else:
+            self.data.extend(pChunk)
+        self.size += len(pChunk)
+
+    def finish(self):
+        """ Tells that no more chunks are coming. It must be called before reading a buffer that went to a file. """
+        if self.file is not None and self.data is None:
+            self.file.flush()
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else bytearray()
+        return self
+
+    def isMapped(self):
+        return self.file is not None
+
+    def close(self):
+        """ Frees the memory map and the temporary file. """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.file is not None:
+            self.file.close()
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, pIndex):
+        if isinstance(pIndex, slice):
+            return str(self.data[pIndex])
+        if pIndex < 0:
+            pIndex += self.size
+        if not 0 <= pIndex < self.size:
+            raise IndexError("SymbolBuffer index out of range")
+        return chr(self.data[pIndex]) if isinstance(self.data, bytearray) else self.data[pIndex]
+
+    def view(self, pStart=0, pStop=None):
+        """ Read-only view of the symbols from pStart to pStop, sharing the memory of the buffer. """
+        if pStop is None or pStop > self.size:
+            pStop = self.size
+        return buffer(self.data, pStart, max(pStop - pStart, 0))
+
+    def iterChunks(self, chunkSize=65536):
+        """ Yields the symbols in strings of chunkSize characters, like LRope.iterChunks. """
+        for start in range(0, self.size, chunkSize):
+            yield str(self.data[start:start+chunkSize])
+
+    def __iter__(self):
+        for chunk in self.iterChunks():
+            for symbol in chunk:
+                yield symbol
+
+    def __str__(self):
+        return str(self.data[:])
+
+def writeLSBuffer(pW, pP, pDepth, seed=None, threshold=MMAP_THRESHOLD, startGeneration=0, progress=None):
+    """ Same as writeLS but the result is a SymbolBuffer, memory-mapped if it gets bigger than threshold bytes. The
+    generations before the last one are rewritten like in writeLS, the last one a chunk at a time straight into the
+    buffer, so the final string is never held as a str. pW can be a SymbolBuffer too, to carry on from it.
+
+        progress :  If given, it is called with the number of symbols derived so far after every chunk.
+
+        >>> str(writeLSBuffer(writeLSBuffer('F', [[100, 'F', 'F[+F]F']], 1), [[100, 'F', 'F[+F]F']], 1,
+        ...     startGeneration=1)) == writeLS('F', [[100, 'F', 'F[+F]F']], 2)
+        True
+    """
+    grammar = compileRules(pP)
+    if seed is None:
+        seed = newSeed()
+    symbols = SymbolBuffer(threshold)
+    if grammar.extended:
+        # Contexts and parameters don't split at any position, so the whole string is derived first
+        if isinstance(pW, SymbolBuffer):
+            pW = str(pW)
+        pW = writeLS(pW, grammar, pDepth, seed, startGeneration)
+        pDepth = 0
+    last = startGeneration + pDepth - 1
+    for generation in range(startGeneration, last):
+        pW = "".join(_rewriteChunks(pW, grammar, seed, generation))
+    chunks = _rewriteChunks(pW, grammar, seed, last) if pDepth > 0 else _rewriteChunks(pW, None, seed, last)
+    for chunk in chunks:
+        symbols.append(chunk)
+        if progress is not None:
+            progress(len(symbols))
+    return symbols.finish()
+
+def _rewriteChunks(pW, grammar, seed, generation, chunkSize=65536):
+    """ Rewrites a generation of a context free grammar (or just copies it if grammar is None) a chunk at a time. pW
+    can be a string or a SymbolBuffer. """
+    for start in range(0, len(pW), chunkSize):
+        chunk = pW[start:start+chunkSize]
+        yield chunk if grammar is None else rewriteGeneration(chunk, grammar, seed, generation, start)
+
+def writeLSNumpy(pW, pP, pDepth, seed=None):
+    """ NumPy version of writeLS. The string is stored as an array of bytes and every generation is computed in bulk
+    instead of character by character:
+
+        1. Each byte is mapped to the index of its successor with a lookup table (bytes with no rule are their own
+           successor). Stochastic predecessors get their random numbers all at once for the whole generation.
+        2. The lengths of the successors are accumulated, which tells where each one starts in the next generation.
+        3. The next generation is gathered from a buffer with all the successors concatenated.
+
+        pW :      Axiom, the initial word.
+        pP :      Production rules, same format as in writeLS, or a compiled Grammar.
+        pDepth :  Number of iterations over the string.
+        seed :    Seed for the stochastic rules (see stableRandom). None picks a new one.
+
+        On Exit : Returns exactly the same string as writeLS with the same seed. If NumPy is not available, or the
+                  grammar is parametric or context sensitive, it just calls writeLS.
+    """
+    grammar = compileRules(pP)
+    if numpy is None or grammar.extended:
+        return writeLS(pW, grammar, pDepth, seed=seed)
+    if seed is None:
+        seed = newSeed()
+
+    #--- Successor tables. Successors 0-255 are the bytes themselves, the rules come after them ---#
+    successors = [chr(b) for b in range(256)]
+    firstId = numpy.arange(256, dtype=numpy.int64)
+    stochastic = [] # [byte, first successor id, normalised cumulative weights]
+    for pred, succ in grammar.deterministic.items():
+        if len(pred) == 1:
+            firstId[ord(pred)] = len(successors)
+            successors.append(succ)
+    for pred, (succs, cumulative) in grammar.stochastic.items():
+        if len(pred) == 1:
+            stochastic.append([ord(pred), len(successors), numpy.array(cumulative) / cumulative[-1]])
+            firstId[ord(pred)] = len(successors)
+            successors.extend(succs)
+    succLen = numpy.array([len(succ) for succ in successors], dtype=numpy.int64)
+    succOffset = numpy.concatenate([[0], numpy.cumsum(succLen)[:-1]])
+    succBytes = numpy.frombuffer("".join(successors), dtype=numpy.uint8)
+
+    word = numpy.frombuffer(str(pW), dtype=numpy.uint8)
+    for generation in range(0, pDepth):
+        if len(word) == 0:
+            break
+        ids = firstId[word]
+        if stochastic:
+            # One single draw for the whole generation
+            draws = stableRandomArray(seed, generation, numpy.arange(len(word), dtype=numpy.uint64))
+            for byte, first, cumulative in stochastic:
+                mask = word == byte
+                choice = numpy.searchsorted(cumulative, draws[mask], side="right")
+                ids[mask] = first + numpy.minimum(choice, len(cumulative)-1)
+        lengths = succLen[ids]
+        ends = numpy.cumsum(lengths)
+        total = int(ends[-1])
+        # For every output position: where its successor starts in succBytes plus how far into the successor it is
+        gather = numpy.repeat(succOffset[ids] - (ends - lengths), lengths) + numpy.arange(total, dtype=numpy.int64)
+        word = succBytes[gather]
+    return word.tobytes()
+
+def rewriteGeneration(pW, pP, seed=None, generation=0, startPosition=0):
+    """ Rewrites pW just once (one generation). It is the building block of the parallel mode, so it is kept as simple
+    and quick as possible: deterministic grammars are a single list comprehension.
+
+        seed :           Seed for the stochastic rules (see stableRandom). None picks a new one.
+        generation :     Generation pW belongs to.
+        startPosition :  Position of pW inside that generation, when pW is just a chunk of it.
+    """
+    grammar = compileRules(pP)
+    deterministic = grammar.deterministic
+    if grammar.extended:
+        return rewriteModules(pW, grammar, streamKey(seed if seed is not None else newSeed(), generation), startPosition)
+    if grammar.isDeterministic():
+        return "".join([deterministic.get(c, c) for c in pW])
+    if seed is None:
+        seed = newSeed()
+    key = streamKey(seed, generation)
+    stochastic = grammar.stochastic
+    pieces = []
+    for i in range(0, len(pW)):
+        c = pW[i]
+        successor = deterministic.get(c)
+        if successor is None:
+            successor = grammar.successor(c, streamRandom(key, startPosition+i)) if c in stochastic else c
+        pieces.append(successor)
+    return "".join(pieces)
+
+PARALLEL_MIN_LENGTH = 200000    # Generations shorter than this are not worth sending to other processes
+PARALLEL_MIN_CHUNK = 65536      # Smallest chunk sent to a worker
+
+_workerGrammar = None # Grammar of each worker process, set once by _initWorker instead of being sent with every chunk
+
+def _initWorker(pGrammar):
+    global _workerGrammar
+    _workerGrammar = pGrammar
+
+def _rewriteChunk(pArgs):
+    chunk, seed, generation, startPosition = pArgs
+    return rewriteGeneration(chunk, _workerGrammar, seed, generation, startPosition)
+
+def writeLSParallel(pW, pP, pDepth, workers=None, chunkSize=None, seed=None):
+    """ Same as writeLS but spreading the work over several processes. Every generation long enough is split into chunks
+    which are rewritten by a pool of processes and then stitched back in order (rules are context free, so each chunk
+    can be rewritten independently).
+
+        pW :         Axiom, the initial word.
+        pP :         Production rules, same format as in writeLS, or a compiled Grammar.
+        pDepth :     Number of iterations over the string.
+        workers :    Number of processes. By default as many as CPUs.
+        chunkSize :  Number of characters per chunk. By default each generation is split in about 4 chunks per worker so
+                     that a slow chunk doesn't leave the rest of the workers waiting, but never smaller than
+                     PARALLEL_MIN_CHUNK.
+        seed :       Seed for the stochastic rules (see stableRandom). None picks a new one.
+
+        On Exit : Returns exactly the same string as writeLS with the same seed.
+
+    Bear in mind that inside Maya on Windows multiprocessing launches new processes using sys.executable, so it has to be
+    pointed to mayapy first with multiprocessing.set_executable().
+    """
+    grammar = compileRules(pP)
+    if seed is None:
+        seed = newSeed()
+    if grammar.extended: # Chunks would cut the context of the modules at their ends
+        return writeLS(pW, grammar, pDepth, seed=seed)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = None
+    try:
+        for generation in range(0, pDepth):
+            if workers <= 1 or len(pW) < PARALLEL_MIN_LENGTH:
+                pW = rewriteGeneration(pW, grammar, seed, generation)
+                continue
+            if pool is None:
+                pool = multiprocessing.Pool(workers, _initWorker, (grammar,))
+            size = chunkSize or max(PARALLEL_MIN_CHUNK, len(pW) // (workers*4) + 1)
+            chunks = [(pW[i:i+size], seed, generation, i) for i in range(0, len(pW), size)]
+            pW = "".join(pool.map(_rewriteChunk, chunks))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return pW
+
+#--- SIZE PREDICTION AND BUDGET ---#
+MAX_STRING_LENGTH = 20000000    # Longest string generated before refusing (about 20 MB), None means no limit
+TURTLE_SYMBOLS = "+-&^<>*[]"    # Symbols the interpreter doesn't turn into geometry, apart from leaves and blossoms
+
+class BudgetError(ValueError):
+    """ Raised when a derivation or a plant would go over the allowed budget. """
+    pass
+
+def symbolCounts(pString):
+    """ Counts what the interpreter will build from a string. Returns a dictionary with the 'length' (number of symbols
+    or modules), 'segments', 'leaves' and 'blossoms'. """
+    if isinstance(pString, basestring):
+        if "(" in pString:
+            symbols = "".join([symbol for text, symbol, params in parseModules(pString)])
+        else:
+            symbols = pString
+        turtle = sum([symbols.count(symbol) for symbol in TURTLE_SYMBOLS])
+        leaves = symbols.count("L")
+        blossoms = symbols.count("B")
+        length = len(symbols)
+    elif isinstance(pString, SymbolBuffer) and not pString.hasParams:
+        length = len(pString)
+        turtle = leaves = blossoms = 0
+        for chunk in pString.iterChunks():
+            turtle += sum([chunk.count(symbol) for symbol in TURTLE_SYMBOLS])
+            leaves += chunk.count("L")
+            blossoms += chunk.count("B")
+    else:
+        length = turtle = leaves = blossoms = 0
+        for symbol, params in iterModules(pString):
+            length += 1
+            if symbol == "L":
+                leaves += 1
+            elif symbol == "B":
+                blossoms += 1
+            elif symbol in TURTLE_SYMBOLS:
+                turtle += 1
+    return { "length": length, "segments": length - turtle - leaves - blossoms, "leaves": leaves, "blossoms": blossoms }
+
+def predictGrowth(pW, pP, pDepth):
+    """ Predicts how big the derived string will be at each depth without rewriting anything. Each rule tells how many
+    of each symbol a predecessor turns into, which makes a growth matrix (the Parikh vector of the successor for every
+    predecessor). Multiplying the symbol counts of the axiom by it once per depth gives the counts of every generation.
+    For stochastic rules every successor is weighted by its probability, so we get the expected counts. Conditions of
+    parametric rules and contexts can't be known beforehand, so they are taken as always true and every rule of a
+    symbol is weighted by its probability (the prediction is then just an estimate).
+
+        pW :      Axiom, the initial word.
+        pP :      Production rules, same format as in writeLS, or a compiled Grammar.
+        pDepth :  Number of iterations over the string.
+
+        On Exit : Returns a list with one dictionary per depth (from 0 to pDepth), like the ones from symbolCounts.
+
+        For example:
+            >>> predictGrowth('F', [[100, 'F', 'F[+FL]F']], 3)[-1]
+            {'leaves': 13, 'length': 79, 'segments': 27, 'blossoms': 0}
+            >>>
+    """
+    grammar = compileRules(pP)
+    # matrix[a] is a list of [symbol, expected times] that a becomes in one generation
+    matrix = {}
+    for pred, succ in grammar.deterministic.items():
+        matrix[pred] = symbolCounter(succ).items()
+    for pred, (successors, cumulative) in grammar.stochastic.items():
+        expected = {}
+        previous = 0.0
+        for succ, running in zip(successors, cumulative):
+            weight = (running - previous) / cumulative[-1]
+            previous = running
+            for c, count in symbolCounter(succ).items():
+                expected[c] = expected.get(c, 0) + weight * count
+        matrix[pred] = expected.items()
+    if grammar.extended:
+        for symbol, productions in grammar.productions.items():
+            total = sum([production.probability for production in productions])
+            expected = {}
+            for production in productions:
+                weight = production.probability / total if total > 0 else 1.0 / len(productions)
+                for c, count in production.counts.items():
+                    expected[c] = expected.get(c, 0) + weight * count
+            matrix[symbol] = expected.items()
+        vector = {}
+        for text, symbol, params in parseModules(pW):
+            vector[symbol] = vector.get(symbol, 0) + 1
+    else:
+        vector = symbolCounter(pW)
+
+    prediction = [_summary(vector)]
+    for d in range(0, pDepth):
+        following = {}
+        for symbol, count in vector.items():
+            if symbol in matrix:
+                for c, times in matrix[symbol]:
+                    following[c] = following.get(c, 0) + count * times
+            else:
+                following[symbol] = following.get(symbol, 0) + count
+        vector = following
+        prediction.append(_summary(vector))
+    return prediction
+
+def symbolCounter(pString):
+    """ Dictionary symbol --> how many times it is in pString. """
+    counts = {}
+    for c in pString:
+        counts[c] = counts.get(c, 0) + 1
+    return counts
+
+def _summary(pVector):
+    """ Turns a Parikh vector (dictionary symbol --> count) into the dictionary given by symbolCounts. """
+    def roundCount(value):
+        return int(round(value)) if isinstance(value, float) else value
+    length = sum(pVector.values())
+    turtle = sum([pVector.get(symbol, 0) for symbol in TURTLE_SYMBOLS])
+    leaves = pVector.get("L", 0)
+    blossoms = pVector.get("B", 0)
+    return { "length": roundCount(length), "segments": roundCount(length - turtle - leaves - blossoms),
+        "leaves": roundCount(leaves), "blossoms": roundCount(blossoms) }
+
+def checkBudget(pW, pP, pDepth, maxLength=MAX_STRING_LENGTH):
+    """ Raises a BudgetError if the string predicted for pDepth is longer than maxLength. Otherwise it returns the
+    prediction of the last depth (see predictGrowth). """
+    prediction = predictGrowth(pW, pP, pDepth)[-1]
+    if maxLength is not None and prediction["length"] > maxLength:
+        raise BudgetError("Depth %s would generate about %s symbols, over the budget of %s. Try a lower depth."
+            % (pDepth, prediction["length"], maxLength))
+    return prediction
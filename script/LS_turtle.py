@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""
+    Headless Turtle Module:    <LS_turtle.py>
+
+    This module follows the same turtle conventions as LS_interpreter (see its documentation for the meaning of every
+    symbol), but without touching Maya at all. Instead of creating a cylinder and then asking Maya where its top vertex
+    ended up, the turtle works out every transform itself with double precision rotation matrices. The result is a
+    TurtleResult: a bunch of flat arrays with the start and end of every segment, its orientation, radius and branch level,
+    and the frames of every leaf and blossom.
+
+    As it doesn't need Maya it can be tested, benchmarked or used to export plants from a plain Python interpreter. In
+    Maya, LS_interpreter.createGeometry just commits the result.
+
+    Rotations are kept as Euler angles in degrees (X, then Y, then Z, which is Maya's default rotate order), exactly like
+    createGeometry always did, so that the plants don't change. For every segment we also store the matrix they make.
+"""
+import math
+import re
+from array import array
+
+from LS_string_rewriting import iterModules, stableRandom, newSeed, TURTLE_SYMBOLS, _formatNumber, SymbolBuffer
+
+try:
+    import numpy
+except ImportError: # Optional, only used by TurtleResult.asNumpy
+    numpy = None
+
+def eulerMatrix(rotX, rotY, rotZ):
+    """ Rotation matrix (row-major, 9 floats) of the Euler angles in degrees, rotating first around X, then Y and then Z
+    like Maya does with the default 'xyz' rotate order. Its columns are the local axes of the rotated object, so the
+    second column is the direction a segment grows towards. """
+    a, b, c = math.radians(rotX), math.radians(rotY), math.radians(rotZ)
+    ca, sa = math.cos(a), math.sin(a)
+    cb, sb = math.cos(b), math.sin(b)
+    cc, sc = math.cos(c), math.sin(c)
+    return (cc*cb, cc*sb*sa - sc*ca, cc*sb*ca + sc*sa,
+            sc*cb, sc*sb*sa + cc*ca, sc*sb*ca - cc*sa,
+            -sb,   cb*sa,            cb*ca)
+
+#--- STRAIGHT RUNS ---#
+NOT_FORWARD = TURTLE_SYMBOLS + "LB"  # Every other symbol moves the turtle forward
+_FORWARD_RUN_RE = re.compile(r"[^%s]{2,}" % re.escape(NOT_FORWARD))
+
+def collapseForwardRuns(LStringVar):
+    """ Replaces every run of forward moves in a row (no rotation, branch, leaf or blossom in between, so they are all
+    on the same branch level and point the same way) with a single forward move as long as all of them, F(n). The turtle
+    then leaves one segment where it used to leave n, and the plant looks exactly the same.
+
+    LStringVar :  The L-System-generated string, it may have parameters. It can be a SymbolBuffer too.
+
+    On Exit :     Returns the new string and the number of segments it saves. The new string of a SymbolBuffer is another
+                  SymbolBuffer, filled a batch of pieces at a time, so the collapsed string is never held as a str either.
+
+        >>> collapseForwardRuns("FFF[+FF]FL")
+        ('F(3)[+F(2)]FL', 3)
+        >>> collapseForwardRuns("F(2)F(0.5)+F")
+        ('F(2.5)+F', 1)
+        >>> from LS_string_rewriting import writeLSBuffer
+        >>> symbols, saved = collapseForwardRuns(writeLSBuffer("F", [[100, "F", "FF[+F]"]], 2))
+        >>> str(symbols), saved
+        ('F(2)[+F]F(2)[+F][+F(2)[+F]]', 3)
+    """
+    if isinstance(LStringVar, SymbolBuffer):
+        collapsed = SymbolBuffer(LStringVar.threshold)
+        saved = [0]
+        pieces = []
+        for piece in _collapsePieces(LStringVar, saved):
+            pieces.append(piece)
+            if len(pieces) >= 4096:
+                collapsed.append("".join(pieces))
+                pieces = []
+        collapsed.append("".join(pieces))
+        return collapsed.finish(), saved[0]
+    if not isinstance(LStringVar, basestring):
+        LStringVar = "".join(LStringVar)
+    if "(" in LStringVar:
+        saved = [0]
+        return "".join(_collapsePieces(LStringVar, saved)), saved[0]
+    saved = [0]
+    def collapse(match):
+        run = match.end() - match.start()
+        saved[0] += run - 1
+        return "F(%s)" % run
+    return _FORWARD_RUN_RE.sub(collapse, LStringVar), saved[0]
+
+def _collapsePieces(LStringVar, saved):
+    """ Yields the pieces of the collapsed string of collapseForwardRuns, adding the segments it saves to saved[0]. """
+    if isinstance(LStringVar, SymbolBuffer) and not LStringVar.hasParams:
+        # The regular expression reads the bytes of the buffer where they are
+        position = 0
+        for match in _FORWARD_RUN_RE.finditer(LStringVar.data):
+            start, end = match.span()
+            if start > position:
+                yield LStringVar[position:start]
+            yield "F(%s)" % (end - start)
+            saved[0] += end - start - 1
+            position = end
+        if position < len(LStringVar):
+            yield LStringVar[position:]
+        return
+    run = count = 0
+    for symbol, params in iterModules(LStringVar):
+        if symbol not in NOT_FORWARD:
+            run += params[0] if params else 1
+            count += 1
+            continue
+        if count:
+            yield "F" if count == 1 and run == 1 else "F(%s)" % _formatNumber(run)
+            saved[0] += count - 1
+            run = count = 0
+        if params:
+            yield "%s(%s)" % (symbol, ",".join([_formatNumber(param) for param in params]))
+        else:
+            yield symbol
+    if count:
+        yield "F" if count == 1 and run == 1 else "F(%s)" % _formatNumber(run)
+        saved[0] += count - 1
+
+class BracketError(ValueError):
+    """ Raised when the brackets of the string don't match. """
+    pass
+
+class TurtleState(object):
+    """ What the turtle keeps on the stack when it opens a branch. """
+    __slots__ = ("posX", "posY", "posZ", "rotX", "rotY", "rotZ", "lastSegment", "position")
+
+class TurtleStack(object):
+    """ The stack of states of the turtle. The states are created once and reused, so that pushing and popping only
+    copies a few numbers and moves the index of the top. It grows when the branches are deeper than it has room for.
+
+        >>> stack = TurtleStack()
+        >>> stack.push(0, 1, 2, 0, 0, 25, -1, 3)
+        >>> stack.pop(5).rotZ
+        25
+        >>> stack.pop(6)
+        Traceback (most recent call last):
+        ...
+        BracketError: Unbalanced brackets: the ']' at position 6 closes a branch that was never opened.
+    """
+    def __init__(self, size=64):
+        self.states = [TurtleState() for i in range(size)]
+        self.depth = 0
+
+    def push(self, posX, posY, posZ, rotX, rotY, rotZ, lastSegment, position):
+        if self.depth == len(self.states):
+            self.states.extend([TurtleState() for i in range(len(self.states))])
+        state = self.states[self.depth]
+        state.posX, state.posY, state.posZ = posX, posY, posZ
+        state.rotX, state.rotY, state.rotZ = rotX, rotY, rotZ
+        state.lastSegment = lastSegment
+        state.position = position
+        self.depth += 1
+
+    def pop(self, position):
+        """ Returns the state on top of the stack. It stays valid until the next push. """
+        if self.depth == 0:
+            raise BracketError("Unbalanced brackets: the ']' at position %s closes a branch that was never opened."
+                % position)
+        self.depth -= 1
+        return self.states[self.depth]
+
+    def checkEmpty(self):
+        """ Raises a BracketError if any branch was left open. """
+        if self.depth:
+            raise BracketError("Unbalanced brackets: %s '[' never closed, the first one at position %s."
+                % (self.depth, self.states[0].position))
+
+class TurtleResult(object):
+    """ Everything the turtle leaves behind. Points and angles are stored flat, three values per item (x, y, z), in
+    arrays of doubles, which take far less memory than lists of tuples and can be wrapped by NumPy without copying.
+
+        segmentStart, segmentEnd :  Position where each segment starts and ends.
+        segmentRotation :           Euler rotation of each segment (degrees).
+        segmentMatrix :             Rotation matrix of each segment, 9 values each (see eulerMatrix).
+        segmentLength :             Length of each segment, atenuation already applied.
+        segmentRadius :             Radius of each segment, atenuation already applied.
+        segmentStep :               Length of each segment before the atenuation.
+        segmentLevel :              Branch level of each segment.
+        segmentParent :             Index of the segment each one starts from, or -1 for the ones that start at the origin.
+        leafPosition, leafRotation, leafSpin, leafScale, leafLevel :
+                                    Position, rotation (the one of the last segment), extra random rotation, scale and
+                                    branch level of each leaf.
+        blossomPosition, blossomRotation, blossomScale, blossomLevel :
+                                    Same for the blossoms.
+    """
+    def __init__(self):
+        self.segmentStart = array("d")
+        self.segmentEnd = array("d")
+        self.segmentRotation = array("d")
+        self.segmentMatrix = array("d")
+        self.segmentLength = array("d")
+        self.segmentRadius = array("d")
+        self.segmentStep = array("d")
+        self.segmentLevel = array("i")
+        self.segmentParent = array("i")
+        self.leafPosition = array("d")
+        self.leafRotation = array("d")
+        self.leafSpin = array("d")
+        self.leafScale = array("d")
+        self.leafLevel = array("i")
+        self.blossomPosition = array("d")
+        self.blossomRotation = array("d")
+        self.blossomScale = array("d")
+        self.blossomLevel = array("i")
+
+    def segmentCount(self):
+        return len(self.segmentLevel)
+
+    def leafCount(self):
+        return len(self.leafLevel)
+
+    def blossomCount(self):
+        return len(self.blossomLevel)
+
+    def asNumpy(self, pName):
+        """ Returns one of the arrays as a NumPy array without copying it. Points and angles come as (n, 3) arrays and
+        matrices as (n, 3, 3). """
+        values = numpy.frombuffer(getattr(self, pName), dtype=numpy.float64 if getattr(self, pName).typecode == "d"
+            else numpy.intc)
+        if pName == "segmentMatrix":
+            return values.reshape(-1, 3, 3)
+        if pName in ("segmentStart", "segmentEnd", "segmentRotation", "leafPosition", "leafRotation", "leafSpin",
+                     "blossomPosition", "blossomRotation"):
+            return values.reshape(-1, 3)
+        return values
+
+def interpretTurtle(LStringVar, pRad, pStep, pAngle, length_atenuation, radius_atenuation, seed=None):
+    """ Moves the turtle over the string and records all the geometry it would create, without creating it.
+
+    LStringVar :          The L-System-generated string (or an LRope, or anything yielding its characters).
+    pRad :                The radius of the segments left by each turtle's step.
+    pStep :               The length of the segments left by each turtle's step.
+    pAngle :              The turtle will yaw, roll or pitch by this angular amount each time it finds its corresponding
+                          symbol.
+    length_atenuation :   Segments are this fraction (0-1) shorter per branch level.
+    radius_atenuation :   Segments are this fraction (0-1) thinner per branch level.
+    seed :                Seed for the slight random rotation of the leaves, the same as in createGeometry.
+
+    On Exit :  Returns a TurtleResult. If the brackets don't match it raises a BracketError with the position of the
+               culprit, counting symbols (a symbol with parameters, like F(2), is only one).
+    """
+    if seed is None:
+        seed = newSeed()
+    result = TurtleResult()
+
+    posX = posY = posZ = 0.0
+    rotX = rotY = rotZ = 0.0
+    lastSegment = -1                # Segment the turtle is standing on
+    lastSegmentRot = (0.0, 0.0, 0.0)  # Rotation of the last segment created, leaves and blossoms take it
+    indexBranch = 0
+    stack = TurtleStack()
+
+    rotationLeaves = 0
+    leafNum = 1
+
+    for position, (symbol, params) in enumerate(iterModules(LStringVar)):
+        angle = params[0] if params else pAngle
+        if symbol == "+":
+            rotX += angle
+        elif symbol == "-":
+            rotX -= angle
+        elif symbol == "&":
+            rotZ += angle
+        elif symbol == "^":
+            rotZ -= angle
+        elif symbol == "<":
+            rotY += angle
+        elif symbol == ">":
+            rotY -= angle
+        elif symbol == "*":
+            rotX += 180
+
+        elif symbol == "B":
+            result.blossomPosition.extend((posX, posY, posZ))
+            result.blossomRotation.extend(lastSegmentRot)
+            result.blossomScale.append(pRad * 0.95**(indexBranch+1))
+            result.blossomLevel.append(indexBranch)
+
+        elif symbol == "L":
+            result.leafPosition.extend((posX, posY, posZ))
+            result.leafRotation.extend(lastSegmentRot)
+            result.leafSpin.extend((rotationLeaves%48, rotationLeaves, rotationLeaves%15))
+            result.leafScale.append(pRad * 0.5 * 0.85**(indexBranch+1))
+            result.leafLevel.append(indexBranch)
+            # (generation -1 so that it never matches the random numbers used by the rewriting with the same seed)
+            rotationLeaves += int(stableRandom(seed, -1, leafNum) * 721)
+            leafNum += 1
+
+        elif symbol == "[":
+            stack.push(posX, posY, posZ, rotX, rotY, rotZ, lastSegment, position)
+            indexBranch += 1
+
+        elif symbol == "]":
+            state = stack.pop(position)
+            indexBranch -= 1
+            posX, posY, posZ = state.posX, state.posY, state.posZ
+            rotX, rotY, rotZ = state.rotX, state.rotY, state.rotZ
+            lastSegment = state.lastSegment
+
+        else:
+            step = pStep*params[0] if params else pStep
+            length = step * length_atenuation**(indexBranch+1)
+            matrix = eulerMatrix(rotX, rotY, rotZ)
+            result.segmentStart.extend((posX, posY, posZ))
+            posX += matrix[1] * length
+            posY += matrix[4] * length
+            posZ += matrix[7] * length
+            result.segmentEnd.extend((posX, posY, posZ))
+            lastSegmentRot = (rotX, rotY, rotZ)
+            result.segmentRotation.extend(lastSegmentRot)
+            result.segmentMatrix.extend(matrix)
+            result.segmentLength.append(length)
+            result.segmentRadius.append(pRad * radius_atenuation**(indexBranch+1))
+            result.segmentStep.append(step)
+            result.segmentLevel.append(indexBranch)
+            result.segmentParent.append(lastSegment)
+            lastSegment = result.segmentCount() - 1
+    stack.checkEmpty()
+    return result
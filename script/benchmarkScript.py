@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+    Benchmark Script                             <benchmarkScript.py>
+
+    Times the different rewriting engines of LS_string_rewriting on the shipped presets, outside Maya. For every preset it
+    runs the single-threaded writeLS and then writeLSParallel with an increasing number of workers, so that we can see how
+    well the parallel mode scales. Run it from a terminal:
+
+        python benchmarkScript.py --extra-depth 3 --workers 1,2,4,8
+
+    Presets are derived at their own depth plus --extra-depth, otherwise they are far too small to be worth parallelising.
+"""
+import sys
+import time
+import argparse
+import multiprocessing
+
+import presets
+from LS_string_rewriting import *
+
+def timeIt(function, *args, **kwargs):
+    """ Calls function and returns a 2-item list: the seconds it took and its result. """
+    start = time.time()
+    result = function(*args, **kwargs)
+    return [time.time() - start, result]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling curve of writeLSParallel against writeLS on the presets.")
+    parser.add_argument("--extra-depth", type=int, default=3, help="Depth added to the one of each preset.")
+    parser.add_argument("--workers", default=None,
+        help="Comma separated worker counts to try (1,2,4... up to the number of CPUs by default).")
+    parser.add_argument("--presets", default="1,2,3,4", help="Comma separated preset numbers.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the stochastic presets, the same for every engine.")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        workerCounts = [int(w) for w in args.workers.split(",")]
+    else:
+        workerCounts = [1]
+        while workerCounts[-1]*2 <= multiprocessing.cpu_count():
+            workerCounts.append(workerCounts[-1]*2)
+
+    for number in [int(n) for n in args.presets.split(",")]:
+        preset = presets.presetGrammars[number]
+        depth = preset["depth"] + args.extra_depth
+        # The same seed for both, otherwise the stochastic presets would give strings of different lengths
+        serialTime, serialResult = timeIt(writeLS, preset["axiom"], preset["rules"], depth, seed=args.seed)
+        print "Preset %s (depth %s, %s symbols)" % (number, depth, len(serialResult))
+        print "    %-12s %10.3fs" % ("writeLS", serialTime)
+        for workers in workerCounts:
+            parallelTime, result = timeIt(writeLSParallel, preset["axiom"], preset["rules"], depth, workers=workers,
+                seed=args.seed)
+            assert result == serialResult, "writeLSParallel gave a different string than writeLS"
+            print "    %-12s %10.3fs   x%.2f" % ("%s workers" % workers, parallelTime, serialTime / max(parallelTime, 1e-9))
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+    Export Script                                <exportScript.py>
+
+    Makes a plant and writes it to an OBJ or binary PLY file without Maya (see LS_export). The grammar and the geometric
+    parameters are the ones of a preset, and any of them can be changed. Run it from a terminal:
+
+        python exportScript.py plant.ply --preset 1 --depth 6 --seed 42 --mode tubes
+        python exportScript.py plant.obj --axiom F --rule "100,F,F[+F]F[-F]F" --depth 4
+
+    Attenuations are percentages, as in the interface.
+"""
+import sys
+import time
+import argparse
+
+import presets
+from LS_string_rewriting import writeLSBuffer, checkBudget, newSeed
+from LS_cache import cachedWriteLS
+from LS_turtle import interpretTurtle, collapseForwardRuns
+from LS_mesh import LODPolicy
+from LS_export import exportMesh
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Makes an L-System plant and exports it to OBJ or PLY, without Maya.")
+    parser.add_argument("output", help="File to write, .obj or .ply.")
+    parser.add_argument("--preset", type=int, default=1, help="Preset the rest of the values are taken from.")
+    parser.add_argument("--axiom", help="Axiom, instead of the preset's.")
+    parser.add_argument("--rule", action="append", help="Production rule as 'probability,predecessor,successor', "
+        "instead of the preset's. Can be repeated.")
+    parser.add_argument("--depth", type=int, help="Depth, instead of the preset's.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed, 0 picks one.")
+    parser.add_argument("--angle", type=float)
+    parser.add_argument("--length", type=float)
+    parser.add_argument("--radius", type=float)
+    parser.add_argument("--subdivs", type=int)
+    parser.add_argument("--length-atenuation", type=float)
+    parser.add_argument("--radius-atenuation", type=float)
+    parser.add_argument("--mode", choices=["merged", "tubes"], default="merged", help="Cylinders or continuous tubes.")
+    parser.add_argument("--lod", action="store_true", help="Adaptive detail for the branches.")
+    parser.add_argument("--poly-budget", type=int, help="Polygon budget of the branches, with --lod.")
+    parser.add_argument("--no-props", action="store_true", help="Don't export leaves and blossoms.")
+    parser.add_argument("--no-cache", action="store_true", help="Derive the string even if it is in the cache.")
+    args = parser.parse_args(argv)
+
+    values = dict(presets.presetGrammars[args.preset])
+    for key in ("axiom", "depth", "angle", "length", "radius", "length_atenuation", "radius_atenuation"):
+        if getattr(args, key) is not None:
+            values[key] = getattr(args, key)
+    if args.subdivs is not None:
+        values["cylSubdivs"] = args.subdivs
+    if args.rule:
+        values["rules"] = [rule.split(",", 2) for rule in args.rule]
+    seed = args.seed or newSeed()
+
+    start = time.time()
+    checkBudget(values["axiom"], values["rules"], values["depth"])
+    if args.no_cache:
+        # One byte per symbol, memory-mapped if it gets big, and read in place by collapseForwardRuns
+        LStringVar = writeLSBuffer(values["axiom"], values["rules"], values["depth"], seed=seed)
+    else:
+        LStringVar = cachedWriteLS(values["axiom"], values["rules"], values["depth"], seed=seed,
+            compact=True)
+    LStringVar, saved = collapseForwardRuns(LStringVar)
+    turtle = interpretTurtle(LStringVar, values["radius"], values["length"], values["angle"],
+        values["length_atenuation"]/100.0, values["radius_atenuation"]/100.0, seed)
+    print "Seed %s: %s segments (%s merged), %s leaves, %s blossoms (%.2fs)" % (seed, turtle.segmentCount(), saved,
+        turtle.leafCount(), turtle.blossomCount(), time.time() - start)
+
+    start = time.time()
+    lod = LODPolicy(values["cylSubdivs"], polygonBudget=args.poly_budget) if args.lod else None
+    vertices, faces = exportMesh(turtle, args.output, values["cylSubdivs"], args.mode, lod, not args.no_props)
+    print "%s: %s vertices, %s faces (%.2fs)" % (args.output, vertices, faces, time.time() - start)
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
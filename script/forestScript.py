@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+    Forest Script                                <forestScript.py>
+
+    Makes many variants of the same plant at once, one per seed, and writes every one of them to its own OBJ or PLY file
+    (see LS_export), without Maya. The variants are shared out over a pool of processes, each of them doing the whole
+    pipeline for its plant: rewriting, turtle and export. Next to the meshes goes a manifest.json with the parameters used
+    and, for every variant, its file, counts and timings. Run it from a terminal:
+
+        python forestScript.py forest --preset 3 --seeds 1-200 --depth 5
+        python forestScript.py forest --grammar bush.json --seeds 1,7,42 --format obj --mode tubes
+
+    A grammar file is a JSON object with the same keys as the entries of presets.presetGrammars, any of which can be left
+    out to take it from --preset. Attenuations are percentages, as in the interface.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import multiprocessing
+
+import presets
+from LS_string_rewriting import writeLSBuffer, checkBudget
+from LS_cache import cachedWriteLS
+from LS_turtle import interpretTurtle, collapseForwardRuns
+from LS_mesh import LODPolicy
+from LS_export import exportMesh
+
+MANIFEST = "manifest.json"
+
+def parseSeeds(pText):
+    """ Turns a list of seeds like '1-5,9' into a list of ints.
+
+        >>> parseSeeds("1-5,9")
+        [1, 2, 3, 4, 5, 9]
+    """
+    seeds = []
+    for item in pText.split(","):
+        item = item.strip()
+        if "-" in item[1:]:
+            first, last = item.split("-", 1)
+            seeds.extend(range(int(first), int(last) + 1))
+        elif item:
+            seeds.append(int(item))
+    return seeds
+
+def buildVariant(pJob):
+    """ Makes one plant and writes it, in a worker process.
+
+    pJob :     Dictionary with the 'values' of the plant (like an entry of presets.presetGrammars), its 'seed', the
+               'fileName' to write and the 'mode', 'lod', 'polyBudget', 'props' and 'cache' options.
+
+    On Exit :  Returns the entry of the variant in the manifest. If the plant can't be made the entry has an 'error'
+               instead of the counts, so that one bad seed doesn't stop the forest.
+    """
+    values = pJob["values"]
+    seed = pJob["seed"]
+    entry = { "seed": seed, "file": os.path.basename(pJob["fileName"]) }
+    try:
+        start = time.time()
+        checkBudget(values["axiom"], values["rules"], values["depth"])
+        if pJob["cache"]:
+            LStringVar = cachedWriteLS(values["axiom"], values["rules"], values["depth"], seed=seed,
+                compact=True)
+        else:
+            LStringVar = writeLSBuffer(values["axiom"], values["rules"], values["depth"], seed=seed)
+        entry["symbols"] = len(LStringVar)
+        entry["deriveTime"] = time.time() - start
+
+        start = time.time()
+        LStringVar, saved = collapseForwardRuns(LStringVar)
+        turtle = interpretTurtle(LStringVar, values["radius"], values["length"], values["angle"],
+            values["length_atenuation"]/100.0, values["radius_atenuation"]/100.0, seed)
+        entry["turtleTime"] = time.time() - start
+
+        start = time.time()
+        lod = None
+        if pJob["lod"]:
+            lod = LODPolicy(values["cylSubdivs"], polygonBudget=pJob["polyBudget"])
+        entry["vertices"], entry["faces"] = exportMesh(turtle, pJob["fileName"], values["cylSubdivs"], pJob["mode"], lod,
+            pJob["props"])
+        entry["exportTime"] = time.time() - start
+    except (ValueError, MemoryError), e: # Over the budget, unbalanced brackets, rules that can't be understood...
+        entry["error"] = str(e) or e.__class__.__name__
+        return entry
+    entry["segments"] = turtle.segmentCount()
+    entry["merged"] = saved
+    entry["leaves"] = turtle.leafCount()
+    entry["blossoms"] = turtle.blossomCount()
+    return entry
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Makes many variants of an L-System plant, one per seed, and exports "
+        "each of them to OBJ or PLY, without Maya.")
+    parser.add_argument("output", help="Folder the meshes and the manifest are written to, created if needed.")
+    parser.add_argument("--preset", type=int, default=1, help="Preset the values are taken from.")
+    parser.add_argument("--grammar", help="JSON file with the axiom, rules, depth... instead of the preset's.")
+    parser.add_argument("--seeds", default="1-10", help="Seeds of the variants, as in '1-100,205'.")
+    parser.add_argument("--depth", type=int, help="Depth, instead of the grammar's.")
+    parser.add_argument("--format", choices=["ply", "obj"], default="ply", help="Format of the meshes.")
+    parser.add_argument("--mode", choices=["merged", "tubes"], default="merged", help="Cylinders or continuous tubes.")
+    parser.add_argument("--lod", action="store_true", help="Adaptive detail for the branches.")
+    parser.add_argument("--poly-budget", type=int, help="Polygon budget of the branches of every variant, with --lod.")
+    parser.add_argument("--no-props", action="store_true", help="Don't export leaves and blossoms.")
+    parser.add_argument("--no-cache", action="store_true", help="Derive the strings even if they are in the cache.")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes, as many as CPUs by default.")
+    args = parser.parse_args(argv)
+
+    values = dict(presets.presetGrammars[args.preset])
+    if args.grammar:
+        with open(args.grammar) as grammarFile:
+            values.update(json.load(grammarFile))
+    if args.depth is not None:
+        values["depth"] = args.depth
+    values["axiom"] = str(values["axiom"])
+    values["rules"] = [[float(prob), str(pred), str(succ)] for prob, pred, succ in values["rules"]]
+    seeds = parseSeeds(args.seeds)
+    if not seeds:
+        parser.error("No seeds given.")
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    jobs = []
+    for seed in seeds:
+        jobs.append({ "values": values, "seed": seed, "mode": args.mode, "lod": args.lod, "polyBudget": args.poly_budget,
+                      "props": not args.no_props, "cache": not args.no_cache,
+                      "fileName": os.path.join(args.output, "plant_%s.%s" % (seed, args.format)) })
+
+    start = time.time()
+    entries = []
+    pool = multiprocessing.Pool(args.processes or multiprocessing.cpu_count())
+    try:
+        # Every process writes its own file, only the manifest entries come back
+        for entry in pool.imap_unordered(buildVariant, jobs):
+            entries.append(entry)
+            if "error" in entry:
+                print "[%s/%s] Seed %s failed: %s" % (len(entries), len(jobs), entry["seed"], entry["error"])
+            else:
+                print "[%s/%s] %s: %s segments, %s leaves, %s blossoms, %s faces (%.2fs)" % (len(entries), len(jobs),
+                    entry["file"], entry["segments"], entry["leaves"], entry["blossoms"], entry["faces"],
+                    entry["deriveTime"] + entry["turtleTime"] + entry["exportTime"])
+            sys.stdout.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    totalTime = time.time() - start
+
+    entries.sort(key=lambda entry: entry["seed"])
+    manifest = { "grammar": values, "mode": args.mode, "format": args.format, "lod": args.lod,
+                 "polyBudget": args.poly_budget, "props": not args.no_props, "totalTime": totalTime,
+                 "variants": entries }
+    with open(os.path.join(args.output, MANIFEST), "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=2, sort_keys=True)
+    failed = len([entry for entry in entries if "error" in entry])
+    print "%s variants written to %s, %s failed (%.2fs)" % (len(entries) - failed, args.output, failed, totalTime)
+
+if __name__ == "__main__":
+    main()
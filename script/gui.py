@@ -9,14 +9,27 @@
         Instructions and Presets:     Quick guide for the users.
         Rules:                        Setting the predecessor, successor and probability for the rule to happen.
         Geometric interpretation:     Attributes and parameters for the geometry.
+        Scatter:                      Many instances of a few plants, for a forest.
         Warnings and helpline:        Self-explanatory.
 
 """
 
 import maya.cmds as cmds
+import maya.utils
 import pydoc
+import threading
 from LS_string_rewriting import *
 from LS_interpreter import *
+from LS_session import PlantSession
+from LS_cache import cachedWriteLS
+from LS_scatter import scatterOnPlane, scatterOnPoints
+
+LSession = PlantSession() # Remembers the last plant, so that changes don't start from scratch
+LStringVar = ""           # The whole generated string. The output field only shows the beginning of it
+LSeedVar = None
+LGeneration = None        # The StringGeneration running in the background, if any
+
+OUTPUT_PREVIEW = 2000     # Symbols of the string shown in the output field, more than that makes the field crawl
 
 __author__ = "Ramon Blanquer Ruiz"
 __version__ = "1.0.0"
@@ -117,7 +130,14 @@ def createUI():
     #--- Depth ---#
     cmds.rowColumnLayout( numberOfColumns=1, columnWidth=[(1, 406)], parent=rulesLayout )
     cmds.intSliderGrp( "depthIntField", l="Depth: ", v=4, cw3=[40,30,350], min=1, max=10, fmx=20, f=True,
-        ann="Set the index of recursion. The number of iterations over the generated string. How many times do you want to seach and replace chars in the string?" )
+        ann="Set the index of recursion. The number of iterations over the generated string. How many times do you want to seach and replace chars in the string?",
+        cc=predictButtonAction )
+
+    #--- Seed ---#
+    cmds.rowColumnLayout( numberOfColumns=2, columnWidth=[(1, 43), (2, 80)], parent=rulesLayout )
+    cmds.text( l="Seed ", align="right" )
+    cmds.intField( "seedIntField", v=0, min=0,
+        ann="Seed for the stochastic rules and the rotation of the leaves. The same seed always gives the same plant. Leave it at 0 to get a different one every time." )
 
     #--- Probabilities header ---#
     cmds.rowColumnLayout( numberOfColumns=3, cal=[(1,"right")], columnWidth=[(1,325),(2,50),(3,45)], parent=rulesLayout )
@@ -130,7 +150,7 @@ def createUI():
 
      #--- RULE 1 ---#
     cmds.text( l="Rule 1: ", en=True )
-    cmds.textField( "prodRulePred1", en=True, tx="F", ann="Enter predecessor string for production rule 1. If this character is found in the string it will be replaced." )
+    cmds.textField( "prodRulePred1", en=True, tx="F", ann="Enter predecessor string for production rule 1. If this character is found in the string it will be replaced. It can also be parametric, A(l): l>1, or context sensitive, B<A>C." )
     cmds.text( l="->", en=True )
     cmds.textField( "prodRuleSucc1", en=True, tx="F[&+F]F[->FL][&FB]", ann="Enter successor string for production rule 1. The value you want to replace the predecessor with." )
     cmds.intField( "prodRuleProb1", minValue=0, maxValue=100, value=100,
@@ -219,15 +239,21 @@ def createUI():
             cmds.intField( "prodRuleProb4", edit=True, v=0 )
     cmds.checkBox( "prodRuleCheckBox4", edit=True, changeCommand=toggleGreyingOut4 )
 
-    #--- Generate String / Clear String  ---#
-    cmds.rowColumnLayout( numberOfColumns=3, columnWidth=[(1,196), (2,10), (3,196)], parent=rulesLayout )
-    cmds.button( l="Generate String", ann="Click to run the L-System string procedure.", c=generateStringButtonAction )
+    #--- Generate String / Predict Size / Clear String  ---#
+    cmds.rowColumnLayout( numberOfColumns=5, columnWidth=[(1,130), (2,6), (3,130), (4,6), (5,130)], parent=rulesLayout )
+    cmds.button( "generateStringButton", l="Generate String", ann="Click to run the L-System string procedure.",
+        c=generateStringButtonAction )
+    cmds.separator( h=5, st="none" )
+    cmds.button( l="Predict Size", ann="Click to know how big the string and the plant will be, without generating them.",
+        c=predictButtonAction )
     cmds.separator( h=5, st="none" )
     cmds.button( l="Clear String", ann="Click to reset the generated string", command=clearStringButtonAction )
+    cmds.rowColumnLayout( numberOfColumns=1, columnWidth=[(1, 402)], parent=rulesLayout )
+    cmds.text( "predictionText", l="", align="left" )
 
     #--- String Output ---#
     cmds.rowColumnLayout( numberOfColumns=1, columnWidth=[(1, 402)], parent=rulesLayout )
-    cmds.textField( "output", editable=True, ann="This is the generated string. When you get it proceed to construct the geometry.")
+    cmds.textField( "output", editable=False, ann="This is the beginning of the generated string and what it will build. When you get it proceed to construct the geometry.")
     cmds.rowColumnLayout( numberOfColumns=1, columnWidth=[(1, 402)], parent=mainFrame )
     cmds.separator( h=5, st='none' )
 
@@ -250,6 +276,27 @@ def createUI():
         ann="Next's index branch's segment's radius will be (this field) percent the length of the previous one." )
     cmds.floatSliderGrp( "turtleSpeed", l="Turtle speed: ", v=0, cw3=[92,40,288], min=0, max=1, pre=2, fmx=5, f=True,
         ann="Before proceeding to the next turtle command it will be frozen for this amount of time (in seconds). Useful for keeping track of everything that happens." )
+    cmds.optionMenu( "branchMode", l="Branches: ", ann="All the branches in a single mesh, as cylinders or as continuous tubes, a mesh per branch level, or one cylinder per segment (slow, every segment can be picked)." )
+    cmds.menuItem( l="Merged" )
+    cmds.menuItem( l="Tubes" )
+    cmds.menuItem( l="Per Level" )
+    cmds.menuItem( l="Segments" )
+    cmds.checkBox( "collapseCheckBox", l="Merge straight runs", value=True,
+        ann="Forward moves in a row become a single longer segment. The plant looks the same with fewer segments." )
+    cmds.rowColumnLayout( numberOfColumns=3, columnWidth=[(1,150), (2,100), (3,150)], parent=mInterpret )
+    cmds.checkBox( "lodCheckBox", l="Adaptive detail", value=False,
+        ann="Thinner segments get fewer subdivisions, the thinnest ones are built as cards if the polygon budget asks for it." )
+    cmds.text( l="Polygon budget: " )
+    cmds.intField( "polyBudgetField", v=0, min=0, ann="Most polygons the branches of a plant may have with adaptive detail on. 0 means no limit." )
+    cmds.rowColumnLayout( numberOfColumns=6, columnWidth=[(1,130), (2,45), (3,60), (4,60), (5,60), (6,40)], parent=mInterpret )
+    cmds.checkBox( "progressiveCheckBox", l="Progressive build", value=False,
+        ann="Shows the plant while it is being built, with a progress bar. Press Esc to stop it." )
+    cmds.text( l="Every " )
+    cmds.intField( "chunkSizeField", v=500, min=0, ann="Objects built between refreshes of the viewport. 0 means only by time." )
+    cmds.text( l="objects or " )
+    cmds.intField( "chunkTimeField", v=250, min=0, ann="Milliseconds between refreshes of the viewport. 0 means only by objects." )
+    cmds.text( l=" ms" )
+    cmds.rowColumnLayout( numberOfColumns=1, columnWidth=[(1,406)], parent=mInterpret )
     cmds.separator( h=2, st="none" )
 
     #--- Colour Fields ---#
@@ -261,10 +308,38 @@ def createUI():
     cmds.colorSliderGrp('rgb_blossomField', l="Blossoms", rgb=(0.624,0,0), cw3=[52,30,328], ann="Blossoms colour." )
 
     #--- Create Geometry / Clean Plant ---#
-    cmds.rowColumnLayout( numberOfColumns=3, columnWidth=[(1,196), (2,10), (3,196)], parent=mInterpret )
+    cmds.rowColumnLayout( numberOfColumns=5, columnWidth=[(1,130), (2,8), (3,130), (4,8), (5,130)], parent=mInterpret )
     cmds.button( l="Create Geometry", command=createGeometryButtonAction, ann="Go turtle! Go!" )
     cmds.separator( h=5, st="none" )
+    cmds.button( l="Update Plant", command=updatePlantButtonAction,
+        ann="Changes the last plant to match the fields, moving it into place when only the geometric parameters changed." )
+    cmds.separator( h=5, st="none" )
     cmds.button( l="Clean Plant", command=cleanPlantButtonAction, ann='Deletes the lastest generated plant.' )
+    cmds.rowColumnLayout( numberOfColumns=1, columnWidth=[(1, 402)], parent=mainFrame )
+    cmds.separator( h=5, st='none' )
+
+    #///////////////////////////////////////////////////SCATTER////////////////////////////////////////////////////////////#
+    mScatter = cmds.frameLayout( label = "Scatter", collapsable=True, cl=True, mw = 10, mh = 10, w=425 )
+    cmds.rowColumnLayout( numberOfColumns=6, columnWidth=[(1,70), (2,60), (3,70), (4,60), (5,80), (6,60)], parent=mScatter )
+    cmds.text( l="Prototypes: " )
+    cmds.intField( "scatterPrototypesField", v=4, min=1,
+        ann="Number of different plants built, each with its own seed. The instances are copies of them." )
+    cmds.text( l="Instances: " )
+    cmds.intField( "scatterCountField", v=1000, min=1, ann="Number of plants placed on the ground." )
+    cmds.text( l="Min. distance: " )
+    cmds.floatField( "scatterDistanceField", v=5, min=0, pre=2, ann="The plants are kept at least this far from each other. 0 lets them overlap." )
+    cmds.text( l="Width: " )
+    cmds.floatField( "scatterWidthField", v=200, min=0, pre=1, ann="Size of the ground along X." )
+    cmds.text( l="Depth: " )
+    cmds.floatField( "scatterDepthField", v=200, min=0, pre=1, ann="Size of the ground along Z." )
+    cmds.text( l="Scale: " )
+    cmds.floatFieldGrp( "scatterScaleField", nf=2, v1=0.8, v2=1.2, pre=2, cw2=[30,30],
+        ann="Every plant is scaled by a random amount between these two." )
+    cmds.rowColumnLayout( numberOfColumns=2, columnWidth=[(1,276), (2,130)], parent=mScatter )
+    cmds.checkBox( "scatterOnSelectionCheckBox", l="On the vertices of the selected mesh", value=False,
+        ann="Places a plant on every vertex of the selected object instead of scattering them over the ground." )
+    cmds.button( l="Scatter Plants", command=scatterButtonAction,
+        ann="Builds the prototypes with the rules and fields above, and places instances of them. The scene only grows with the number of prototypes." )
 
     #/////////////////////////////////////WARNINGS//AND//HELPLINE//////////////////////////////////////////////////////////#
     cmds.rowColumnLayout( numberOfColumns=3, columnWidth=[(1,55), (2, 5), (3, 366)], parent=mainFrame )
@@ -282,52 +357,143 @@ def createUI():
 
 #////////////////////////////////////////////BUTTON//ACTIONS///////////////////////////////////////////////////////////////#
 #--- GENERATE STRING ---#
-def generateStringButtonAction(*pArgs):
-    ''' Queries all the fields related to the string generation and calls the procedure. '''
-    pAxiom = cmds.textField( "axiomTextField", q=True, tx=True )
-
+def queryRules():
+    """ Queries the axiom, the active production rules and the depth from the interface. """
+    pAxiom = str(cmds.textField( "axiomTextField", q=True, tx=True ))
     pP = []
-
-    prodRuleProb1 = str(cmds.intField( "prodRuleProb1", q=True, v=True ))
-    prodRulePred1 = str(cmds.textField( "prodRulePred1", q=True, tx=True ))
-    prodRuleSucc1 = str(cmds.textField("prodRuleSucc1", q=True, tx=True))
-
-    prodRuleCheckBox2 = cmds.checkBox( "prodRuleCheckBox2", q=True, value=True )
-    prodRuleProb2 = str(cmds.intField( "prodRuleProb2", q=True, v=True ))
-    prodRulePred2 = str(cmds.textField( "prodRulePred2", q=True, tx=True ))
-    prodRuleSucc2 = str(cmds.textField("prodRuleSucc2", q=True, tx=True))
-
-    prodRuleCheckBox3 = cmds.checkBox( "prodRuleCheckBox3", q=True, value=True )
-    prodRuleProb3 = str(cmds.intField( "prodRuleProb3", q=True, v=True ))
-    prodRulePred3 = str(cmds.textField( "prodRulePred3", q=True, tx=True ))
-    prodRuleSucc3 = str(cmds.textField("prodRuleSucc3", q=True, tx=True))
-
-    prodRuleCheckBox4 = cmds.checkBox( "prodRuleCheckBox4", q=True, value=True )
-    prodRuleProb4 = str(cmds.intField( "prodRuleProb4", q=True, v=True ))
-    prodRulePred4 = str(cmds.textField( "prodRulePred4", q=True, tx=True ))
-    prodRuleSucc4 = str(cmds.textField("prodRuleSucc4", q=True, tx=True))
-
-    pP.append([prodRuleProb1, prodRulePred1, prodRuleSucc1])
-    if prodRuleCheckBox2 == True:
-        pP.append([prodRuleProb2, prodRulePred2, prodRuleSucc2]) 
-    if prodRuleCheckBox3 == True:
-        pP.append([prodRuleProb3, prodRulePred3, prodRuleSucc3]) 
-    if prodRuleCheckBox4 == True:
-        pP.append([prodRuleProb4, prodRulePred4, prodRuleSucc4])
-
+    for i in range(1, 5):
+        if i == 1 or cmds.checkBox( "prodRuleCheckBox%s" % i, q=True, value=True ):
+            prodRuleProb = str(cmds.intField( "prodRuleProb%s" % i, q=True, v=True ))
+            prodRulePred = str(cmds.textField( "prodRulePred%s" % i, q=True, tx=True ))
+            prodRuleSucc = str(cmds.textField( "prodRuleSucc%s" % i, q=True, tx=True ))
+            pP.append([prodRuleProb, prodRulePred, prodRuleSucc])
     pDepth = cmds.intSliderGrp( "depthIntField", q=True, v=True )
-
-    # This bit makes sure the sum of all probabilities is 100.
-    if prodRulePred1 == prodRulePred2 or prodRulePred1 == prodRulePred3 or prodRulePred1 == prodRulePred4 or prodRulePred2 == prodRulePred3 or prodRulePred2 == prodRulePred4 or prodRulePred3 == prodRulePred4:
-        probSum = int(prodRuleProb1) + int(prodRuleProb2) + int(prodRuleProb3) + int(prodRuleProb4)
-        if probSum == 100 or ((prodRulePred1 != prodRulePred2) or (prodRulePred1 != prodRulePred3) or (prodRulePred1 != prodRulePred4) or (prodRulePred2 != prodRulePred3) or (prodRulePred2 != prodRulePred4) or (prodRulePred3 != prodRulePred4)):
-            global LStringVar
-            LStringVar = writeLS(pAxiom, pP, pDepth)
-            cmds.textField( "output", edit=True, tx=LStringVar )
-            cmds.textField( "warningsTextField", edit=True, tx="None" )
-        else:
+    return pAxiom, pP, pDepth
+
+def checkProbabilities(pP):
+    """ Makes sure the probabilities of the rules sharing a predecessor add up to 100. If they don't, it says so in the
+    warnings field and returns False. """
+    probSums = {}
+    for prob, pred, succ in pP:
+        probSums.setdefault(pred, []).append(float(prob))
+    for pred, probs in probSums.items():
+        if len(probs) > 1 and abs(sum(probs) - 100) > 1e-6:
             cmds.textField( "warningsTextField", edit=True, tx="Be careful with percentages. They don't add to 100." )
-            cmds.textField( "output", edit=True, tx="ERROR. Take a look at the warning text line." )
+            return False
+    return True
+
+def generateStringButtonAction(*pArgs):
+    ''' Queries all the fields related to the string generation and starts it in the background (see StringGeneration). '''
+    pAxiom, pP, pDepth = queryRules()
+    pSeed = cmds.intField( "seedIntField", q=True, v=True )
+    chosenSeed = pSeed != 0
+    if pSeed == 0:
+        pSeed = newSeed()
+
+    if not checkProbabilities(pP):
+        cmds.textField( "output", edit=True, tx="ERROR. Take a look at the warning text line." )
+        return
+
+    global LGeneration
+    if LGeneration is not None:
+        cmds.textField( "warningsTextField", edit=True, tx="Still generating the last string, please wait." )
+        return
+    try:
+        predictButtonAction()
+        checkBudget(pAxiom, pP, pDepth)
+        expected = predictGrowth(pAxiom, pP, pDepth)[-1]["length"]
+        # A random derivation with a seed nobody knows is never asked for again, it would only push useful ones out of
+        # the cache. Deterministic ones don't depend on the seed, so they are still worth keeping.
+        cached = chosenSeed or compileRules(pP).isDeterministic()
+    except ValueError, e: # Over the budget, or parametric / context sensitive rules that can't be understood
+        cmds.textField( "warningsTextField", edit=True, tx=str(e) )
+        return
+    cmds.textField( "output", edit=True, tx="Generating..." )
+    cmds.button( "generateStringButton", edit=True, en=False )
+    LGeneration = StringGeneration(pAxiom, pP, pDepth, pSeed, expected, cached)
+    LGeneration.start()
+
+class StringGeneration(threading.Thread):
+    """ Derives a string in the background, so that Maya doesn't freeze while a deep plant is rewritten. Maya commands
+    can only be run from the main thread, so the progress and the result are handed to it with maya.utils.executeDeferred.
+
+        pExpected :  Predicted length of the string, to tell how far it has got.
+        cached :     Whether the string is taken from and stored in the disk cache.
+    """
+    def __init__(self, pAxiom, pP, pDepth, pSeed, pExpected, cached=True):
+        threading.Thread.__init__(self, name="LSystemStringGeneration")
+        self.daemon = True
+        self.args = (pAxiom, pP, pDepth, pSeed)
+        self.expected = max(pExpected, 1)
+        self.cached = cached
+        self.shown = 0      # Symbols derived last time the progress was shown
+        self.error = None
+
+    def progress(self, pSize):
+        # Every percent is enough, the main thread has better things to do
+        if pSize - self.shown >= self.expected / 100.0:
+            self.shown = pSize
+            maya.utils.executeDeferred(showGenerationProgress, pSize, self.expected)
+
+    def run(self):
+        result = None
+        pAxiom, pP, pDepth, pSeed = self.args
+        try:
+            # The session reuses the strings of the other depths, or takes it from the disk if it was derived before
+            LStringVar = LSession.derive(pAxiom, pP, pDepth, seed=pSeed, progress=self.progress, cached=self.cached)
+            result = LStringVar, symbolCounts(LStringVar)
+        except ValueError, e:
+            self.error = str(e)
+        finally:
+            maya.utils.executeDeferred(finishGeneration, self, result)
+
+def showGenerationProgress(pSize, pExpected):
+    """ Shows how much of the string has been generated, in the output field. """
+    if LGeneration is not None:
+        percent = min(99, int(100.0 * pSize / pExpected)) # The prediction is an average for stochastic rules
+        cmds.textField( "output", edit=True, tx="Generating... %s%% (%s symbols)" % (percent, pSize) )
+
+def finishGeneration(pGeneration, pResult):
+    """ Keeps the string the background generation made and shows it, or what went wrong. """
+    global LGeneration, LStringVar, LSeedVar
+    LGeneration = None
+    cmds.button( "generateStringButton", edit=True, en=True )
+    if pResult is None:
+        cmds.textField( "output", edit=True, tx="ERROR. Take a look at the warning text line." )
+        cmds.textField( "warningsTextField", edit=True,
+            tx=pGeneration.error or "The string could not be generated, see the Script Editor." )
+        return
+    LStringVar, counts = pResult
+    LSeedVar = pGeneration.args[3] # Kept for createGeometry, so that the leaves are rotated the same way for the same seed
+    cmds.textField( "output", edit=True, tx=stringPreview(LStringVar, counts) )
+    cmds.textField( "warningsTextField", edit=True, tx="None" )
+
+def stringPreview(pLString, counts):
+    """ What the output field shows of a string: what it will build and its first OUTPUT_PREVIEW symbols. A textField
+    with megabytes of text in it takes ages to draw. """
+    preview = str(pLString[:OUTPUT_PREVIEW])
+    if len(pLString) > OUTPUT_PREVIEW:
+        preview += "..."
+    return "%s symbols, %s segments, %s leaves, %s blossoms: %s" % (counts["length"], counts["segments"], counts["leaves"],
+        counts["blossoms"], preview)
+
+#--- PREDICT SIZE ACTION ---#
+def predictButtonAction(*pArgs):
+    """ Shows how big the string and the plant will be before generating anything. """
+    pAxiom, pP, pDepth = queryRules()
+    try:
+        prediction = predictGrowth(pAxiom, pP, pDepth)[-1]
+    except ValueError, e:
+        cmds.text( "predictionText", edit=True, l=str(e) )
+        return
+    text = "Depth %s: %s symbols, %s segments, %s leaves, %s blossoms" % (pDepth, prediction["length"],
+        prediction["segments"], prediction["leaves"], prediction["blossoms"])
+    nodes = prediction["segments"] + prediction["leaves"] + prediction["blossoms"]
+    if MAX_STRING_LENGTH is not None and prediction["length"] > MAX_STRING_LENGTH:
+        text += " (too long!)"
+    elif MAX_SCENE_NODES is not None and nodes > MAX_SCENE_NODES:
+        text += " (too many objects!)"
+    cmds.text( "predictionText", edit=True, l=text )
 
 #--- CLEAR STRING BUTTON ACTION ---#
 def clearStringButtonAction(*pArgs):
@@ -335,38 +501,201 @@ def clearStringButtonAction(*pArgs):
     cmds.textField( "output", edit=True, tx="" )
 
 #--- GENERATE GEOMETRY ACTION ---#
-def createGeometryButtonAction(*pArgs):
-    """ Queries all the fields related to the geometry interpretation and calls the procedure. """
-    pAngle = cmds.floatSliderGrp( "angle", q=True, v=True )
-    pStep = cmds.floatSliderGrp( "length", q=True, v=True )
-    pRad = cmds.floatSliderGrp( "radius", q=True, v=True )
-    subDivs = cmds.intSliderGrp( "cylSubdivs", q=True, v=True )
-    length_atenuation = cmds.intSliderGrp( "length_atenuation", q=True, v=True )
-    radius_atenuation = cmds.intSliderGrp( "radius_atenuation", q=True, v=True )
-    turtleSpeed = cmds.floatSliderGrp( "turtleSpeed", q=True, v=True)
-    rgb_blossom = cmds.colorSliderGrp( "rgb_blossomField", q=True, rgb=True )
-    rgb_leaf = cmds.colorSliderGrp( "rgb_leafField", q=True, rgb=True )
-    rgb_branch = cmds.colorSliderGrp( "rgb_branchField", q=True, rgb=True )
-
-    if pAngle == 0 or pStep == 0 or pRad == 0 or subDivs == 0 or LStringVar == '':
-        cmds.textField('warningsTextField', edit=True, tx='Please, revise all the fields again')  
+def queryGeometry():
+    """ Queries all the fields related to the geometry interpretation. Returns them in a dictionary, with the
+    atenuations as fractions (0-1). """
+    geo = {}
+    geo["pAngle"] = cmds.floatSliderGrp( "angle", q=True, v=True )
+    geo["pStep"] = cmds.floatSliderGrp( "length", q=True, v=True )
+    geo["pRad"] = cmds.floatSliderGrp( "radius", q=True, v=True )
+    geo["subDivs"] = cmds.intSliderGrp( "cylSubdivs", q=True, v=True )
+    geo["length_atenuation"] = cmds.intSliderGrp( "length_atenuation", q=True, v=True ) / 100.0
+    geo["radius_atenuation"] = cmds.intSliderGrp( "radius_atenuation", q=True, v=True ) / 100.0
+    geo["turtleSpeed"] = cmds.floatSliderGrp( "turtleSpeed", q=True, v=True)
+    geo["rgb_blossom"] = cmds.colorSliderGrp( "rgb_blossomField", q=True, rgb=True )
+    geo["rgb_leaf"] = cmds.colorSliderGrp( "rgb_leafField", q=True, rgb=True )
+    geo["rgb_branch"] = cmds.colorSliderGrp( "rgb_branchField", q=True, rgb=True )
+    geo["mode"] = {"Merged": "merged", "Tubes": "tubes", "Per Level": "levels",
+                   "Segments": "segments"}[cmds.optionMenu( "branchMode", q=True, v=True )]
+    geo["collapse"] = cmds.checkBox( "collapseCheckBox", q=True, value=True )
+    geo["chunkSize"] = geo["chunkTime"] = None
+    if cmds.checkBox( "progressiveCheckBox", q=True, value=True ):
+        geo["chunkSize"] = cmds.intField( "chunkSizeField", q=True, v=True ) or None
+        geo["chunkTime"] = cmds.intField( "chunkTimeField", q=True, v=True ) or None
+    geo["lod"] = None
+    if cmds.checkBox( "lodCheckBox", q=True, value=True ):
+        polyBudget = cmds.intField( "polyBudgetField", q=True, v=True )
+        geo["lod"] = LODPolicy(geo["subDivs"], polygonBudget=polyBudget or None)
+    return geo
+
+def interpretSession(geo):
+    """ Runs the turtle of the session (only if something changed) and checks the plant is not over the budget. Returns
+    the TurtleResult, or None after writing what went wrong in the warnings field. """
+    if LGeneration is not None:
+        cmds.textField('warningsTextField', edit=True, tx='Still generating the string, please wait.')
+        return None
+    if geo["pAngle"] == 0 or geo["pStep"] == 0 or geo["pRad"] == 0 or geo["subDivs"] == 0 or not LStringVar:
+        cmds.textField('warningsTextField', edit=True, tx='Please, revise all the fields again')
+        return None
+    try:
+        turtle = LSession.interpret(geo["pRad"], geo["pStep"], geo["pAngle"], geo["length_atenuation"],
+            geo["radius_atenuation"], geo["collapse"])
+        checkNodeBudget(turtle, mode=geo["mode"]) # Before creating anything, so nothing is left behind
+    except (BudgetError, BracketError), e:
+        cmds.textField('warningsTextField', edit=True, tx=str(e))
+        return None
+    if LSession.saved:
+        cmds.textField('warningsTextField', edit=True, tx='None. Merging straight runs saved %s segments.' % LSession.saved)
     else:
-        import globalVar
-        reload(globalVar)
-        globalVar.plantNumber += 1
         cmds.textField('warningsTextField', edit=True, tx='None.')
-        createBranchShader(rgb_branch)
-        createLeafShader(rgb_leaf)
-        createBlossomShader(rgb_blossom)
-        createGeometry(LStringVar, pRad, pStep, pAngle, subDivs, length_atenuation/100.0, radius_atenuation/100.0,
-            turtleSpeed, rgb_branch, rgb_leaf, rgb_blossom)
+    return turtle
+
+def buildSessionPlant(geo, turtle, built=None):
+    """ Builds the plant of the session with the current plant number, or again in the group and with the materials of
+    what was built before if built (see createGeometry) is given. The turtle must have gone through interpretSession,
+    which already checked the budget. """
+    plantName = shaderNumber = None
+    if built is not None:
+        plantName, shaderNumber = built["plant"], built["shaderNumber"]
+    finished = createGeometry(LSession.LStringTurtle, geo["pRad"], geo["pStep"], geo["pAngle"], geo["subDivs"],
+        geo["length_atenuation"], geo["radius_atenuation"], geo["turtleSpeed"], geo["rgb_branch"], geo["rgb_leaf"],
+        geo["rgb_blossom"], seed=LSeedVar, maxNodes=None, mode=geo["mode"], turtle=turtle, lod=geo["lod"],
+        chunkSize=geo["chunkSize"], chunkTime=geo["chunkTime"], session=LSession, shaderNumber=shaderNumber,
+        plantName=plantName)
+    if not finished:
+        cmds.textField('warningsTextField', edit=True, tx='The plant was cancelled, it is only half built.')
 
+def createGeometryButtonAction(*pArgs):
+    """ Queries all the fields related to the geometry interpretation and calls the procedure. """
+    geo = queryGeometry()
+    turtle = interpretSession(geo)
+    if turtle is None:
+        return
+    import globalVar
+    reload(globalVar)
+    globalVar.plantNumber += 1
+    createBranchShader(geo["rgb_branch"])
+    createLeafShader(geo["rgb_leaf"])
+    createBlossomShader(geo["rgb_blossom"])
+    buildSessionPlant(geo, turtle)
+
+#--- UPDATE PLANT ACTION ---#
+def updatePlantButtonAction(*pArgs):
+    """ Changes the last plant to match the string and the fields. If only the geometric parameters changed the plant is
+    just moved into place, otherwise it is built again inside the same group, with the same materials. """
+    import globalVar
+    reload(globalVar)
+    geo = queryGeometry()
+    built = LSession.built
+    if built is None or not cmds.objExists(built["plant"]):
+        createGeometryButtonAction()
+        return
+    sameDetail = built["mode"] == geo["mode"] and built["subDivs"] == geo["subDivs"]
+    if geo["lod"] is None or built["lod"] is None:
+        sameDetail = sameDetail and geo["lod"] is built["lod"]
+    else:
+        sameDetail = sameDetail and geo["lod"].polygonBudget == built["lod"].polygonBudget
+    turtle = interpretSession(geo)
+    if turtle is None:
+        return
+    if sameDetail and updatePlant(LSession):
+        cmds.textField('warningsTextField', edit=True, tx='None. The plant was updated in place.')
+        return
+    children = cmds.listRelatives( built["plant"], children=True, fullPath=True )
+    if children:
+        cmds.delete( children )
+    buildSessionPlant(geo, turtle, built)
 
 #--- CLEAN ACTION ---#
 def cleanPlantButtonAction(*pArgs):
-    """ Will delete the last plant that has been generated. """
+    """ Will delete the last plant that has been generated, or the last scatter. """
     import globalVar
     reload(globalVar)
     
-    cmds.select( "plant"+str(globalVar.plantNumber) )
-    cmds.delete()
+    for name in ("plant"+str(globalVar.plantNumber), "scatter"+str(globalVar.plantNumber)):
+        if cmds.objExists( name ):
+            cmds.select( name )
+            cmds.delete()
+
+#--- SCATTER ACTION ---#
+def scatterButtonAction(*pArgs):
+    """ Builds a few prototype plants with the rules and the geometric fields, each with its own seed, and scatters
+    instances of them (see LS_scatter and LS_interpreter.createScatter). The prototypes share one set of materials. """
+    if LGeneration is not None:
+        cmds.textField( "warningsTextField", edit=True, tx="Still generating the string, please wait." )
+        return
+    pAxiom, pP, pDepth = queryRules()
+    if not checkProbabilities(pP):
+        return
+    geo = queryGeometry()
+    if geo["pAngle"] == 0 or geo["pStep"] == 0 or geo["pRad"] == 0 or geo["subDivs"] == 0:
+        cmds.textField( "warningsTextField", edit=True, tx="Please, revise all the fields again" )
+        return
+    pSeed = cmds.intField( "seedIntField", q=True, v=True )
+    chosenSeed = pSeed != 0
+    if pSeed == 0:
+        pSeed = newSeed()
+    prototypeCount = cmds.intField( "scatterPrototypesField", q=True, v=True )
+    scaleRange = cmds.floatFieldGrp( "scatterScaleField", q=True, v=True )[:2]
+
+    # Where the instances go is worked out first, as building the prototypes changes the selection
+    if cmds.checkBox( "scatterOnSelectionCheckBox", q=True, value=True ):
+        selection = cmds.ls( sl=True, o=True )
+        if not selection:
+            cmds.textField( "warningsTextField", edit=True, tx="Select the mesh the plants have to be placed on." )
+            return
+        points = cmds.xform( selection[0]+".vtx[*]", q=True, ws=True, t=True )
+        scatter = scatterOnPoints(points, prototypeCount, seed=pSeed, scaleRange=scaleRange)
+    else:
+        scatter = scatterOnPlane(cmds.intField( "scatterCountField", q=True, v=True ), prototypeCount,
+            cmds.floatField( "scatterWidthField", q=True, v=True ), cmds.floatField( "scatterDepthField", q=True, v=True ),
+            seed=pSeed, minDistance=cmds.floatField( "scatterDistanceField", q=True, v=True ), scaleRange=scaleRange)
+
+    # Every prototype is worked out before anything is built, so that nothing is left behind if one of them is wrong
+    turtles = []
+    try:
+        checkBudget(pAxiom, pP, pDepth)
+        cached = chosenSeed or compileRules(pP).isDeterministic() # See generateStringButtonAction
+        for k in range(prototypeCount):
+            if cached:
+                LStringVar = cachedWriteLS(pAxiom, pP, pDepth, seed=pSeed+k, compact=True)
+            else:
+                LStringVar = writeLSBuffer(pAxiom, pP, pDepth, seed=pSeed+k)
+            if geo["collapse"]:
+                LStringVar, saved = collapseForwardRuns(LStringVar)
+            turtle = interpretTurtle(LStringVar, geo["pRad"], geo["pStep"], geo["pAngle"], geo["length_atenuation"],
+                geo["radius_atenuation"], pSeed+k)
+            checkNodeBudget(turtle, mode=geo["mode"])
+            turtles.append((LStringVar, turtle))
+    except ValueError, e: # Over the budget, unbalanced brackets, or rules that can't be understood
+        cmds.textField( "warningsTextField", edit=True, tx=str(e) )
+        return
+
+    import globalVar
+    reload(globalVar)
+    globalVar.plantNumber += 1
+    shaderNumber = globalVar.plantNumber
+    createBranchShader(geo["rgb_branch"])
+    createLeafShader(geo["rgb_leaf"])
+    createBlossomShader(geo["rgb_blossom"])
+    # The budget of every prototype was checked above, so createGeometry doesn't check it again (maxNodes=None).
+    # The prototypes are named after the scatter instead of taking plant numbers, so that Clean Plant and Update Plant
+    # never reach a plant the instances depend on
+    prototypes = []
+    for k, (LStringVar, turtle) in enumerate(turtles):
+        prototypes.append('plant%s_%s' % (shaderNumber, k+1))
+        lod = None
+        if geo["lod"] is not None: # fit() only ever lowers the detail, so every prototype needs a policy of its own
+            lod = LODPolicy(geo["lod"].maxSubDivs, geo["lod"].minSubDivs, polygonBudget=geo["lod"].polygonBudget)
+        finished = createGeometry(LStringVar, geo["pRad"], geo["pStep"], geo["pAngle"], geo["subDivs"],
+            geo["length_atenuation"], geo["radius_atenuation"], 0, geo["rgb_branch"], geo["rgb_leaf"], geo["rgb_blossom"],
+            seed=pSeed+k, maxNodes=None, mode=geo["mode"], turtle=turtle, lod=lod, chunkSize=geo["chunkSize"],
+            chunkTime=geo["chunkTime"], shaderNumber=shaderNumber, plantName=prototypes[-1])
+        if not finished:
+            cmds.textField( "warningsTextField", edit=True, tx="The scatter was cancelled while building the prototypes." )
+            return
+    if not createScatter(prototypes, scatter, 'scatter'+str(shaderNumber), geo["chunkSize"], geo["chunkTime"]):
+        cmds.textField( "warningsTextField", edit=True, tx="The scatter was cancelled, only some plants were placed." )
+        return
+    cmds.textField( "warningsTextField", edit=True, tx="None. %s instances of %s plants (%s)." % (scatter.count(),
+        prototypeCount, ", ".join([str(count) for count in scatter.prototypeCounts(prototypeCount)])) )
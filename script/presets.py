@@ -6,8 +6,23 @@
     are inspired by The Algorithmic Beaute of Plants (Astrid Lindenmayer and Przemyslaw Prusinkiewicz) and from internet 
     sites such as Hung-Wen Chen's one (http://www.nbb.cornell.edu/neurobio/land/OldStudentProjects/cs490-94to95/hwchen/), I
     tweaked some of them to get more interesting results, and now it looks better.
+
+    Besides the classes that fill the user interface, the same presets are stored as plain data in presetGrammars so that
+    the tools which run outside Maya (benchmarks, batch scripts...) can use them too.
 '''
 
+presetGrammars = {
+    1: { "axiom": 'F', "depth": 4, "rules": [[100, 'F', 'F[&+F]F[->FL][&FB]']],
+         "angle": 28, "length": 1.20, "radius": 0.20, "cylSubdivs": 5, "length_atenuation": 95, "radius_atenuation": 85 },
+    2: { "axiom": 'F', "depth": 3, "rules": [[70, 'F', 'F[+FL][-FB][&FL][^FB]F'], [30, 'F', '[-FL]F[F[-FB-&&>F][&>F]]']],
+         "angle": 25.7, "length": 3.32, "radius": 0.50, "cylSubdivs": 6, "length_atenuation": 90, "radius_atenuation": 70 },
+    3: { "axiom": 'S', "depth": 6, "rules": [[33, 'S', 'S[>>&&FL][>>^^FL]S'], [33, 'S', 'S[-FL]F[S[-F-FB-&&>S][&>F][+S]]'],
+                                            [34, 'S', 'S[+S[-FB][&>S]]']],
+         "angle": 26.5, "length": 1.20, "radius": 0.20, "cylSubdivs": 8, "length_atenuation": 94, "radius_atenuation": 86 },
+    4: { "axiom": 'F', "depth": 4, "rules": [[100, 'F', 'F+R++R-F--FF-R+'], [100, 'R', '-F+RR++R+F--F-R']],
+         "angle": 60, "length": 2, "radius": 0.39, "cylSubdivs": 8, "length_atenuation": 77, "radius_atenuation": 80 },
+}
+
 class preset1:
     def __init__(*args):
         ''' Edits all the fields related to the string generation and calls the procedure. ''' 
@@ -78,6 +78,16 @@ class findPathWindow:
         import copy
         import LS_string_rewriting
         reload(LS_string_rewriting)
+        import LS_cache
+        reload(LS_cache)
+        import LS_turtle
+        reload(LS_turtle)
+        import LS_mesh
+        reload(LS_mesh)
+        import LS_session
+        reload(LS_session)
+        import LS_scatter
+        reload(LS_scatter)
         import LS_interpreter
         reload(LS_interpreter)
         import gui